@@ -1,17 +1,28 @@
 from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, PlainTextResponse
 import base64
 import json
+import logging
 from io import BytesIO
 import pandas as pd
 import requests
-from specialized_only import analyze_real_estate_document_json
-from standard_only import analyze_real_estate_document
+from pipeline import analyze, analyze_stream, analyze_batch, analysis_response, run_blocking, BATCH_CONCURRENCY, BATCH_MAX_CONCURRENCY, BATCH_MAX_DOCUMENTS
+from fanout import ANALYSIS_FANOUT
+from ingestion import load_checklist, is_url
+from storage import is_storage_ref, check_ref, start_prewarm, StorageRefError
+from triage import TriageError
+from llm_client import close_async_client
+from sse import event_stream, SSE_HEADERS
+from jobs import job_manager, QueueFullError
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 from reportlab.lib.units import mm
-from reportlab.pdfbase.pdfmetrics import stringWidth
+from text_layout import TextLayout, iter_pages, lines_per_page
+from observability import configure_logging, RequestMetricsMiddleware, REGISTRY, METRICS_CONTENT_TYPE, ANALYSIS_TIMINGS, start_timings, span
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
@@ -23,6 +34,21 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(RequestMetricsMiddleware)  # Request ids and HTTP metrics
+
+def describe_input(content):
+    """An input as logged: the URL or storage reference, or only the size of inline content"""
+    if is_url(content) or is_storage_ref(content):
+        return content
+    return f"<{len(content)} characters of inline content>" if content else "<none>"
+
+def check_inputs(*contents):
+    """Answer 400 to inputs referencing a storage bucket outside the allowlist"""
+    try:
+        for content in contents:
+            check_ref(content)
+    except StorageRefError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 # Text to PDF conversion function
 def text_to_pdf(text, max_width=170*mm):
@@ -30,35 +56,20 @@ def text_to_pdf(text, max_width=170*mm):
     c = canvas.Canvas(buffer, pagesize=A4)  # Create a canvas for the PDF
     width, height = A4                      # Get the dimensions of the A4 page
     x_margin, y_margin = 20*mm, 20*mm       # Set margins
-    y = height - y_margin                   # Start drawing from the top
-    c.setFont("Helvetica", 11)              # Set the font for the PDF
-
-    # Function to wrap lines of text to fit within the specified width
-    def wrap_line(line, font_name="Helvetica", font_size=11):
-        words = line.split()  # Split the line into words
-        lines = []
-        current_line = ""
-        for word in words:
-            test_line = f"{current_line} {word}".strip()  # Test the current line with the new word
-            if stringWidth(test_line, font_name, font_size) <= max_width:
-                current_line = test_line  # If it fits, add the word to the current line
-            else:
-                lines.append(current_line)  # If it doesn't fit, save the current line
-                current_line = word  # Start a new line with the current word
-        if current_line:
-            lines.append(current_line)  # Add the last line if it exists
-        return lines
-
-    # Iterate through each line of the text
-    for raw_line in text.split("\n"):
-        wrapped_lines = wrap_line(raw_line)  # Wrap the line to fit the page
-        for line in wrapped_lines:
-            if y < y_margin:                    # Check if we need to start a new page
-                c.showPage()                    # Create a new page
-                c.setFont("Helvetica", 11)      # Reset the font
-                y = height - y_margin           # Reset the y position
-            c.drawString(x_margin, y, line)     # Draw the line on the PDF
-            y -= 14                             # Move down for the next line
+    leading = 14                            # Space between lines
+
+    # Wrap the lines to fit within the specified width, measuring each word once
+    layout = TextLayout(max_width, "Helvetica", 11)
+
+    # Draw the pages as the wrapped lines come
+    for number, page in enumerate(iter_pages(layout.wrap(text), lines_per_page(height, y_margin, leading))):
+        if number:
+            c.showPage()                    # Create a new page
+        c.setFont("Helvetica", 11)          # Set the font for the page
+        y = height - y_margin               # Start drawing from the top
+        for line in page:
+            c.drawString(x_margin, y, line) # Draw the line on the PDF
+            y -= leading                    # Move down for the next line
 
     c.save()        # Save the PDF to the buffer
     buffer.seek(0)  # Move to the beginning of the buffer
@@ -71,56 +82,195 @@ async def analyze_document(request: dict):
         pdf_content = request.get("pdf_content")
         checklist_content = request.get("checklist_content")
         api_key = request.get("api_key", "")
+        bypass_cache = bool(request.get("bypass_cache", False))
+        timings = start_timings() if request.get("timings", ANALYSIS_TIMINGS) else None
+        fanout = bool(request.get("fanout", ANALYSIS_FANOUT))
         
         if not pdf_content or not checklist_content:
             raise HTTPException(
                 status_code=400, 
                 detail="Missing required parameters: pdf_content and checklist_content are required"
             )
+        check_inputs(pdf_content, checklist_content)
         
         # Log the request parameters
-        print(f"Received analyze request for PDF: {pdf_content}")
-        print(f"Checklist content: {checklist_content}")
-        print(f"API key provided: {bool(api_key)}")
+        logger.info("Received analyze request for PDF: %s, checklist: %s, API key provided: %s",
+                    describe_input(pdf_content), describe_input(checklist_content), bool(api_key))
         
-        # Call the specialized analysis function
-        result = analyze_real_estate_document_json(
-            pdf_content,
-            checklist_content,
-            api_key
-        )
-        
-        # Call the standard analysis function
-        result_summary = analyze_real_estate_document(
-            pdf_content,
-            checklist_content,
-            api_key
-        )
+        # Run the specialized and standard analyses concurrently, off the event loop
+        result, result_summary, triage = await analyze(pdf_content, checklist_content, api_key, use_cache=not bypass_cache, fanout=fanout)
 
         # Check if specialized analysis was successful
         if not result.get("success", False):
             error_msg = result.get("error", "Unknown error in specialized document analysis")
-            print(f"Specialized analysis failed: {error_msg}")
+            logger.error("Specialized analysis failed: %s", error_msg)
             raise HTTPException(status_code=500, detail=error_msg)
             
         # # Check if standard analysis was successful
         if not result_summary.get("success", False):
             error_msg = result_summary.get("error", "Unknown error in standard document analysis")
-            print(f"Standard analysis failed: {error_msg}")
+            logger.warning("Standard analysis failed: %s", error_msg)
             # We'll continue even if standard analysis fails
 
-        print("Analysis completed successfully")
+        logger.info("Analysis completed successfully")
         
-        # Return both results
-        return {
-            "json_output": result.get("json_output", {}),
-            "standard_report": result_summary.get("standard_report", "") if result_summary.get("success", False) else ""
-        }        
+        # Return both results, with where the time went when it was asked for
+        response = analysis_response(result, result_summary, triage)
+        if timings is not None:
+            response["timings"] = timings.to_dict()
+        return response
         
+    except HTTPException:
+        raise
+    except TriageError as e:
+        # Rejected before any AI call: tell the client why, with what triage measured
+        raise HTTPException(status_code=422, detail=e.to_detail())
+    except Exception as e:
+        logger.exception("Error in analyze endpoint: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/analyze/stream")
+async def analyze_document_stream(request: dict):
+    """
+    Streaming variant of /analyze, answering with Server-Sent Events
+
+    Sends "stage" events as the inputs are downloaded and parsed, "token" events
+    with the pieces of both reports as the AI writes them, then a "result" event
+    with the same content as the /analyze response, or an "error" event.
+    """
+    pdf_content = request.get("pdf_content")
+    checklist_content = request.get("checklist_content")
+    api_key = request.get("api_key", "")
+    bypass_cache = bool(request.get("bypass_cache", False))
+
+    if not pdf_content or not checklist_content:
+        raise HTTPException(
+            status_code=400,
+            detail="Missing required parameters: pdf_content and checklist_content are required"
+        )
+    check_inputs(pdf_content, checklist_content)
+
+    logger.info("Received streamed analyze request for PDF: %s", describe_input(pdf_content))
+
+    return StreamingResponse(
+        event_stream(analyze_stream(pdf_content, checklist_content, api_key, use_cache=not bypass_cache)),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+@app.post("/analyze/batch")
+async def analyze_documents_batch(request: dict):
+    """
+    Analyze many PDFs against one checklist
+
+    The checklist is loaded once, then the documents are analyzed `concurrency`
+    at a time. Results are streamed as NDJSON, one line per document in the
+    order they finish, and a last line with the counts of the batch. A failed
+    document is reported on its line without stopping the others.
+    """
+    pdf_contents = request.get("pdf_contents")
+    checklist_content = request.get("checklist_content")
+    api_key = request.get("api_key", "")
+    bypass_cache = bool(request.get("bypass_cache", False))
+
+    if not isinstance(pdf_contents, list) or not pdf_contents or not all(pdf_contents) or not checklist_content:
+        raise HTTPException(
+            status_code=400,
+            detail="Missing required parameters: pdf_contents (a list of PDFs) and checklist_content are required"
+        )
+    if len(pdf_contents) > BATCH_MAX_DOCUMENTS:
+        raise HTTPException(status_code=400, detail=f"Too many documents in one batch (at most {BATCH_MAX_DOCUMENTS})")
+    try:
+        concurrency = min(max(int(request.get("concurrency", BATCH_CONCURRENCY)), 1), BATCH_MAX_CONCURRENCY)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="concurrency must be an integer")
+    check_inputs(checklist_content, *pdf_contents)
+
+    logger.info("Received batch analyze request for %d PDFs, concurrency %d", len(pdf_contents), concurrency)
+
+    # A checklist that cannot be loaded fails the whole batch before anything is streamed
+    try:
+        checklist = await run_blocking(load_checklist, checklist_content)
     except Exception as e:
-        print(f"Error in analyze endpoint: {str(e)}")
+        logger.error("Error loading the batch checklist: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
+    async def ndjson_lines():
+        succeeded = 0
+        async for item in analyze_batch(pdf_contents, checklist, api_key, use_cache=not bypass_cache, concurrency=concurrency):
+            succeeded += item["success"]
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+        yield json.dumps({"summary": {"documents": len(pdf_contents), "succeeded": succeeded, "failed": len(pdf_contents) - succeeded}}) + "\n"
+
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+@app.post("/jobs", status_code=202)
+async def submit_job(request: dict):
+    """
+    Queue an analysis and return its job id right away
+
+    Takes the same request as /analyze. The job is then followed with
+    GET /jobs/{job_id} or GET /jobs/{job_id}/events.
+    """
+    pdf_content = request.get("pdf_content")
+    checklist_content = request.get("checklist_content")
+    api_key = request.get("api_key", "")
+    bypass_cache = bool(request.get("bypass_cache", False))
+
+    if not pdf_content or not checklist_content:
+        raise HTTPException(
+            status_code=400,
+            detail="Missing required parameters: pdf_content and checklist_content are required"
+        )
+    check_inputs(pdf_content, checklist_content)
+
+    try:
+        job = job_manager.submit({
+            "pdf_content": pdf_content,
+            "checklist_content": checklist_content,
+            "api_key": api_key,
+            "use_cache": not bypass_cache,
+            "fanout": bool(request.get("fanout", ANALYSIS_FANOUT)),
+        })
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+
+    logger.info("Queued job %s for PDF: %s", job.id, describe_input(pdf_content))
+
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/jobs/{job.id}",
+        "events_url": f"/jobs/{job.id}/events"
+    }
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status of a job, with its result once it succeeded"""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown or expired job: {job_id}")
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}/events")
+async def follow_job(job_id: str):
+    """
+    Server-Sent Events following a job: a "status" event on each change, then
+    "result" or "error" when it finishes
+    """
+    if job_manager.get(job_id) is None:
+        raise HTTPException(status_code=404, detail=f"Unknown or expired job: {job_id}")
+
+    async def job_events():
+        async for job in job_manager.watch(job_id):
+            yield "status", {"job_id": job.id, "status": job.status, "stage": job.stage}
+            if job.result is not None:
+                yield "result", job.result
+            elif job.error is not None:
+                yield "error", job.error
+
+    return StreamingResponse(event_stream(job_events()), media_type="text/event-stream", headers=SSE_HEADERS)
+
 @app.post("/convert")
 async def convert_text_to_pdf(request: Request):
     """
@@ -149,7 +299,8 @@ async def convert_text_to_pdf(request: Request):
             raise HTTPException(status_code=400, detail="No text provided")
         
         # Convert text to PDF
-        pdf_buffer = text_to_pdf(text)
+        with span("text_to_pdf"):
+            pdf_buffer = text_to_pdf(text)
         
         # Return the PDF as a downloadable file
         return StreamingResponse(
@@ -161,14 +312,30 @@ async def convert_text_to_pdf(request: Request):
         )
     
     except Exception as e:
-        print(f"Error in convert endpoint: {str(e)}")
+        logger.exception("Error in convert endpoint: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/metrics")
+async def metrics():
+    """Counters and histograms of the pipeline, the AI calls, the caches and the API, in the Prometheus text format"""
+    return PlainTextResponse(REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
 @app.get("/health")
 async def health_check():
     """Simple health check endpoint"""
     return {"status": "ok"}
 
+@app.on_event("startup")
+async def start_job_workers():
+    job_manager.start()
+    start_prewarm()  # Mirror the checklists bucket in the background, the first analyses need not wait for it
+
+@app.on_event("shutdown")
+async def close_clients():
+    """Stop the job workers and close the pooled AI service connections"""
+    await job_manager.stop()
+    await close_async_client()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
@@ -0,0 +1,128 @@
+"""
+Benchmark of the standard pre-analysis: one `point in pdf_text` scan per
+validation point against the single-pass PatternMatcher.
+
+    python -m benchmarks.bench_matcher --pages 10 80 --points 100 300 1000 3000
+
+Every implementation is run on the same synthetic DV text and checklist and
+must produce the same report; one JSON line is printed per configuration.
+`automaton_ms` always uses the Aho-Corasick automaton, `matcher_ms` is what
+the pre-analysis does (automaton from MATCHER_AUTOMATON_MIN_PATTERNS points).
+"""
+import argparse
+import json
+import random
+import time
+from checklist import ChecklistClause
+from matcher import PatternMatcher
+from standard_only import build_standard_analysis
+
+VOCABULARY = (
+    "vendeur acheteur immeuble déclarations toiture fondation infiltration eau sous-sol "
+    "rapport inspection annexe certificat localisation garantie servitude copropriété "
+    "réparation entretien fenêtres électricité plomberie chauffage isolation vermiculite "
+    "amiante pyrite radon réservoir mazout fosse septique puits zonage municipal taxe "
+    "date signature initiales oui non détails section formulaire courtier agence"
+).split()
+
+
+def synthetic_text(pages, rng):
+    words_per_page = 450  # About what a filled DV page holds
+    return " ".join(rng.choice(VOCABULARY) for _ in range(pages * words_per_page))
+
+
+def synthetic_checklist(points, rng, text):
+    """Clauses of 5 points, about half of them present in the text"""
+    clauses = []
+    for number in range(0, points, 5):
+        clause_points = []
+        for _ in range(5):
+            if rng.random() < 0.5:
+                start = rng.randrange(0, len(text) - 40)
+                clause_points.append(text[start:start + rng.randint(8, 30)].strip())
+            else:
+                clause_points.append(" ".join(rng.choice(VOCABULARY) for _ in range(4)) + f" {number}")
+        clauses.append(ChecklistClause(
+            code=f"DV{number // 5 + 1}",
+            name=f"Clause {number // 5 + 1}",
+            validations=" - ".join(clause_points),
+            validation_points=tuple(p for p in clause_points if p),
+        ))
+    return clauses
+
+
+class BenchChecklist:
+    """Just what build_standard_analysis reads from a CompiledChecklist"""
+
+    def __init__(self, clauses, **matcher_options):
+        self.clauses = clauses
+        self.matcher = PatternMatcher((point for clause in clauses for point in clause.validation_points), **matcher_options)
+
+
+def naive_standard_analysis(checklist, pdf_text):
+    """The pre-analysis as it was written before the matcher: one text scan per point"""
+    results = []
+    for clause in checklist.clauses:
+        status = "✅ Conforme"
+        missing = []
+        for point in clause.validation_points:
+            if point not in pdf_text:
+                status = "🟡 Partiellement conforme"
+                missing.append(point)
+        if any("rapport" in m for m in missing):
+            status = "🔴 Non conforme"
+        results.append(f"### {clause.code} - {clause.name}\nStatus: {status}\nMissing: {', '.join(missing) if missing else 'None'}\n")
+    return "".join(results)
+
+
+def best_of(repeat, func, *args):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 40, 80])
+    parser.add_argument("--points", type=int, nargs="+", default=[100, 300, 1000, 3000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    for pages in args.pages:
+        for points in args.points:
+            rng = random.Random(args.seed)
+            text = synthetic_text(pages, rng)
+            clauses = synthetic_checklist(points, rng, text)
+
+            checklist = BenchChecklist(clauses)
+            build_start = time.perf_counter()
+            automaton_checklist = BenchChecklist(clauses, min_patterns=0)
+            build = time.perf_counter() - build_start
+
+            naive, expected = best_of(args.repeat, naive_standard_analysis, checklist, text)
+            automaton, automaton_report = best_of(args.repeat, build_standard_analysis, automaton_checklist, text)
+            matcher, matcher_report = best_of(args.repeat, build_standard_analysis, checklist, text)
+            if automaton_report != expected or matcher_report != expected:
+                raise SystemExit(f"Reports differ for pages={pages} points={points}")
+
+            print(json.dumps({
+                "pages": pages,
+                "text_chars": len(text),
+                "points": points,
+                "states": len(automaton_checklist.matcher.transitions),
+                "build_ms": round(build * 1000, 2),
+                "naive_ms": round(naive * 1000, 2),
+                "automaton_ms": round(automaton * 1000, 2),
+                "matcher_ms": round(matcher * 1000, 2),
+                "speedup": round(naive / matcher, 2),
+                "identical": True,
+            }))
+
+
+if __name__ == "__main__":
+    main()
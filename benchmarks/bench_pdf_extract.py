@@ -0,0 +1,97 @@
+"""
+Benchmark of PDF text extraction: the former string-concatenating extractor
+against the page-streaming one, sequential and split across worker processes.
+
+    python -m benchmarks.bench_pdf_extract --pages 10 80 200 --scanned 20
+
+Synthetic DV-like PDFs are generated with PyMuPDF; `--scanned` appends that
+many image-only pages, like the scanned annexes brokers attach. One JSON line
+is printed per document size with the best time and the peak Python memory
+(tracemalloc) of each extractor.
+"""
+import argparse
+import json
+import random
+import time
+import tracemalloc
+import fitz  # PyMuPDF for PDF handling
+from pdf_text import extract_text
+
+LINE = "DV{section}.{line}  Le vendeur déclare  que l'immeuble n'a  pas subi d'infiltration d'eau, voir annexe G et le rapport d'inspection."
+
+
+def synthetic_pdf(pages, scanned, seed=3):
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for number in range(pages):
+        page = doc.new_page()
+        text = "\n".join(LINE.format(section=number % 16 + 1, line=line) for line in range(55))
+        page.insert_textbox(fitz.Rect(36, 36, 560, 806), text, fontsize=7)
+    for _ in range(scanned):
+        page = doc.new_page()
+        pixmap = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 600, 800), False)
+        pixmap.set_rect(pixmap.irect, (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+        page.insert_image(page.rect, pixmap=pixmap)
+    content = doc.tobytes()
+    doc.close()
+    return content
+
+
+def legacy_extract_pdf_text(file_content):
+    """The extractor as it was written before the page-streaming one"""
+    doc = fitz.open(stream=file_content, filetype="pdf")
+    text = ""
+    for page in doc:
+        text += page.get_text()
+    return text.lower().replace("\n", " ").replace("  ", " ")
+
+
+def measure(repeat, func, *args, **kwargs):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    func(*args, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 80, 200])
+    parser.add_argument("--scanned", type=int, default=20, help="Image-only pages appended to each document")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    for pages in args.pages:
+        content = synthetic_pdf(pages, args.scanned)
+        extract_text(content, parallel_min_pages=1, workers=args.workers)  # Start the worker processes
+
+        legacy_time, legacy_peak = measure(args.repeat, legacy_extract_pdf_text, content)
+        stream_time, stream_peak = measure(args.repeat, extract_text, content, parallel_min_pages=0)
+        parallel_time, parallel_peak = measure(args.repeat, extract_text, content, parallel_min_pages=1, workers=args.workers)
+        text = extract_text(content, parallel_min_pages=0)
+
+        print(json.dumps({
+            "pages": pages + args.scanned,
+            "pdf_bytes": len(content),
+            "text_chars": len(text),
+            "legacy_ms": round(legacy_time * 1000, 1),
+            "legacy_peak_kb": legacy_peak // 1024,
+            "stream_ms": round(stream_time * 1000, 1),
+            "stream_peak_kb": stream_peak // 1024,
+            "parallel_ms": round(parallel_time * 1000, 1),
+            "parallel_peak_kb": parallel_peak // 1024,
+            "stream_pages_per_s": round((pages + args.scanned) / stream_time),
+            "parallel_pages_per_s": round((pages + args.scanned) / parallel_time),
+        }))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""
+Offline benchmark of each stage of /analyze, to see where the time goes and
+catch regressions between versions.
+
+    python -m benchmarks.bench_pipeline --pages 5 20 80 --rows 20 100 500 --output bench.json
+    python -m benchmarks.bench_pipeline --compare bench.json --threshold 1.25
+
+Synthetic DV forms are generated with ReportLab and synthetic checklists with
+pandas, and both are served by a local HTTP server for the download stage.
+AI calls go to the stub OpenRouter server, which answers after `--latency`
+seconds with its canned report. Stages are timed on their own, `--repeat`
+times for each PDF size and checklist size they depend on:
+
+    download             download_from_url of the PDF
+    extract_pdf_text     page-by-page extraction, then the same call on a cached text
+    read_excel           pd.read_excel of the checklist, then compile_checklist
+    standard_checks      the substring checks of the standard pre-analysis
+    prompts              build_specialized_prompt and build_standard_prompt
+    call_agent           one AI call to the stub; overhead_ms leaves its latency out
+    parse_report         parse_specialized_report_to_json of the canned report
+    parse_json_report    parse_structured_report of the same report as JSON
+    text_to_pdf          /convert of a standard report of the checklist's size
+    analyze              the whole pipeline, both AI calls included (--end-to-end)
+
+One JSON line is printed per stage and configuration. `--output` also writes
+them to a file with the commit and machine they were measured on; with
+`--compare`, medians are compared to such a file and the exit status is 1
+when one of them, of at least `--min-ms`, grew by more than `--threshold`.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+import pandas as pd
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.pdfgen import canvas
+import llm_client
+from api import text_to_pdf
+from benchmarks.bench_matcher import VOCABULARY
+from benchmarks.stub_openrouter import start_stub_server, DEFAULT_CONTENT, DEFAULT_JSON_CONTENT
+from checklist import compile_checklist, CODE_COLUMN, NAME_COLUMN, VALIDATION_COLUMN
+from ingestion import PreparedDocument, download_from_url, extract_pdf_text
+from pdf_text import extract_text
+from pipeline import analyze
+from report_parser import parse_structured_report
+from specialized_only import build_specialized_prompt, parse_specialized_report_to_json
+from standard_only import build_standard_analysis, build_standard_prompt, MODEL
+
+LINES_PER_PAGE = 55
+
+
+def synthetic_pdf(pages, rng):
+    """A DV form of `pages` pages: every section DV1-DV16 in turn, with declarations and answers"""
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    for number in range(pages):
+        c.setFont("Helvetica", 8)
+        y = height - 15*mm
+        c.drawString(15*mm, y, f"DV{number % 16 + 1} Déclarations du vendeur sur l'immeuble")
+        for line in range(LINES_PER_PAGE):
+            y -= 4.6*mm if line else 6*mm
+            words = " ".join(rng.choice(VOCABULARY) for _ in range(14))
+            c.drawString(15*mm, y, f"DV{number % 16 + 1}.{line + 1} {words} {rng.choice(('oui', 'non'))}")
+        c.showPage()
+    c.save()
+    return buffer.getvalue()
+
+
+def synthetic_checklist(rows, rng, pdf_text):
+    """An Excel checklist of `rows` clauses of 4 points, about half of them found in the PDF text"""
+    records = []
+    for number in range(rows):
+        points = []
+        for _ in range(4):
+            if rng.random() < 0.5:
+                start = rng.randrange(0, len(pdf_text) - 40)
+                points.append(pdf_text[start:start + rng.randint(8, 30)].replace("-", " ").strip())
+            else:
+                points.append(" ".join(rng.choice(VOCABULARY) for _ in range(4)) + f" {number}")
+        records.append({
+            CODE_COLUMN: f"DV{number % 16 + 1}.{number // 16 + 1}",
+            NAME_COLUMN: f"Clause {number + 1}",
+            VALIDATION_COLUMN: " - ".join(points),
+        })
+    buffer = BytesIO()
+    pd.DataFrame(records).to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+def standard_report(checklist):
+    """A standard report as long as the AI writes for this checklist: a paragraph per clause"""
+    parts = ["# RAPPORT D'ANALYSE STANDARD", ""]
+    for clause in checklist.clauses:
+        parts.extend([f"## {clause.code} - {clause.name}", f"Statut: à vérifier. Éléments attendus: {clause.validations}", ""])
+    return "\n".join(parts)
+
+
+def start_file_server(files):
+    """Serve `files`, a dict of path to content, on a free local port"""
+    class FileHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            content = files.get(self.path)
+            if content is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FileHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def measure(repeat, func, *args, **kwargs):
+    """Milliseconds of each of `repeat` calls"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def summarize(stage, timings, **config):
+    timings = sorted(timings)
+    return {
+        "stage": stage,
+        **config,
+        "runs": len(timings),
+        "min_ms": round(timings[0], 3),
+        "median_ms": round(statistics.median(timings), 3),
+        "max_ms": round(timings[-1], 3),
+    }
+
+
+def run_stages(args):
+    rng = random.Random(args.seed)
+    pdfs = {pages: synthetic_pdf(pages, rng) for pages in args.pages}
+    texts = {pages: extract_text(pdf) for pages, pdf in pdfs.items()}
+    checklists = {rows: synthetic_checklist(rows, rng, texts[max(args.pages)]) for rows in args.rows}
+    compiled = {rows: compile_checklist(content) for rows, content in checklists.items()}
+
+    files = {f"/dv_{pages}.pdf": pdf for pages, pdf in pdfs.items()}
+    file_server, files_url = start_file_server(files)
+    stub, stub_url = start_stub_server(latency=args.latency)
+    llm_client.OPENROUTER_BASE_URL = stub_url
+    repeat = args.repeat
+
+    try:
+        for pages, pdf in pdfs.items():
+            config = {"pages": pages, "pdf_kb": len(pdf) // 1024}
+            yield summarize("download", measure(repeat, download_from_url, f"{files_url}/dv_{pages}.pdf"), **config)
+            yield summarize("extract_pdf_text", measure(repeat, extract_text, pdf), **config)
+            extract_pdf_text(pdf)
+            yield summarize("extract_pdf_text_cached", measure(repeat, extract_pdf_text, pdf), **config)
+
+        for rows, content in checklists.items():
+            config = {"checklist_rows": rows, "xlsx_kb": len(content) // 1024}
+            yield summarize("read_excel", measure(repeat, lambda: pd.read_excel(BytesIO(content))), **config)
+            yield summarize("compile_checklist", measure(repeat, compile_checklist, content), **config)
+            report = standard_report(compiled[rows])
+            yield summarize("text_to_pdf", measure(repeat, text_to_pdf, report), report_kb=len(report) // 1024, **config)
+
+        for pages in args.pages:
+            for rows in args.rows:
+                config = {"pages": pages, "checklist_rows": rows}
+                prepared = PreparedDocument(pdf_bytes=pdfs[pages], pdf_text=texts[pages], checklist=compiled[rows])
+                yield summarize("standard_checks", measure(repeat, build_standard_analysis, compiled[rows], texts[pages]), **config)
+                yield summarize("specialized_prompt", measure(repeat, build_specialized_prompt, prepared), **config)
+                yield summarize("standard_prompt", measure(repeat, build_standard_prompt, prepared), **config)
+
+                prompt = build_specialized_prompt(prepared).text
+                timings = measure(repeat, llm_client.call_agent, prompt, MODEL, "bench-key")
+                result = summarize("call_agent", timings, prompt_kb=len(prompt) // 1024, **config)
+                result["overhead_ms"] = round(result["median_ms"] - args.latency * 1000, 3)
+                yield result
+
+                if args.end_to_end:
+                    run = lambda: asyncio.run(analyze(pdfs[pages], checklists[rows], "bench-key", use_cache=False))
+                    yield summarize("analyze", measure(repeat, run), **config)
+
+        yield summarize("parse_report", measure(repeat * 20, parse_specialized_report_to_json, DEFAULT_CONTENT),
+                        report_chars=len(DEFAULT_CONTENT))
+        yield summarize("parse_json_report", measure(repeat * 20, parse_structured_report, DEFAULT_JSON_CONTENT),
+                        report_chars=len(DEFAULT_JSON_CONTENT))
+    finally:
+        file_server.shutdown()
+        stub.shutdown()
+
+
+def result_key(result):
+    return (result["stage"], result.get("pages"), result.get("checklist_rows"))
+
+
+def compare(results, baseline_path, threshold, min_ms):
+    """
+    Compare medians to a former --output file
+
+    Stages faster than `min_ms` in both runs are reported but never count as
+    regressions: at that scale the ratio is mostly timer noise.
+
+    Returns:
+        int: Number of regressions
+    """
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {result_key(result): result for result in json.load(f)["results"]}
+    regressions = 0
+    for result in results:
+        before = baseline.get(result_key(result))
+        if before is None or not before["median_ms"]:
+            continue
+        ratio = result["median_ms"] / before["median_ms"]
+        regression = ratio > threshold and max(result["median_ms"], before["median_ms"]) >= min_ms
+        regressions += regression
+        print(json.dumps({
+            "stage": result["stage"],
+            "pages": result.get("pages"),
+            "checklist_rows": result.get("checklist_rows"),
+            "baseline_median_ms": before["median_ms"],
+            "median_ms": result["median_ms"],
+            "ratio": round(ratio, 2),
+            "regression": regression,
+        }))
+    return regressions
+
+
+def environment(args):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "args": vars(args),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, nargs="+", default=[5, 20, 80])
+    parser.add_argument("--rows", type=int, nargs="+", default=[20, 100, 500])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds the stub AI takes to answer")
+    parser.add_argument("--end-to-end", action="store_true", help="Also time the whole analyze pipeline")
+    parser.add_argument("--seed", type=int, default=17)
+    parser.add_argument("--output", help="JSON file to write the results to")
+    parser.add_argument("--compare", help="JSON file of a former --output to compare the medians to")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Median ratio over which a stage regressed")
+    parser.add_argument("--min-ms", type=float, default=1.0, help="Medians under this are too small to compare")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)  # Time the stages, not the progress logs
+    results = []
+    for result in run_stages(args):
+        results.append(result)
+        print(json.dumps(result))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"environment": environment(args), "results": results}, f, indent=2)
+
+    if args.compare and compare(results, args.compare, args.threshold, args.min_ms):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
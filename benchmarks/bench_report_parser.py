@@ -0,0 +1,214 @@
+"""
+Benchmark of the specialized report parser: the former whole-report regexes
+against the single-pass report_parser.
+
+    python -m benchmarks.bench_report_parser --mutants 2000 --sizes 250 500 1000
+
+Both parsers must return the same result on every sample of
+benchmarks/report_samples and on `--mutants` randomly damaged copies of them
+(lines dropped or repeated, labels unbolded, whitespace runs inserted, ...).
+Timings are then printed, one JSON line per input, for the samples and for
+pathological inputs of each `--size`: long whitespace runs after a label,
+many entries missing a field, no section at all and runs of "#". Keep the
+sizes small: the former parser backtracks for seconds on 1000 characters.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import time
+from report_parser import parse_specialized_report
+
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), "report_samples")
+
+
+def legacy_parse_specialized_report_to_json(report_text):
+    """parse_specialized_report_to_json as it was written before report_parser"""
+    result = {
+        "summary": "",
+        "recommended_actions": [],
+        "warnings": [],
+        "vendor": "",
+        "buyers": "",
+        "date": "",
+        "property_type": "",
+        "overall_score": ""
+    }
+
+    summary_match = re.search(r'## (?:Évaluation Sommaire|Summary Evaluation|Résumé de l\'Analyse)\s*(.*?)(?=##|\Z)', report_text, re.DOTALL)
+    if summary_match:
+        result["summary"] = summary_match.group(1).strip()
+        buyers_match = re.search(r"acheteurs? (.*?)(?:est|sont) (.*?)\.?$", result["summary"], re.IGNORECASE | re.MULTILINE)
+        if buyers_match:
+            result["buyers"] = buyers_match.group(2).strip()
+        else:
+            buyers_match = re.search(r"celle des acheteurs (.*?)(?:est|sont)? (.*?)\.?$", result["summary"], re.IGNORECASE | re.MULTILINE)
+            if buyers_match:
+                result["buyers"] = buyers_match.group(1).strip()
+            else:
+                buyers_match = re.search(r"acheteurs? (.*?)\.?$", result["summary"], re.IGNORECASE | re.MULTILINE)
+                if buyers_match:
+                    result["buyers"] = buyers_match.group(1).strip()
+
+    actions_section = re.search(r'## (?:RECOMMANDATIONS|RECOMMENDED ACTIONS|Actions Recommandées)(.*?)(?=##|\Z)', report_text, re.DOTALL)
+    if actions_section and actions_section.group(1):
+        actions_text = actions_section.group(1)
+        action_patterns = re.finditer(r'\*\*Section\*\*:\s*(.*?)\s*\*\*Action Requise\*\*:\s*(.*?)\s*\*\*Priorité\*\*:\s*(.*?)\s*\*\*(?:Échéancier|Délai)\*\*:\s*(.*?)(?=\n\n\*\*Section|\n\n##|\Z)',
+                                      actions_text, re.DOTALL)
+        for match in action_patterns:
+            result["recommended_actions"].append({
+                "section": match.group(1).strip(),
+                "action_required": match.group(2).strip(),
+                "priority": match.group(3).strip(),
+                "timeline": match.group(4).strip()
+            })
+        if not result["recommended_actions"]:
+            action_patterns = re.finditer(r'(?:\*\*)?Section(?:\*\*)?\s*:\s*(.*?)\s*(?:\*\*)?Action (?:Requise|Required)(?:\*\*)?\s*:\s*(.*?)\s*(?:\*\*)?(?:Priorité|Priority)(?:\*\*)?\s*:\s*(.*?)\s*(?:\*\*)?(?:Échéancier|Délai|Timeline)(?:\*\*)?\s*:\s*(.*?)(?=\n\n(?:\*\*)?Section|\n\n##|\Z)',
+                                          actions_text, re.DOTALL)
+            for match in action_patterns:
+                result["recommended_actions"].append({
+                    "section": match.group(1).strip(),
+                    "action_required": match.group(2).strip(),
+                    "priority": match.group(3).strip(),
+                    "timeline": match.group(4).strip()
+                })
+
+    warnings_section = re.search(r'## (?:AVERTISSEMENTS|WARNINGS|Avertissements)(.*?)(?=##|\Z)', report_text, re.DOTALL)
+    if warnings_section:
+        warnings_text = warnings_section.group(1)
+        warning_patterns = re.finditer(r'\*\*(?:Niveau de Risque|Risque Level)\*\*:\s*(.*?)\s*\*\*(?:Problème|Issue)\*\*:\s*(.*?)\s*\*\*(?:Conséquences Potentielles|Potential Consequences)\*\*:\s*(.*?)\s*\*\*(?:Atténuation|Mitigation)\*\*:\s*(.*?)(?=\n\n\*\*(?:Niveau de Risque|Risque Level)|\n\n##|\Z)',
+                                       warnings_text, re.DOTALL)
+        for match in warning_patterns:
+            result["warnings"].append({
+                "risk_level": match.group(1).strip(),
+                "issue": match.group(2).strip(),
+                "potential_consequences": match.group(3).strip(),
+                "mitigation": match.group(4).strip()
+            })
+        if not result["warnings"]:
+            warning_patterns = re.finditer(r'(?:\*\*)?(?:Niveau de Risque|Risque Level)(?:\*\*)?\s*:\s*(.*?)\s*(?:\*\*)?(?:Problème|Issue)(?:\*\*)?\s*:\s*(.*?)\s*(?:\*\*)?(?:Conséquences Potentielles|Potential Consequences)(?:\*\*)?\s*:\s*(.*?)\s*(?:\*\*)?(?:Atténuation|Mitigation)(?:\*\*)?\s*:\s*(.*?)(?=\n\n(?:\*\*)?(?:Niveau de Risque|Risque Level)|\n\n##|\Z)',
+                                           warnings_text, re.DOTALL)
+            for match in warning_patterns:
+                result["warnings"].append({
+                    "risk_level": match.group(1).strip(),
+                    "issue": match.group(2).strip(),
+                    "potential_consequences": match.group(3).strip(),
+                    "mitigation": match.group(4).strip()
+                })
+
+    overview_section = re.search(r'## (?:Aperçu du Document|Document Overview)(.*?)(?=##|\Z)', report_text, re.DOTALL)
+    if overview_section:
+        overview_text = overview_section.group(1)
+        vendor_match = re.search(r'\*\*(?:Vendeur\(s\)|Vendor\(s\))\*\*:\s*(.*?)(?=\n\-|\Z)', overview_text, re.DOTALL)
+        if vendor_match:
+            result["vendor"] = vendor_match.group(1).strip()
+        date_match = re.search(r'\*\*Date\*\*:\s*(.*?)(?=\n\-|\Z)', overview_text, re.DOTALL)
+        if date_match:
+            result["date"] = date_match.group(1).strip()
+        property_match = re.search(r'\*\*(?:Type de Propriété|Property Type)\*\*:\s*(.*?)(?=\n\-|\Z)', overview_text, re.DOTALL)
+        if property_match:
+            result["property_type"] = property_match.group(1).strip()
+        score_match = re.search(r'\*\*(?:Score Global|Overall Score)\*\*:\s*(.*?)%', overview_text)
+        if score_match:
+            result["overall_score"] = score_match.group(1).strip()
+
+    return result
+
+
+def load_samples():
+    samples = {}
+    for name in sorted(os.listdir(SAMPLES_DIR)):
+        with open(os.path.join(SAMPLES_DIR, name), encoding="utf-8") as f:
+            samples[name] = f.read()
+    return samples
+
+
+def mutate(text, rng):
+    """A damaged copy of a report, like AI output that drifted from the requested format"""
+    lines = text.split("\n")
+    for _ in range(rng.randint(1, 4)):
+        if not lines:
+            lines.append("")
+        choice = rng.randrange(9)
+        index = rng.randrange(len(lines))
+        if choice == 0:
+            del lines[index]
+        elif choice == 1:
+            lines.insert(index, lines[rng.randrange(len(lines))])
+        elif choice == 2:
+            lines[index] = lines[index].replace("**", "")
+        elif choice == 3:
+            lines[index] = lines[index] + " " * rng.randint(1, 40) + "\t"
+        elif choice == 4:
+            lines[index] = lines[index].replace(": ", " : ").replace("**:", "** :")
+        elif choice == 5:
+            lines.insert(index, "")
+        elif choice == 6:
+            lines[index] = lines[index].replace("##", "###" if rng.random() < 0.5 else "#")
+        elif choice == 7:
+            lines[index] = lines[index].upper() if rng.random() < 0.5 else lines[index].lower()
+        else:
+            position = rng.randrange(len(lines[index]) + 1)
+            lines[index] = lines[index][:position] + rng.choice(["**", "##", "\n\n", "%", " - ", "\n-", "Section:", "est "]) + lines[index][position:]
+    return "\n".join(lines)
+
+
+def pathological_inputs(size):
+    action = "**Section**: DV1\n**Action Requise**: Joindre le rapport\n**Priorité**: High\n"
+    return {
+        f"whitespace_run_{size}": "## Actions Recommandées\n**Section**: DV1" + " " * size + "fin\n\n## Avertissements\nRisque Level:" + "\n" * size,
+        f"entries_missing_field_{size}": "## Actions Recommandées\n" + (action + "\n") * (size // len(action)),
+        f"no_sections_{size}": ("Le vendeur déclare que l'immeuble n'a pas subi d'infiltration d'eau. " * (size // 70)),
+        f"hash_runs_{size}": "## Avertissements\n" + "#" * size,
+    }
+
+
+def best_of(repeat, func, *args):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mutants", type=int, default=2000)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[250, 500, 1000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=5)
+    args = parser.parse_args()
+
+    samples = load_samples()
+    rng = random.Random(args.seed)
+    checked = 0
+    for name, text in samples.items():
+        variants = [text] + [mutate(text, rng) for _ in range(args.mutants // len(samples))]
+        for variant in variants:
+            if parse_specialized_report(variant) != legacy_parse_specialized_report_to_json(variant):
+                raise SystemExit(f"Results differ on a variant of {name}:\n{variant}")
+            checked += 1
+    print(json.dumps({"identical": True, "samples": len(samples), "inputs_checked": checked}))
+
+    inputs = dict(samples)
+    for size in args.sizes:
+        inputs.update(pathological_inputs(size))
+    for name, text in inputs.items():
+        legacy, expected = best_of(args.repeat, legacy_parse_specialized_report_to_json, text)
+        single_pass, result = best_of(args.repeat, parse_specialized_report, text)
+        if result != expected:
+            raise SystemExit(f"Results differ on {name}")
+        print(json.dumps({
+            "input": name,
+            "chars": len(text),
+            "legacy_ms": round(legacy * 1000, 3),
+            "single_pass_ms": round(single_pass * 1000, 3),
+            "speedup": round(legacy / single_pass, 1),
+        }))
+
+
+if __name__ == "__main__":
+    main()
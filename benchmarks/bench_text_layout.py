@@ -0,0 +1,115 @@
+"""
+Benchmark of /convert: the former text_to_pdf, which measured the whole
+growing line for every word, against the TextLayout engine.
+
+    python -m benchmarks.bench_text_layout --kb 50 200 500 --paragraph-words 40 2000
+
+Synthetic reports are generated like AI output: markdown headings and
+paragraphs of `--paragraph-words` words without line breaks. Both versions
+render with ReportLab's invariant mode and must produce byte-identical PDFs.
+One JSON line is printed per configuration.
+"""
+import argparse
+import json
+import random
+import time
+from io import BytesIO
+from reportlab import rl_config
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas
+from api import text_to_pdf
+from benchmarks.bench_matcher import VOCABULARY
+
+
+def synthetic_report(kb, paragraph_words, rng):
+    parts = []
+    size = 0
+    while size < kb * 1024:
+        heading = f"## {rng.choice(VOCABULARY).capitalize()} DV{rng.randint(1, 16)}"
+        paragraph = " ".join(rng.choice(VOCABULARY) for _ in range(paragraph_words))
+        parts.extend([heading, paragraph, ""])
+        size += len(heading) + len(paragraph) + 2
+    return "\n".join(parts)
+
+
+def legacy_text_to_pdf(text, max_width=170*mm):
+    """text_to_pdf as it was written before the layout engine"""
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    x_margin, y_margin = 20*mm, 20*mm
+    y = height - y_margin
+    c.setFont("Helvetica", 11)
+
+    def wrap_line(line, font_name="Helvetica", font_size=11):
+        words = line.split()
+        lines = []
+        current_line = ""
+        for word in words:
+            test_line = f"{current_line} {word}".strip()
+            if stringWidth(test_line, font_name, font_size) <= max_width:
+                current_line = test_line
+            else:
+                lines.append(current_line)
+                current_line = word
+        if current_line:
+            lines.append(current_line)
+        return lines
+
+    for raw_line in text.split("\n"):
+        wrapped_lines = wrap_line(raw_line)
+        for line in wrapped_lines:
+            if y < y_margin:
+                c.showPage()
+                c.setFont("Helvetica", 11)
+                y = height - y_margin
+            c.drawString(x_margin, y, line)
+            y -= 14
+
+    c.save()
+    buffer.seek(0)
+    return buffer
+
+
+def best_of(repeat, func, *args):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--kb", type=int, nargs="+", default=[50, 200, 500])
+    parser.add_argument("--paragraph-words", type=int, nargs="+", default=[40, 2000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args()
+
+    rl_config.invariant = 1  # Same bytes for the same drawing, so both PDFs can be compared
+    for kb in args.kb:
+        for paragraph_words in args.paragraph_words:
+            text = synthetic_report(kb, paragraph_words, random.Random(args.seed))
+            legacy, expected = best_of(args.repeat, legacy_text_to_pdf, text)
+            layout, pdf = best_of(args.repeat, text_to_pdf, text)
+            if pdf != expected:
+                raise SystemExit(f"PDFs differ for kb={kb} paragraph_words={paragraph_words}")
+
+            print(json.dumps({
+                "text_kb": len(text) // 1024,
+                "paragraph_words": paragraph_words,
+                "pdf_kb": len(pdf) // 1024,
+                "legacy_ms": round(legacy * 1000, 1),
+                "layout_ms": round(layout * 1000, 1),
+                "speedup": round(legacy / layout, 2),
+                "identical": True,
+            }))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Local stand-in for the OpenRouter chat completions API.
+
+Lets the AI client be exercised without network access or an API key:
+
+    python -m benchmarks.stub_openrouter --port 8089 --latency 0.5 --fail 429,503
+    OPENROUTER_BASE_URL=http://127.0.0.1:8089/api/v1 python api.py
+
+Every request waits `latency` seconds, then the first requests receive the
+status codes listed in `--fail` (with a Retry-After header when
+`--retry-after` is set) and the following ones receive the canned report,
+as JSON when they ask for a `response_format`.
+Requests sent with `"stream": true` receive it as Server-Sent Events, in
+chunks of `--chunk-size` characters sent `--chunk-delay` seconds apart.
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_CONTENT = """# RAPPORT D'ANALYSE: DV
+
+## Aperçu du Document
+- **Vendeur(s)**: Jean Tremblay
+- **Date**: 2025-04-09
+- **Type de Propriété**: Maison unifamiliale
+- **Score Global**: 85%
+
+## Actions Recommandées
+**Section**: DV5
+**Action Requise**: Joindre le rapport d'inspection
+**Priorité**: High
+**Échéancier**: Immediate
+
+## Avertissements
+**Risque Level**: High
+**Issue**: Rapport d'inspection manquant
+**Conséquences Potentielles**: Recours de l'acheteur
+**Atténuation**: Obtenir le rapport avant la signature
+
+## Résumé de l'Analyse
+Le formulaire est globalement conforme. La signature des acheteurs Marie Roy est présente.
+"""
+
+# The same report, as asked for with the specialized response_format
+DEFAULT_JSON_CONTENT = json.dumps({
+    "vendor": "Jean Tremblay",
+    "buyers": "Marie Roy",
+    "date": "2025-04-09",
+    "property_type": "Maison unifamiliale",
+    "overall_score": 85,
+    "summary": "Le formulaire est globalement conforme. La signature des acheteurs Marie Roy est présente.",
+    "recommended_actions": [
+        {"section": "DV5", "action_required": "Joindre le rapport d'inspection", "priority": "High", "timeline": "Immediate"},
+    ],
+    "warnings": [
+        {"risk_level": "High", "issue": "Rapport d'inspection manquant", "potential_consequences": "Recours de l'acheteur",
+         "mitigation": "Obtenir le rapport avant la signature"},
+    ],
+}, ensure_ascii=False)
+
+
+class StubState:
+    """Behaviour of the stub server and the requests it received"""
+
+    def __init__(self, latency=0.0, failures=(), retry_after=None, content=DEFAULT_CONTENT, chunk_size=40, chunk_delay=0.0,
+                 json_content=DEFAULT_JSON_CONTENT):
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.failures = list(failures)
+        self.retry_after = retry_after
+        self.content = content
+        self.json_content = json_content
+        self.requests = []
+        self.lock = threading.Lock()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real service
+    disable_nagle_algorithm = True  # Headers and body are written apart, Nagle would hold the body for a delayed ACK
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_stream(self, state, model, content):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def write_chunk(data):
+            body = data.encode("utf-8")
+            self.wfile.write(f"{len(body):x}\r\n".encode("ascii") + body + b"\r\n")
+            self.wfile.flush()
+
+        write_chunk(": OPENROUTER PROCESSING\n\n")
+        for start in range(0, len(content), state.chunk_size):
+            time.sleep(state.chunk_delay)
+            delta = content[start:start + state.chunk_size]
+            chunk = {"id": f"stub-{len(state.requests)}", "model": model, "choices": [{"index": 0, "delta": {"content": delta}}]}
+            write_chunk(f"data: {json.dumps(chunk)}\n\n")
+        write_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_POST(self):
+        state = self.server.state
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+
+        with state.lock:
+            state.requests.append(payload)
+            status = state.failures.pop(0) if state.failures else 200
+
+        time.sleep(state.latency)
+
+        if status != 200:
+            headers = {"Retry-After": str(state.retry_after)} if state.retry_after is not None else {}
+            self.send_json(status, {"error": {"code": status, "message": "stub failure"}}, headers)
+            return
+
+        content = state.json_content if payload.get("response_format") else state.content
+        if payload.get("stream"):
+            self.send_stream(state, payload.get("model"), content)
+            return
+
+        self.send_json(200, {
+            "id": f"stub-{len(state.requests)}",
+            "model": payload.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(json.dumps(payload)) // 4, "completion_tokens": len(content) // 4},
+        })
+
+
+def start_stub_server(host="127.0.0.1", port=0, **behaviour):
+    """
+    Start the stub server in a background thread
+
+    Args:
+        host (str): Interface to listen on
+        port (int): Port to listen on, 0 picks a free one
+        **behaviour: latency, failures, retry_after, content, json_content, chunk_size and chunk_delay, see StubState
+
+    Returns:
+        tuple: The server (its `state` attribute records the requests) and the base URL
+            to use as OPENROUTER_BASE_URL
+    """
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.state = StubState(**behaviour)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/api/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub OpenRouter chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before answering")
+    parser.add_argument("--fail", default="", help="Comma separated status codes returned to the first requests")
+    parser.add_argument("--retry-after", type=float, default=None, help="Retry-After value sent with failures")
+    parser.add_argument("--content-file", default=None, help="File holding the canned report")
+    parser.add_argument("--chunk-size", type=int, default=40, help="Characters per streamed chunk")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="Seconds between streamed chunks")
+    args = parser.parse_args()
+
+    content = DEFAULT_CONTENT
+    if args.content_file:
+        with open(args.content_file, encoding="utf-8") as f:
+            content = f.read()
+
+    server, url = start_stub_server(
+        args.host,
+        args.port,
+        latency=args.latency,
+        failures=[int(code) for code in args.fail.split(",") if code],
+        retry_after=args.retry_after,
+        content=content,
+        chunk_size=args.chunk_size,
+        chunk_delay=args.chunk_delay,
+    )
+    print(f"Stub OpenRouter listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
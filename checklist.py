@@ -0,0 +1,214 @@
+import os
+import time
+import logging
+import threading
+from io import BytesIO
+from collections import OrderedDict
+from dataclasses import dataclass, field
+import pandas as pd
+from pdf_text_cache import content_hash
+from matcher import PatternMatcher
+
+logger = logging.getLogger(__name__)
+
+# Columns of the compliance checklist the analyses rely on
+CODE_COLUMN = "Code form."
+NAME_COLUMN = "Nom de la clause"
+VALIDATION_COLUMN = "Éléments de validation"
+
+CHECKLIST_CACHE_SIZE = int(os.getenv("CHECKLIST_CACHE_SIZE", "8"))  # Compiled checklists kept in memory
+CHECKLIST_URL_TTL = float(os.getenv("CHECKLIST_URL_TTL", "300"))   # Seconds a checklist URL is trusted without downloading it again
+
+
+@dataclass(frozen=True)
+class ChecklistClause:
+    """
+    One row of the compliance checklist
+
+    Attributes:
+        code (str): Clause code, e.g. "DV5"
+        name (str): Clause name
+        validations (str): Raw validation elements of the clause
+        validation_points (tuple): Lower-cased validation points, split on "-"
+    """
+    code: str
+    name: str
+    validations: str
+    validation_points: tuple
+
+
+@dataclass(frozen=True)
+class CompiledChecklist:
+    """
+    Compliance checklist compiled once from the Excel file
+
+    Attributes:
+        clauses (tuple): The ChecklistClause of every row
+        columns (tuple): Names of all the columns of the Excel file
+        rows (tuple): Every row as a tuple of cell texts, empty cells as ""
+        source_hash (str): SHA-256 of the Excel file
+        matcher (PatternMatcher): Automaton finding the validation points of all clauses in one pass
+    """
+    clauses: tuple
+    columns: tuple
+    rows: tuple
+    source_hash: str
+    matcher: PatternMatcher = field(default=None, compare=False, repr=False)
+
+    @property
+    def shape(self):
+        return (len(self.rows), len(self.columns))
+
+def split_validation_points(validations):
+    """
+    Split the validation elements of a clause into the points looked up in the PDF text
+
+    Args:
+        validations (str): Raw validation elements, points separated by "-"
+
+    Returns:
+        tuple: Stripped, lower-cased, non-empty points
+    """
+    points = (point.strip().lower() for point in validations.split("-"))
+    return tuple(point for point in points if point)
+
+def cell_text(value):
+    return "" if pd.isna(value) else str(value).strip()
+
+def compile_checklist(file_content):
+    """
+    Compile the compliance checklist from the Excel file
+
+    Args:
+        file_content (bytes): Content of the Excel file
+
+    Returns:
+        CompiledChecklist: The compiled checklist
+    """
+    try:
+        checklist = pd.read_excel(BytesIO(file_content))
+    except Exception as e:
+        logger.error("Error reading Excel file: %s", e)
+        raise Exception(f"Failed to read Excel checklist: {str(e)}")
+
+    missing_columns = [c for c in (CODE_COLUMN, NAME_COLUMN, VALIDATION_COLUMN) if c not in checklist.columns]
+    if missing_columns:
+        raise Exception(f"Failed to read Excel checklist: missing columns {', '.join(missing_columns)}")
+
+    clauses = []
+    for code, name, validations in zip(
+        checklist[CODE_COLUMN].tolist(),
+        checklist[NAME_COLUMN].tolist(),
+        checklist[VALIDATION_COLUMN].tolist(),
+    ):
+        validations = str(validations)  # Empty cells become "nan", as they always have
+        clauses.append(ChecklistClause(
+            code=str(code),
+            name=str(name),
+            validations=validations,
+            validation_points=split_validation_points(validations),
+        ))
+
+    compiled = CompiledChecklist(
+        clauses=tuple(clauses),
+        columns=tuple(str(column) for column in checklist.columns),
+        rows=tuple(tuple(cell_text(value) for value in row) for row in checklist.itertuples(index=False)),
+        source_hash=content_hash(file_content),
+        matcher=PatternMatcher(point for clause in clauses for point in clause.validation_points),
+    )
+    logger.info("Checklist compiled, shape: %s", compiled.shape)
+    return compiled
+
+
+class ChecklistCache:
+    """
+    Compiled checklists, keyed by the SHA-256 of the Excel file.
+
+    Also remembers which checklist each URL pointed to, so that a URL seen less
+    than `url_ttl` seconds ago is not even downloaded again.
+    """
+
+    def __init__(self, max_entries, url_ttl):
+        self.max_entries = max_entries
+        self.url_ttl = url_ttl
+        self.entries = OrderedDict()
+        self.urls = {}  # URL -> (content hash, time it was downloaded)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get_url(self, url):
+        """
+        Look up the checklist a URL pointed to, if it was downloaded recently
+
+        Args:
+            url (str): URL of the Excel file
+
+        Returns:
+            CompiledChecklist: The compiled checklist, or None
+        """
+        with self.lock:
+            known = self.urls.get(url)
+            if known is None:
+                return None
+            key, fetched_at = known
+            if time.monotonic() - fetched_at > self.url_ttl or key not in self.entries:
+                del self.urls[url]
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+    def compile(self, file_content, url=None):
+        """
+        Get the compiled form of an Excel file, compiling it on a miss
+
+        Args:
+            file_content (bytes): Content of the Excel file
+            url (str, optional): URL the content was downloaded from
+
+        Returns:
+            CompiledChecklist: The compiled checklist
+        """
+        key = content_hash(file_content)
+        with self.lock:
+            compiled = self.entries.get(key)
+            if compiled is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if compiled is None:
+            compiled = compile_checklist(file_content)
+
+        with self.lock:
+            self.entries[key] = compiled
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            if url:
+                self.urls[url] = (key, time.monotonic())
+        return compiled
+
+    def invalidate(self, url=None):
+        """
+        Forget a checklist URL, or everything when no URL is given
+
+        Args:
+            url (str, optional): URL of the Excel file
+        """
+        with self.lock:
+            if url is None:
+                self.entries.clear()
+                self.urls.clear()
+            else:
+                self.urls.pop(url, None)
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries)}
+
+
+# Cache shared by both analyzers
+checklist_cache = ChecklistCache(CHECKLIST_CACHE_SIZE, CHECKLIST_URL_TTL)
@@ -0,0 +1,219 @@
+import os
+import time
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+import requests
+from requests.adapters import HTTPAdapter
+from observability import register_cache
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_CONNECT_TIMEOUT = float(os.getenv("DOWNLOAD_CONNECT_TIMEOUT", "10"))  # Seconds to open a connection
+DOWNLOAD_READ_TIMEOUT = float(os.getenv("DOWNLOAD_READ_TIMEOUT", "60"))        # Seconds the server may stay silent
+DOWNLOAD_MAX_MB = float(os.getenv("DOWNLOAD_MAX_MB", "50"))                    # Largest file downloaded, 0 for no limit
+DOWNLOAD_SPOOL_MB = float(os.getenv("DOWNLOAD_SPOOL_MB", "8"))                 # Bodies larger than this are spooled to a temp file
+DOWNLOAD_POOL_SIZE = int(os.getenv("DOWNLOAD_POOL_SIZE", "16"))                # Keep-alive connections kept open per host
+# Memory kept for the bodies of files revalidated with conditional GETs (checklists), 0 disables it
+DOWNLOAD_CACHE_MAX_MB = float(os.getenv("DOWNLOAD_CACHE_MAX_MB", "32"))
+
+CHUNK_SIZE = 64 * 1024
+# Headers making a GET conditional; a None value removes them from the request
+CONDITIONAL_HEADERS = ("If-None-Match", "If-Modified-Since")
+
+
+class DownloadError(Exception):
+    """Raised when a file cannot be downloaded, or is larger than allowed"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ValidatorCache:
+    """
+    Files downloaded with an ETag or Last-Modified header, keyed by URL.
+
+    They are revalidated with a conditional GET: an unchanged file costs a 304
+    without body instead of a full download. Bodies are kept in an LRU bounded by size.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # URL -> (etag, last_modified, body)
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, url):
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is not None:
+                self.entries.move_to_end(url)
+            return entry
+
+    def validators(self, url):
+        """
+        Conditional headers for a URL
+
+        Returns:
+            dict: If-None-Match and If-Modified-Since of the cached copy, empty if there is none
+        """
+        entry = self.get(url)
+        if entry is None:
+            return {}
+        etag, last_modified, _ = entry
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def put(self, url, etag, last_modified, body):
+        if not (etag or last_modified) or len(body) > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(url, None)
+            if previous is not None:
+                self.current_bytes -= len(previous[2])
+            self.entries[url] = (etag, last_modified, body)
+            self.current_bytes += len(body)
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.current_bytes -= len(evicted[2])
+
+    def record(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries), "bytes": self.current_bytes}
+
+
+validator_cache = ValidatorCache(int(DOWNLOAD_CACHE_MAX_MB * 1024 * 1024))
+register_cache("download", validator_cache)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Get the shared requests session, keeping connections to the file hosts alive between downloads
+
+    Returns:
+        requests.Session: The pooled session
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=8, pool_maxsize=DOWNLOAD_POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+def read_body(response, url, max_bytes):
+    """
+    Read a response body in chunks, spooling large ones to a temp file
+
+    Args:
+        response (requests.Response): Response opened with stream=True
+        url (str): URL of the file, for error messages
+        max_bytes (int): Largest body accepted, 0 for no limit
+
+    Returns:
+        bytes: The body
+
+    Raises:
+        DownloadError: As soon as the body grows past max_bytes
+    """
+    declared = response.headers.get("Content-Length")
+    if max_bytes and declared and declared.isdigit() and int(declared) > max_bytes:
+        raise DownloadError(f"File of {int(declared) / 1024 / 1024:.1f} MB, the limit is {max_bytes / 1024 / 1024:.1f} MB", 413)
+
+    size = 0
+    with tempfile.SpooledTemporaryFile(max_size=int(DOWNLOAD_SPOOL_MB * 1024 * 1024)) as buffer:
+        for chunk in response.iter_content(CHUNK_SIZE):
+            size += len(chunk)
+            if max_bytes and size > max_bytes:
+                raise DownloadError(f"File larger than the limit of {max_bytes / 1024 / 1024:.1f} MB: {url}", 413)
+            buffer.write(chunk)
+        buffer.seek(0)
+        return buffer.read()
+
+def fetch(url, headers=None, max_bytes=None):
+    """
+    GET a file with the pooled session, within timeouts and a size limit
+
+    Args:
+        url (str): URL of the file
+        headers (dict, optional): Request headers, e.g. conditional or authorization headers
+        max_bytes (int, optional): Largest file accepted, DOWNLOAD_MAX_MB by default
+
+    Returns:
+        tuple: The status code (200 or 304), the body (None on a 304) and the response headers
+
+    Raises:
+        DownloadError: If the request fails, the server answers an error or the file is too large
+    """
+    if max_bytes is None:
+        max_bytes = int(DOWNLOAD_MAX_MB * 1024 * 1024)
+    try:
+        with get_session().get(url, headers=headers, stream=True, timeout=(DOWNLOAD_CONNECT_TIMEOUT, DOWNLOAD_READ_TIMEOUT)) as response:
+            if response.status_code == 304:
+                return 304, None, response.headers
+            if response.status_code >= 400:
+                raise DownloadError(f"{response.status_code} {response.reason} for url: {url}", response.status_code)
+            return response.status_code, read_body(response, url, max_bytes), response.headers
+    except requests.RequestException as e:
+        raise DownloadError(str(e))
+
+def download(url, conditional=False, max_bytes=None):
+    """
+    Download a file with the pooled session, within timeouts and a size limit
+
+    Args:
+        url (str): URL of the file
+        conditional (bool, optional): Revalidate a cached copy with a conditional GET, and keep
+            the file for the next time if the server sends an ETag or Last-Modified header.
+            Meant for stable files like checklists.
+        max_bytes (int, optional): Largest file accepted, DOWNLOAD_MAX_MB by default
+
+    Returns:
+        bytes: Content of the file
+
+    Raises:
+        DownloadError: If the request fails, the server answers an error or the file is too large,
+            or answers 304 when no cached copy is left
+    """
+    headers = validator_cache.validators(url) if conditional and validator_cache.max_bytes else {}
+    start = time.perf_counter()
+
+    status, body, response_headers = fetch(url, headers, max_bytes)
+    if status == 304:
+        cached = validator_cache.get(url)
+        if cached is not None:
+            validator_cache.record(hit=True)
+            logger.info("Not modified, reusing the cached copy of %s", url)
+            return cached[2]
+        if headers:
+            # Evicted in the meantime: download it again, removing the validators so the request is unconditional
+            status, body, response_headers = fetch(url, dict.fromkeys(CONDITIONAL_HEADERS), max_bytes)
+        if body is None:
+            raise DownloadError(f"304 Not Modified without a cached copy for url: {url}", 304)
+    if conditional:
+        validator_cache.record(hit=False)
+        validator_cache.put(url, response_headers.get("ETag"), response_headers.get("Last-Modified"), body)
+
+    logger.info("Downloaded %d bytes in %.0f ms from %s", len(body), (time.perf_counter() - start) * 1000, url)
+    return body
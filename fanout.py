@@ -0,0 +1,441 @@
+import os
+import re
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from llm_client import complete_async, run_in_background
+from prompt_builder import build_prompt, trim_middle
+import specialized_only
+import standard_only
+from specialized_only import parse_specialized_report_to_json, read_specialized_report, build_specialized_error, analyze_prepared_document_json
+from standard_only import build_standard_blocks, build_standard_error, analyze_prepared_document
+from observability import span
+from triage import DV_SECTION_MARKER_RE
+
+logger = logging.getLogger(__name__)
+
+# Split the analyses into one AI call per group of DV sections, run side by side
+ANALYSIS_FANOUT = os.getenv("ANALYSIS_FANOUT", "0") == "1"
+FANOUT_SECTIONS_PER_CALL = int(os.getenv("FANOUT_SECTIONS_PER_CALL", "2"))  # DV sections evaluated by each call
+FANOUT_CONCURRENCY = int(os.getenv("FANOUT_CONCURRENCY", "9"))              # Calls of one analysis running at once
+# Sections that must be found, in the PDF text or in the checklist, to fan out; below, one call is made as before
+FANOUT_MIN_SECTIONS = int(os.getenv("FANOUT_MIN_SECTIONS", "4"))
+# Characters of the document sent to the overview call, its beginning and its end (signatures)
+FANOUT_OVERVIEW_CHARS = int(os.getenv("FANOUT_OVERVIEW_CHARS", "12000"))
+
+SECTION_COUNT = 16      # DV1 to DV16
+MAX_SECTION_SKIP = 3    # A marker more sections ahead than this is a cross-reference, not a heading
+
+# "DV5", "DV5.2" or "D15" in the code column of the checklist; the PDF text is split at triage's DV_SECTION_MARKER_RE
+SECTION_CODE_RE = re.compile(r"^\s*d\.? ?v? ?(\d{1,2})\b", re.IGNORECASE)
+# Headings of the parts of the standard report built from the section calls
+STANDARD_PART_RE = re.compile(r"^[#*\s\d.]*(éléments conformes|points à bonifier|points à corriger)\b.*$", re.IGNORECASE | re.MULTILINE)
+STANDARD_CLOSING_RE = re.compile(r"^[#*\s]*5\s*[.)-]", re.MULTILINE)
+MISSING_SECTION_TEXT = "(section introuvable dans le document)"
+
+
+@dataclass(frozen=True)
+class SectionGroup:
+    """
+    DV sections evaluated by one AI call
+
+    Attributes:
+        sections (tuple): Numbers of the sections, e.g. (3, 4)
+        text (str): Their part of the PDF text, empty if none of them was found
+        row_indices (tuple): Checklist rows of these sections
+    """
+    sections: tuple
+    text: str
+    row_indices: tuple
+
+    @property
+    def label(self):
+        return ", ".join(f"DV{number}" for number in self.sections)
+
+
+def segment_text(pdf_text):
+    """
+    Split the PDF text at the headings of the DV sections
+
+    Sections are expected in order: a marker is taken as the heading of the
+    next section only if it is at most MAX_SECTION_SKIP sections ahead, so
+    that "voir DV15" in the middle of DV3 does not start DV15.
+
+    Args:
+        pdf_text (str): Normalized text extracted from the PDF
+
+    Returns:
+        dict: Section number -> its text, the signatures ending up in the last section found
+    """
+    segments = {}
+    current, start = 0, 0
+    for match in DV_SECTION_MARKER_RE.finditer(pdf_text):
+        number = int(match.group(1))
+        if current < number <= min(current + MAX_SECTION_SKIP, SECTION_COUNT):
+            if current:
+                segments[current] = pdf_text[start:match.start()]
+            current, start = number, match.start()
+    if current:
+        segments[current] = pdf_text[start:]
+    return segments
+
+def section_of_code(code):
+    """
+    Section of a checklist clause
+
+    Args:
+        code (str): Clause code, e.g. "DV5.2"
+
+    Returns:
+        int: Its DV section, or None for clauses outside DV1-DV16 (signatures, annexes, ...)
+    """
+    match = SECTION_CODE_RE.match(code)
+    if match and 1 <= int(match.group(1)) <= SECTION_COUNT:
+        return int(match.group(1))
+    return None
+
+def plan_sections(checklist, pdf_text=None):
+    """
+    Group the DV sections into the AI calls of a fanned-out analysis
+
+    Args:
+        checklist (CompiledChecklist): The compiled checklist
+        pdf_text (str, optional): Normalized PDF text, to give each call its part of the document
+
+    Returns:
+        tuple: The SectionGroup list, and the indices of the checklist rows outside DV1-DV16
+    """
+    segments = segment_text(pdf_text) if pdf_text is not None else {}
+    rows = {}
+    general = []
+    for index, clause in enumerate(checklist.clauses):
+        section = section_of_code(clause.code)
+        if section is None:
+            general.append(index)
+        else:
+            rows.setdefault(section, []).append(index)
+
+    groups = []
+    size = max(1, FANOUT_SECTIONS_PER_CALL)
+    for first in range(1, SECTION_COUNT + 1, size):
+        sections = tuple(range(first, min(first + size, SECTION_COUNT + 1)))
+        row_indices = tuple(index for section in sections for index in rows.get(section, ()))
+        if not row_indices and not any(section in segments for section in sections):
+            continue
+        text = " ".join(segments[section] if section in segments else f"dv{section} {MISSING_SECTION_TEXT}" for section in sections)
+        groups.append(SectionGroup(sections, text if segments else "", row_indices))
+    return groups, tuple(general)
+
+def run_calls(prompts, model, api_key, use_cache, stage, **options):
+    """
+    Send prompts to the AI service side by side, FANOUT_CONCURRENCY at a time
+
+    The calls run on the background loop of llm_client rather than on threads
+    of their own, so that when one fails the others are cancelled, those in
+    progress included, instead of running on after the analysis failed.
+
+    Args:
+        prompts (list): BuiltPrompt of every call
+        model (str): OpenRouter model identifier
+        api_key (str): API key for OpenRouter
+        use_cache (bool): Set to False to bypass the AI response cache
+        stage (str): Stage every call is timed as
+        **options: Extra parameters of every call, e.g. response_format
+
+    Returns:
+        list: The Completion of every prompt, in order
+
+    Raises:
+        Exception: The first error of a call; the other calls are cancelled
+    """
+    async def run_all():
+        turns = asyncio.Semaphore(max(1, FANOUT_CONCURRENCY))
+
+        async def call(prompt):
+            async with turns:
+                with span(stage):
+                    return await complete_async(prompt.text, model=model, api_key=api_key, use_cache=use_cache, **options)
+
+        # Each task gets its own copy of the context: request id and timing breakdown
+        tasks = [asyncio.ensure_future(call(prompt)) for prompt in prompts]
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return run_in_background(run_all())
+
+def overview_text(text):
+    """The document as sent to an overview call: its beginning and its end, FANOUT_OVERVIEW_CHARS at most"""
+    return trim_middle(text, FANOUT_OVERVIEW_CHARS) if FANOUT_OVERVIEW_CHARS > 0 else text
+
+def usage_fields(prompts, completions):
+    return {
+        "cached": all(completion.cached for completion in completions),
+        "prompt_tokens": sum(prompt.estimated_tokens for prompt in prompts),
+        "prompt_trimmed": any(prompt.trimmed for prompt in prompts),
+        "fanout_calls": len(prompts),
+    }
+
+
+# Specialized prompt of one group of sections, followed by their part of the document and checklist
+SPECIALIZED_SECTIONS_PROMPT = """<Instruction> You are an expert real estate assistant specializing in form validation and compliance analysis. Your task is to analyze sections {sections} of a "Déclarations du vendeur" (DV) form based on the matching rows of a detailed validation table that outlines expected responses, required documents, and critical checks.  The text to analyze is the part of the form holding these sections only. The table that follows provides the criteria for analysis.  You must: Evaluate conformity of sections {sections} only, by comparing the form content with the validation table. Identify issues and provide specialized guidance formatted specifically in two key areas: 1. Recommended Actions - Specific steps to take to resolve issues 2. Warnings - Critical issues that need immediate attention  </Instruction>  Format your output in the following specialized format, and nothing else: ## Actions Recommandées **Section**: [Section] **Action Requise**: [Specific action] **Priorité**: [High/Medium/Low] **Échéancier**: [Immediate/Within X days]</br> </br>  ## Avertissements **Risque Level**: [Critical/High/Medium] **Issue**: [Issue description] **Conséquences Potentielles**: [Consequences] **Atténuation**: [Mitigation approach]</br> </br>
+    Give the output in French language only!!
+    """
+
+# Specialized prompt of the whole document, for what no section call covers
+SPECIALIZED_OVERVIEW_PROMPT = """<Instruction> You are an expert real estate assistant specializing in form validation and compliance analysis. Your task is to give the overview of a "Déclarations du vendeur" (DV) form based on a detailed validation table that outlines expected responses, required documents, and critical checks for each section (DV1 to DV16).  The first pdf document is the report to analyze. The second xlsx document is the validation table/checklist that provides the criteria for analysis.  Sections DV1 to DV16 are evaluated in detail separately: do not list their actions and warnings; the validation table below only holds its rows outside DV1 to DV16.  You must: Find the name of the person who's selling and who's buying the estate in the signature part. Give the overall conformity score of the form and a brief summary of its assessment. List the actions and warnings of the rows of the validation table outside DV1 to DV16 (signatures, annexes, ...), if any.  </Instruction>  Format your output in the following specialized format: # RAPPORT D'ANALYSE: [form number]  </br> ## Aperçu du Document - **Vendeur(s)**: [Names] - **Date**: [Date] - **Type de Propriété**: [Type] - **Score Global**: [score]%  </br> ## Actions Recommandées **Section**: [Section] **Action Requise**: [Specific action] **Priorité**: [High/Medium/Low] **Échéancier**: [Immediate/Within X days]</br> </br>  ## Avertissements **Risque Level**: [Critical/High/Medium] **Issue**: [Issue description] **Conséquences Potentielles**: [Consequences] **Atténuation**: [Mitigation approach]</br> </br>  ## Résumé de l\'Analyse [Brief summary paragraph with overall assessment]
+    Give the output in French language only!!
+    """
+
+# JSON counterparts of the two prompts above, for the "json" output format of the specialized analysis
+SPECIALIZED_SECTIONS_JSON_PROMPT = """<Instruction> You are an expert real estate assistant specializing in form validation and compliance analysis. Your task is to analyze sections {sections} of a "Déclarations du vendeur" (DV) form based on the matching rows of a detailed validation table that outlines expected responses, required documents, and critical checks.  The text to analyze is the part of the form holding these sections only. The table that follows provides the criteria for analysis.  You must: Evaluate conformity of sections {sections} only, by comparing the form content with the validation table. Identify issues and provide specialized guidance in two key areas: 1. Recommended Actions - Specific steps to take to resolve issues 2. Warnings - Critical issues that need immediate attention  </Instruction>  Answer with a single JSON object and nothing else: recommended_actions (objects with section, action_required, priority: High/Medium/Low, timeline: Immediate/Within X days) and warnings (objects with risk_level: Critical/High/Medium, issue, potential_consequences, mitigation); leave vendor, buyers, date, property_type and summary empty and set overall_score to 0, the overview of the form being written separately.
+    Give the text values in French language only!!
+    """
+
+SPECIALIZED_OVERVIEW_JSON_PROMPT = """<Instruction> You are an expert real estate assistant specializing in form validation and compliance analysis. Your task is to give the overview of a "Déclarations du vendeur" (DV) form based on a detailed validation table that outlines expected responses, required documents, and critical checks for each section (DV1 to DV16).  The first pdf document is the report to analyze. The second xlsx document is the validation table/checklist that provides the criteria for analysis.  Sections DV1 to DV16 are evaluated in detail separately: do not list their actions and warnings; the validation table below only holds its rows outside DV1 to DV16.  You must: Find the name of the person who's selling and who's buying the estate in the signature part. Give the overall conformity score of the form and a brief summary of its assessment. List the actions and warnings of the rows of the validation table outside DV1 to DV16 (signatures, annexes, ...), if any.  </Instruction>  Answer with a single JSON object and nothing else: vendor, buyers, date, property_type, overall_score (conformity percentage, a number), summary (brief paragraph with overall assessment), recommended_actions (objects with section, action_required, priority: High/Medium/Low, timeline: Immediate/Within X days) and warnings (objects with risk_level: Critical/High/Medium, issue, potential_consequences, mitigation).
+    Give the text values in French language only!!
+    """
+
+def read_section_report(report_text):
+    """
+    Read the report of a section call, in the output format of the specialized analysis
+
+    A section without issues legitimately yields an empty Markdown report, so
+    only JSON reports that cannot be read are counted as parse failures.
+    """
+    if specialized_only.SPECIALIZED_OUTPUT_FORMAT == "json":
+        return read_specialized_report(report_text)
+    return parse_specialized_report_to_json(report_text)
+
+def merge_specialized_reports(overview_report, section_reports):
+    """
+    Merge the reports of a fanned-out specialized analysis into the shape of parse_specialized_report_to_json
+
+    Args:
+        overview_report (str): Report of the overview call
+        section_reports (list): Reports of the section calls, in section order,
+            read as JSON in the "json" output format like the overview report
+
+    Returns:
+        dict: Overview fields and summary of the overview call, the actions and
+            warnings of every section followed by those of the overview call
+    """
+    merged = read_specialized_report(overview_report)
+    actions, warnings = [], []
+    for report in section_reports:
+        parsed = read_section_report(report)
+        actions.extend(parsed["recommended_actions"])
+        warnings.extend(parsed["warnings"])
+    merged["recommended_actions"] = actions + merged["recommended_actions"]
+    merged["warnings"] = warnings + merged["warnings"]
+    return merged
+
+def analyze_specialized_sections(prepared, api_key=None, use_cache=True):
+    """
+    Run the specialized analysis as one AI call per group of DV sections, plus one for the overview
+
+    Each call only writes the actions and warnings of its sections, so the
+    analysis takes as long as its slowest call rather than the whole report.
+    Falls back to analyze_prepared_document_json when fewer than
+    FANOUT_MIN_SECTIONS sections are found in the PDF text.
+
+    Args:
+        prepared (PreparedDocument): PDF text and checklist produced by prepare_document
+        api_key (str, optional): API key for OpenRouter
+        use_cache (bool, optional): Set to False to bypass the AI response cache
+
+    Returns:
+        dict: Same as analyze_prepared_document_json, with the number of `fanout_calls`
+    """
+    if len(segment_text(prepared.pdf_text)) < FANOUT_MIN_SECTIONS:
+        logger.info("Too few DV sections found in the PDF text to fan out, analyzing it in one call")
+        return analyze_prepared_document_json(prepared, api_key, use_cache)
+    try:
+        with span("specialized_prompt"):
+            groups, general = plan_sections(prepared.checklist, prepared.pdf_text)
+            json_format = specialized_only.SPECIALIZED_OUTPUT_FORMAT == "json"
+            overview_prompt = SPECIALIZED_OVERVIEW_JSON_PROMPT if json_format else SPECIALIZED_OVERVIEW_PROMPT
+            sections_prompt = SPECIALIZED_SECTIONS_JSON_PROMPT if json_format else SPECIALIZED_SECTIONS_PROMPT
+            # The overview needs the names, dates and signatures, and the checklist rows no section call covers
+            prompts = [build_prompt(overview_prompt, overview_text(prepared.pdf_text), prepared.checklist, row_indices=general)]
+            prompts.extend(
+                build_prompt(sections_prompt.format(sections=group.label), group.text, prepared.checklist, row_indices=group.row_indices)
+                for group in groups
+            )
+        logger.info("Sending %d specialized prompts to AI service (~%d tokens)...", len(prompts), sum(prompt.estimated_tokens for prompt in prompts))
+
+        completions = run_calls(prompts, specialized_only.MODEL, api_key, use_cache, "specialized_llm", **specialized_only.SPECIALIZED_OPTIONS)
+        with span("parse_report"):
+            json_output = merge_specialized_reports(completions[0].content, [completion.content for completion in completions[1:]])
+        logger.debug("Merged specialized report: %s", json_output)
+
+        return {
+            "json_output": json_output,
+            **usage_fields(prompts, completions),
+            "timestamp": datetime.now().strftime("%Y%m%d_%H%M%S"),
+            "success": True
+        }
+    except Exception as e:
+        return build_specialized_error(e)
+
+
+# Standard prompt of one group of sections, followed by their pre-analysis and checklist rows
+STD_SECTIONS_PROMPT = """
+        <Instruction>
+        You are an expert real estate assistant specializing in form validation and compliance analysis. Your task is to analyze sections {sections} of a "Déclarations du vendeur" (DV) form based on the matching rows of a detailed validation table that outlines expected responses, required documents, and critical checks.
+
+        You must:
+        Evaluate conformity of sections {sections} only, by comparing the form content with the validation table.
+
+        Identify:
+        ✅ Conforming elements (complete, clear, and documented)
+        🟡 Partial elements (missing minor info, ambiguous, incomplete)
+        🔴 Critical non-conformities (missing required documentation or information that creates risk)
+        </Instruction>
+
+        Format your output as follows, with these three headings only:
+        ÉLÉMENTS CONFORMES :
+        Section
+        Détails conformes
+        (List each conforming section with relevant details.)
+
+        POINTS À BONIFIER :
+        Section
+        Problème détecté
+        Recommandation
+        (List each partially conforming section, what's missing, and how to fix it.)
+
+        POINTS À CORRIGER :
+        Section
+        Risque identifié
+        Action immédiate
+        (List critical issues and what must be corrected.)
+        """
+
+# Standard prompt of the whole document, for the parts of the report no section call writes
+STD_OVERVIEW_PROMPT = """
+        <Instruction>
+        You are an expert real estate assistant specializing in form validation and compliance analysis. Your task is to give the overall assessment of a "Déclarations du vendeur" (DV) form based on a detailed validation table that outlines expected responses, required documents, and critical checks for each section (DV1 to DV16).
+
+        The first pdf document is the report to analyze. The second xlsx document is the validation table/checklist that provides the criteria for analysis.
+
+        Sections DV1 to DV16 are evaluated in detail separately: do not list their conforming elements, observations and risks. The validation table below only holds its rows outside DV1 to DV16; the pre-analysis covers every section.
+
+        Give a conformity score as a percentage based on overall completeness and correctness.
+        </Instruction>
+
+        Format your output as follows:
+        DV [form number] : [score]% Voici l'évaluation complète du formulaire "Déclarations du vendeur" (DV) de [NOM VENDEUR(S)], daté du [DATE], pour un immeuble résidentiel de moins de 5 logements.
+
+        1. SCORE DE CONFORMITÉ GÉNÉRAL : [score]% – [niveau de conformité : Conforme, Conforme avec points à bonifier, Non conforme]
+        Résumé de l'état général du document (structure, signatures, etc.).
+
+        5. RECOMMANDATIONS À L'AGENCE / COURTIER
+        (Add specific recommendations for the agency or broker based on observed patterns or recurring mistakes.)
+
+        6. CONCLUSION
+        (Summarize if the form is valid, under what conditions, and what documents must be urgently provided.)
+
+        Important Notes for Evaluation:
+        Use section D15 for details if "oui" is checked elsewhere.
+        Require Annexe G where applicable (for technical/maintenance details).
+        Require original or attached documents (e.g. inspection reports, invoices).
+        A missing signature or D15 clarification on a critical item may invalidate the form.
+        """
+
+STANDARD_PARTS = (
+    ("éléments conformes", "2. ÉLÉMENTS CONFORMES :"),
+    ("points à bonifier", "3. OBSERVATIONS / POINTS À BONIFIER"),
+    ("points à corriger", "4. POINTS À CORRIGER POUR ÉVITER RISQUES :"),
+)
+
+def split_standard_parts(report):
+    """
+    Split the report of a section call at its three headings
+
+    Returns:
+        dict: Lower-cased heading -> text under it; text before any heading counts as points à bonifier
+    """
+    parts = {}
+    matches = list(STANDARD_PART_RE.finditer(report))
+    preamble = report[:matches[0].start()] if matches else report
+    if preamble.strip():
+        parts["points à bonifier"] = preamble.strip()
+    for match, following in zip(matches, matches[1:] + [None]):
+        text = report[match.end():following.start() if following else len(report)].strip()
+        if text:
+            key = match.group(1).lower()
+            parts[key] = f"{parts[key]}\n{text}" if key in parts else text
+    return parts
+
+def merge_standard_reports(overview_report, section_reports):
+    """
+    Merge the reports of a fanned-out standard analysis into one report of the usual outline
+
+    Parts 2 to 4 are gathered from the section calls, in section order, and
+    inserted before part 5 of the overview call (or after it if it has none).
+
+    Args:
+        overview_report (str): Report of the overview call: heading, parts 1, 5 and 6
+        section_reports (list): Reports of the section calls, in section order
+
+    Returns:
+        str: The standard report
+    """
+    gathered = {key: [] for key, _ in STANDARD_PARTS}
+    for report in section_reports:
+        for key, text in split_standard_parts(report).items():
+            gathered[key].append(text)
+    middle = "\n\n".join(f"{title}\n" + "\n\n".join(gathered[key]) for key, title in STANDARD_PARTS if gathered[key])
+
+    closing = STANDARD_CLOSING_RE.search(overview_report)
+    if closing is None:
+        return f"{overview_report.rstrip()}\n\n{middle}\n"
+    return f"{overview_report[:closing.start()].rstrip()}\n\n{middle}\n\n{overview_report[closing.start():]}"
+
+def analyze_standard_sections(prepared, api_key=None, use_cache=True):
+    """
+    Run the standard analysis as one AI call per group of DV sections, plus one for the overall assessment
+
+    Falls back to analyze_prepared_document when fewer than FANOUT_MIN_SECTIONS
+    sections have rows in the checklist.
+
+    Args:
+        prepared (PreparedDocument): PDF text and checklist produced by prepare_document
+        api_key (str, optional): API key for OpenRouter
+        use_cache (bool, optional): Set to False to bypass the AI response cache
+
+    Returns:
+        dict: Same as analyze_prepared_document, with the number of `fanout_calls`
+    """
+    groups, general = plan_sections(prepared.checklist)
+    groups = [group for group in groups if group.row_indices]
+    if sum(len(group.sections) for group in groups) < FANOUT_MIN_SECTIONS:
+        logger.info("Too few DV sections in the checklist to fan out, analyzing it in one call")
+        return analyze_prepared_document(prepared, api_key, use_cache)
+    try:
+        with span("standard_prompt"):
+            blocks = build_standard_blocks(prepared.checklist, prepared.pdf_text)
+            prompts = [build_prompt(STD_OVERVIEW_PROMPT, overview_text("".join(blocks)), prepared.checklist, row_indices=general)]
+            prompts.extend(
+                build_prompt(STD_SECTIONS_PROMPT.format(sections=group.label), "".join(blocks[index] for index in group.row_indices),
+                             prepared.checklist, row_indices=group.row_indices)
+                for group in groups
+            )
+        logger.info("Sending %d standard prompts to AI service (~%d tokens)...", len(prompts), sum(prompt.estimated_tokens for prompt in prompts))
+
+        completions = run_calls(prompts, standard_only.MODEL, api_key, use_cache, "standard_llm")
+        standard_report = merge_standard_reports(completions[0].content, [completion.content for completion in completions[1:]])
+        logger.debug("Merged standard report: %s", standard_report)
+
+        return {
+            "standard_report": standard_report,
+            **usage_fields(prompts, completions),
+            "success": True,
+            "timestamp": datetime.now().strftime("%Y%m%d_%H%M%S")
+        }
+    except Exception as e:
+        return build_standard_error(e)
@@ -0,0 +1,192 @@
+import logging
+from dataclasses import dataclass
+from typing import Optional
+from pdf_text_cache import pdf_text_cache, content_hash
+from pdf_text import extract_text, TEXT_FORMAT_VERSION
+from checklist import CompiledChecklist, checklist_cache
+from triage import TriageReport, inspect_pdf, check_text
+from downloader import download
+from storage import is_storage_ref, check_ref, read_object, StorageRefError
+from observability import span, register_cache
+
+logger = logging.getLogger(__name__)
+register_cache("pdf_text", pdf_text_cache)
+register_cache("checklist", checklist_cache)
+
+
+@dataclass
+class PreparedDocument:
+    """
+    Inputs of an analysis, downloaded and parsed once so that both the
+    specialized and the standard analyzers can share them.
+
+    Attributes:
+        pdf_bytes (bytes): Raw content of the PDF file
+        pdf_text (str): Normalized text extracted from the PDF
+        checklist (CompiledChecklist): Checklist compiled from the Excel file
+        triage (TriageReport): What triage found out about the PDF
+        pdf_hash (str): SHA-256 of the PDF, identifying identical analyses
+    """
+    pdf_bytes: bytes
+    pdf_text: str
+    checklist: CompiledChecklist
+    triage: Optional[TriageReport] = None
+    pdf_hash: Optional[str] = None
+
+
+# Function to check whether an input is a URL rather than file content
+def is_url(content):
+    return isinstance(content, str) and (content.startswith('http://') or content.startswith('https://'))
+
+# Function to download content from a URL
+@span("download")
+def download_from_url(url, conditional=False):
+    """
+    Download content from a URL
+
+    Args:
+        url (str): URL to download content from
+        conditional (bool, optional): Revalidate a previous download with a conditional GET, see downloader.download
+
+    Returns:
+        bytes: Downloaded content
+    """
+    try:
+        # Pooled session, timeouts and size limit; an unchanged file revalidated costs a 304
+        return download(url, conditional=conditional)
+    except Exception as e:
+        logger.error("Error downloading from %s: %s", url, e)
+        raise Exception(f"Failed to download content from URL: {str(e)}")
+
+# Function to read an object of a storage bucket
+def read_from_storage(ref):
+    """
+    Read an object of a storage bucket, through the local mirror when one is configured
+
+    Args:
+        ref (str): "supabase://<bucket>/<object>" or a public URL of the Supabase project
+
+    Returns:
+        bytes: Content of the object
+    """
+    try:
+        return read_object(ref)
+    except StorageRefError:
+        raise  # The client's mistake, not a storage failure
+    except Exception as e:
+        logger.error("Error reading %s from storage: %s", ref, e)
+        raise Exception(f"Failed to read content from storage: {str(e)}")
+
+# Function to get the raw content of an input (URL, storage reference or content)
+def load_content(file_content):
+    """
+    Get the raw content of a file given either its content, its URL or its storage reference
+
+    Args:
+        file_content (bytes or str): Either file content as bytes, URL to the file or storage reference
+
+    Returns:
+        bytes: Content of the file
+    """
+    if is_storage_ref(file_content):
+        return read_from_storage(file_content)
+    if is_url(file_content):
+        return download_from_url(file_content)
+    return file_content
+
+# Function to extract text from a PDF file
+@span("extract_text")
+def extract_pdf_text(file_content):
+    """
+    Extract text from PDF content
+
+    Args:
+        file_content (bytes or str): Either PDF file content as bytes or URL to PDF
+
+    Returns:
+        str: Extracted text from the PDF
+    """
+    file_content = load_content(file_content)  # If file_content is a URL, download the content
+
+    # The same PDF is often submitted many times, reuse the text extracted the first time
+    key = f"{content_hash(file_content)}-v{TEXT_FORMAT_VERSION}"
+    text = pdf_text_cache.get(key)
+    if text is not None:
+        return text
+
+    text = extract_text(file_content)  # Lower-cased text, whitespace runs collapsed, page by page
+
+    pdf_text_cache.put(key, text)
+    return text
+
+# Function to get the compiled compliance checklist
+@span("checklist")
+def load_checklist(file_content):
+    """
+    Get the compiled checklist of an Excel file, reusing it when the file was already compiled
+
+    Args:
+        file_content (bytes or str): Either Excel file content as bytes, URL to the Excel file or storage reference
+
+    Returns:
+        CompiledChecklist: The checklist
+    """
+    if is_storage_ref(file_content):
+        check_ref(file_content)
+        compiled = checklist_cache.get_url(file_content)
+        if compiled is not None:
+            return compiled
+        # The mirror serves it from disk, revalidating it once in a while
+        return checklist_cache.compile(read_from_storage(file_content), url=file_content)
+    if is_url(file_content):
+        compiled = checklist_cache.get_url(file_content)
+        if compiled is not None:
+            return compiled
+        # Checklists rarely change: revalidate the last download rather than fetching it again
+        return checklist_cache.compile(download_from_url(file_content, conditional=True), url=file_content)
+    return checklist_cache.compile(file_content)
+
+def prepare_pdf(pdf_file_content, checklist):
+    """
+    Download, triage and extract the text of a PDF to analyze against a loaded checklist
+
+    Args:
+        pdf_file_content (bytes or str): Content of the PDF file to analyze or URL to the PDF
+        checklist (CompiledChecklist): The checklist
+
+    Returns:
+        PreparedDocument: The raw bytes, extracted text, checklist and triage report
+
+    Raises:
+        TriageError: If the PDF is not worth sending to the analyzers
+    """
+    pdf_bytes = load_content(pdf_file_content)
+    triage = inspect_pdf(pdf_bytes)  # Size and structure, before spending time on the text
+    pdf_text = extract_pdf_text(pdf_bytes)
+    logger.info("PDF text extracted, length: %d characters", len(pdf_text))
+    check_text(triage, pdf_text)
+
+    return PreparedDocument(
+        pdf_bytes=pdf_bytes,
+        pdf_text=pdf_text,
+        checklist=checklist,
+        triage=triage,
+        pdf_hash=content_hash(pdf_bytes),
+    )
+
+def prepare_document(pdf_file_content, checklist_file_content):
+    """
+    Download and parse the inputs of an analysis once
+
+    Args:
+        pdf_file_content (bytes or str): Content of the PDF file to analyze or URL to the PDF
+        checklist_file_content (bytes or str): Content of the Excel checklist file or URL to the Excel file
+
+    Returns:
+        PreparedDocument: The raw bytes, extracted text, parsed checklist and triage report
+
+    Raises:
+        TriageError: If the PDF is not worth sending to the analyzers
+    """
+    checklist = load_checklist(checklist_file_content)
+    return prepare_pdf(pdf_file_content, checklist)
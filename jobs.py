@@ -0,0 +1,307 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import sqlite3
+import threading
+import dataclasses
+from dataclasses import dataclass
+from typing import Optional
+from pipeline import analyze, analysis_response
+from triage import TriageError
+from observability import REGISTRY, request_id_var
+from llm_scheduler import llm_priority, BATCH
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))            # Analyses run at the same time
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "100"))      # Jobs waiting for a worker before submissions get a 429
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "")            # SQLite file holding the jobs; unset keeps them in memory
+JOB_TTL = float(os.getenv("JOB_TTL", "3600"))               # Seconds a job and its result are kept
+JOB_POLL_SECONDS = 1.0  # Subscribers also re-read the store this often, for jobs run by other processes
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED_STATUSES = (SUCCEEDED, FAILED)
+
+# Stages a job ends on
+COMPLETED = "completed"
+CANCELLED = "cancelled"
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is full"""
+
+
+@dataclass
+class Job:
+    """
+    Analysis submitted to the job queue
+
+    Attributes:
+        id (str): Job identifier
+        status (str): queued, running, succeeded or failed
+        stage (str): Last stage reached: preparing or analyzing (see pipeline.analyze),
+            then completed, failed or cancelled
+        created_at (float): Submission time, as a Unix timestamp
+        started_at (float): Time a worker picked the job up
+        finished_at (float): Time the job succeeded or failed
+        result (dict): Same content as the /analyze response, once succeeded
+        error (dict): Stage and detail of the failure, once failed
+    """
+    id: str
+    status: str
+    stage: Optional[str]
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[dict] = None
+    error: Optional[dict] = None
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATUSES
+
+    def to_dict(self):
+        return dataclasses.asdict(self)
+
+
+class MemoryJobStore:
+    """Jobs kept in this process"""
+
+    def __init__(self):
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def add(self, job):
+        with self.lock:
+            self.jobs[job.id] = dataclasses.replace(job)
+
+    def update(self, job_id, **fields):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                self.jobs[job_id] = dataclasses.replace(job, **fields)
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dataclasses.replace(job) if job is not None else None
+
+    def purge(self, before):
+        """Forget the jobs created before a timestamp"""
+        with self.lock:
+            for job_id in [job.id for job in self.jobs.values() if job.created_at < before]:
+                del self.jobs[job_id]
+
+
+class SqliteJobStore:
+    """
+    Jobs stored in SQLite, so that any API process sharing the file can report them.
+
+    Only the job state is stored: the submitted documents and API key stay in
+    the memory of the process running the job.
+    """
+
+    COLUMNS = ("id", "status", "stage", "created_at", "started_at", "finished_at", "result", "error")
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " status TEXT NOT NULL,"
+            " stage TEXT,"
+            " created_at REAL NOT NULL,"
+            " started_at REAL,"
+            " finished_at REAL,"
+            " result TEXT,"
+            " error TEXT)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created_at)")
+        self.connection.commit()
+
+    @staticmethod
+    def encode(name, value):
+        return json.dumps(value, ensure_ascii=False) if name in ("result", "error") and value is not None else value
+
+    def add(self, job):
+        row = job.to_dict()
+        with self.lock:
+            self.connection.execute(
+                f"INSERT INTO jobs ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                tuple(self.encode(name, row[name]) for name in self.COLUMNS),
+            )
+            self.connection.commit()
+
+    def update(self, job_id, **fields):
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self.lock:
+            self.connection.execute(
+                f"UPDATE jobs SET {assignments} WHERE id = ?",
+                tuple(self.encode(name, value) for name, value in fields.items()) + (job_id,),
+            )
+            self.connection.commit()
+
+    def get(self, job_id):
+        with self.lock:
+            row = self.connection.execute(f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        values = dict(zip(self.COLUMNS, row))
+        for name in ("result", "error"):
+            if values[name] is not None:
+                values[name] = json.loads(values[name])
+        return Job(**values)
+
+    def purge(self, before):
+        """Forget the jobs created before a timestamp"""
+        with self.lock:
+            self.connection.execute("DELETE FROM jobs WHERE created_at < ?", (before,))
+            self.connection.commit()
+
+
+def make_job_store(path=JOB_STORE_PATH):
+    return SqliteJobStore(path) if path else MemoryJobStore()
+
+
+class JobManager:
+    """
+    Queue of analyses run by a pool of in-process workers.
+
+    The number of jobs waiting for a worker is bounded: once `max_queued` are
+    waiting, submit() raises QueueFullError instead of accepting more work.
+    """
+
+    def __init__(self, store, workers=JOB_WORKERS, max_queued=JOB_QUEUE_MAX, ttl=JOB_TTL, runner=analyze):
+        self.store = store
+        self.workers = workers
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self.runner = runner
+        self.queue = None
+        self.tasks = []
+        self.changed = None
+
+    def start(self):
+        """Start the workers, from the event loop that will run them"""
+        if self.tasks:
+            return
+        self.queue = asyncio.Queue(maxsize=self.max_queued)
+        self.changed = asyncio.Event()
+        self.tasks = [asyncio.create_task(self.work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Stop the workers; the jobs they were running are marked as failed, waiting ones expire"""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def submit(self, request):
+        """
+        Queue an analysis
+
+        Args:
+            request (dict): Keyword arguments of pipeline.analyze (pdf_content,
+                checklist_content, api_key, use_cache, fanout)
+
+        Returns:
+            Job: The queued job
+
+        Raises:
+            QueueFullError: If `max_queued` jobs are already waiting
+        """
+        if self.queue is None:
+            raise RuntimeError("The job workers are not started")
+        if self.queue.full():
+            raise QueueFullError(f"Too many analyses waiting ({self.max_queued}), try again later")
+
+        self.store.purge(time.time() - self.ttl)
+        job = Job(id=uuid.uuid4().hex, status=QUEUED, stage=None, created_at=time.time())
+        self.store.add(job)
+        self.queue.put_nowait((job.id, request))
+        return job
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def queued(self):
+        return self.queue.qsize() if self.queue is not None else 0
+
+    def update(self, job_id, **fields):
+        self.store.update(job_id, **fields)
+        # Wake up the subscribers, then arm a new event for the next change
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    async def watch(self, job_id):
+        """
+        Follow a job until it finishes
+
+        Yields:
+            Job: The job when first read, then each time it changed
+        """
+        last = None
+        while True:
+            changed = self.changed
+            job = self.store.get(job_id)
+            if job is None:
+                return
+            if job != last:
+                yield job
+                last = job
+            if job.finished:
+                return
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def work(self):
+        while True:
+            job_id, request = await self.queue.get()
+            try:
+                await self.run(job_id, request)
+            finally:
+                self.queue.task_done()
+
+    async def run(self, job_id, request):
+        request_id_var.set(job_id)  # Log lines of the analysis carry the job id
+        llm_priority.set(BATCH)     # Its AI calls wait behind those of interactive requests
+        self.update(job_id, status=RUNNING, started_at=time.time())
+        stage = None
+
+        def on_stage(name):
+            nonlocal stage
+            stage = name
+            self.update(job_id, stage=name)
+
+        try:
+            result, result_summary, triage = await self.runner(on_stage=on_stage, **request)
+            if not result.get("success", False):
+                error = {"stage": "specialized", "detail": result.get("error", "Unknown error in specialized document analysis")}
+                self.update(job_id, status=FAILED, stage=FAILED, error=error, finished_at=time.time())
+                return
+            self.update(job_id, status=SUCCEEDED, stage=COMPLETED, result=analysis_response(result, result_summary, triage), finished_at=time.time())
+        except asyncio.CancelledError:
+            self.update(job_id, status=FAILED, stage=CANCELLED, error={"stage": "cancelled", "detail": "The server stopped before the job finished"}, finished_at=time.time())
+            raise
+        except TriageError as e:
+            self.update(job_id, status=FAILED, stage=FAILED, error={"stage": "triage", "detail": str(e), "reason": e.report.reason, "triage": e.report.to_dict()}, finished_at=time.time())
+        except Exception as e:
+            logger.exception("Error in job %s: %s", job_id, e)
+            self.update(job_id, status=FAILED, stage=FAILED, error={"stage": stage or "job", "detail": str(e)}, finished_at=time.time())
+
+
+job_manager = JobManager(make_job_store())
+REGISTRY.gauge("jobs_queued", "Jobs waiting for a worker", function=job_manager.queued)
@@ -0,0 +1,118 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from observability import register_cache
+
+# SQLite file holding cached AI responses; unset disables the cache (opt-in)
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "86400"))           # Seconds a response stays valid
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "2000"))  # Least recently used responses are evicted past this
+
+
+def prompt_fingerprint(model, prompt, options=None):
+    """
+    Compute the cache key of an AI call
+
+    Args:
+        model (str): OpenRouter model identifier
+        prompt (str): The prompt
+        options (dict, optional): Extra payload parameters that change the answer
+
+    Returns:
+        str: Hex SHA-256 of the model, prompt and options
+    """
+    material = json.dumps({"model": model, "prompt": prompt, "options": options or {}}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    AI responses stored in SQLite, keyed by the fingerprint of the model and prompt.
+
+    Entries expire after `ttl` seconds and the least recently used ones are evicted
+    once there are more than `max_entries`.
+    """
+
+    def __init__(self, path, ttl, max_entries):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT NOT NULL,"
+            " content TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_used_at REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used_at)")
+        self.connection.commit()
+
+    def get(self, key):
+        """
+        Look up a cached response
+
+        Args:
+            key (str): Fingerprint from prompt_fingerprint
+
+        Returns:
+            str: The cached response, or None on a miss or when it expired
+        """
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT content, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] > self.ttl:
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.connection.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.connection.execute("UPDATE responses SET last_used_at = ? WHERE key = ?", (now, key))
+            self.connection.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, model, content):
+        """
+        Store a response, evicting expired and least recently used entries
+
+        Args:
+            key (str): Fingerprint from prompt_fingerprint
+            model (str): Model that produced the response
+            content (str): The response
+        """
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, model, content, created_at, last_used_at) VALUES (?, ?, ?, ?, ?)",
+                (key, model, content, now, now),
+            )
+            self.connection.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+            self.connection.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM responses ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self.connection.commit()
+
+    def stats(self):
+        with self.lock:
+            entries = self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+
+# Cache in front of the AI calls of both analyzers, None when disabled
+llm_cache = LLMResponseCache(LLM_CACHE_PATH, LLM_CACHE_TTL, LLM_CACHE_MAX_ENTRIES) if LLM_CACHE_PATH else None
+if llm_cache is not None:
+    register_cache("llm", llm_cache)
@@ -0,0 +1,678 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import threading
+import contextvars
+import concurrent.futures
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+import httpx
+from dotenv import load_dotenv
+from llm_cache import llm_cache, prompt_fingerprint
+from observability import LLM_REQUEST_SECONDS, LLM_RESPONSES, LLM_RETRIES, LLM_TOKENS, LLM_HEDGES, LLM_HEDGE_WINS, LLM_HEDGES_SKIPPED
+from llm_scheduler import scheduler
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# OpenRouter endpoint; point it at a local stub server to test without the real service
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1").rstrip("/")
+DEFAULT_MODEL = os.getenv("LLM_MODEL", "google/gemini-2.0-flash-001")  # Model used when the caller does not pick one
+
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))  # Seconds to open a connection
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "180"))       # Seconds to wait for the completion
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))             # Retries after the first attempt
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))       # First backoff window in seconds
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20"))          # Largest backoff window in seconds
+LLM_RETRY_AFTER_MAX = float(os.getenv("LLM_RETRY_AFTER_MAX", "60"))  # Longest Retry-After we agree to wait
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "32"))                # Keep-alive connections kept open
+
+# Hedging: a call still running after the usual latency gets a backup call, the first answer wins
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "0"))              # Seconds before the backup; 0 follows the latency quantile
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.9"))      # Latency quantile of the model after which to hedge
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))   # Calls to observe before the quantile is trusted
+LLM_HEDGE_MODEL = os.getenv("LLM_HEDGE_MODEL", "")                     # Model of the backup call; empty for the same model
+LLM_HEDGE_MAX_RATIO = float(os.getenv("LLM_HEDGE_MAX_RATIO", "0.1"))    # Backup calls allowed per call, the cap on the extra spend
+
+# Status codes worth retrying: rate limiting and transient server errors
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+@dataclass
+class Completion:
+    """
+    Answer of the AI service
+
+    Attributes:
+        content (str): The content of the AI's response
+        model (str): Model that produced it
+        cached (bool): Whether it came from the response cache
+    """
+    content: str
+    model: str
+    cached: bool = False
+
+
+class LLMError(Exception):
+    """Error raised when the AI service call fails for good"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+_session = None
+_session_lock = threading.Lock()
+_async_clients = {}  # One async client per event loop, httpx clients cannot be shared between loops
+
+
+def get_session():
+    """
+    Get the shared requests session, keeping connections to OpenRouter alive between calls
+
+    Returns:
+        requests.Session: The pooled session
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=LLM_POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+def get_async_client():
+    """
+    Get the pooled async client of the running event loop
+
+    Returns:
+        httpx.AsyncClient: The pooled client
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=LLM_POOL_SIZE, max_keepalive_connections=LLM_POOL_SIZE),
+        )
+        _async_clients[loop] = client
+    return client
+
+async def close_async_client():
+    """Close the async client of the running event loop, if one was opened"""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+def build_headers(api_key):
+    if not api_key:
+        raise LLMError("No API key provided for AI service")
+    return {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+        "HTTP-Referer": "https://yourapplication.com/",  # Update with your application's URL
+    }
+
+def build_payload(prompt, model, **options):
+    payload = {
+        "model": model,
+        "messages": [{"role": "user", "content": prompt}]
+    }
+    payload.update(options)  # Extra OpenRouter parameters (temperature, response_format, ...)
+    return payload
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header
+
+    Args:
+        value (str): Header value, either a number of seconds or an HTTP date
+
+    Returns:
+        float: Seconds to wait, or None if the header is missing or invalid
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt, retry_after=None):
+    """
+    Compute how long to wait before the next attempt
+
+    Uses exponential backoff with full jitter, unless the service told us how long to wait.
+
+    Args:
+        attempt (int): Number of the attempt that just failed, starting at 0
+        retry_after (float, optional): Delay requested through the Retry-After header
+
+    Returns:
+        float: Seconds to wait
+    """
+    if retry_after is not None:
+        return min(retry_after, LLM_RETRY_AFTER_MAX) + random.uniform(0, LLM_BACKOFF_BASE)
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt)))
+
+@contextmanager
+def observe_call(model, mode):
+    """
+    Time an AI service call, retries included, into llm_request_seconds
+
+    Args:
+        model (str): OpenRouter model identifier
+        mode (str): sync, async or stream
+    """
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    except (GeneratorExit, asyncio.CancelledError):
+        outcome = "cancelled"  # The caller went away before the answer was complete
+        raise
+    finally:
+        LLM_REQUEST_SECONDS.observe(time.perf_counter() - start, model=model, mode=mode, outcome=outcome)
+
+def record_usage(model, data):
+    """Count the tokens the AI service reports in a response or in the last chunk of a stream"""
+    usage = data.get("usage") if isinstance(data, dict) else None
+    if not usage:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        if usage.get(kind):
+            LLM_TOKENS.inc(usage[kind], model=model, kind=kind[:-len("_tokens")])
+
+def log_retry(model, error, delay, attempt):
+    LLM_RETRIES.inc(model=model)
+    logger.warning("%s; retrying in %.1fs (attempt %d/%d)", error, delay, attempt + 1, LLM_MAX_RETRIES)
+
+def extract_content(data):
+    try:
+        return data["choices"][0]["message"]["content"]  # Return the AI's response
+    except (KeyError, IndexError, TypeError):
+        raise LLMError(f"API call failed: unexpected response {json.dumps(data)[:500]}")
+
+def chat_completion(prompt, model=DEFAULT_MODEL, api_key=None, **options):
+    """
+    Send a prompt to the AI service and return its answer
+
+    Args:
+        prompt (str): The prompt to send
+        model (str, optional): OpenRouter model identifier
+        api_key (str): API key for OpenRouter
+        **options: Extra parameters added to the request payload
+
+    Returns:
+        str: The content of the AI's response
+    """
+    headers = build_headers(api_key)
+    body = json.dumps(build_payload(prompt, model, **options))
+    url = f"{OPENROUTER_BASE_URL}/chat/completions"
+    session = get_session()
+
+    with observe_call(model, "sync"):
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            retry_after = None
+            try:
+                # Waits for a turn: concurrency limit, rate limits of the API key and model, priority
+                with scheduler.slot(model, api_key, len(body)) as slot:
+                    response = session.post(url, headers=headers, data=body, timeout=(LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT))
+                    slot.observe(response.status_code)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                LLM_RESPONSES.inc(model=model, status="transport_error")
+                error = LLMError(f"API call failed: {str(e)}")
+            else:
+                LLM_RESPONSES.inc(model=model, status=response.status_code)
+                if response.status_code == 200:
+                    data = response.json()
+                    record_usage(model, data)
+                    return extract_content(data)
+                error = LLMError(f"API call failed: Error: {response.status_code}, {response.text}", response.status_code)
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    raise error
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+
+            if attempt == LLM_MAX_RETRIES:
+                raise error
+            delay = backoff_delay(attempt, retry_after)
+            log_retry(model, error, delay, attempt)
+            time.sleep(delay)
+
+async def chat_completion_async(prompt, model=DEFAULT_MODEL, api_key=None, progress=None, **options):
+    """
+    Send a prompt to the AI service without blocking the event loop
+
+    Args:
+        prompt (str): The prompt to send
+        model (str, optional): OpenRouter model identifier
+        api_key (str): API key for OpenRouter
+        progress (CallProgress, optional): Told when each attempt is sent and answered
+        **options: Extra parameters added to the request payload
+
+    Returns:
+        str: The content of the AI's response
+    """
+    headers = build_headers(api_key)
+    body = json.dumps(build_payload(prompt, model, **options))
+    url = f"{OPENROUTER_BASE_URL}/chat/completions"
+    client = get_async_client()
+
+    with observe_call(model, "async"):
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            retry_after = None
+            try:
+                async with scheduler.slot_async(model, api_key, len(body)) as slot:
+                    if progress is not None:
+                        progress.sent()
+                    try:
+                        response = await client.post(url, headers=headers, content=body)
+                    finally:
+                        if progress is not None:
+                            progress.answered()
+                    slot.observe(response.status_code)
+            except httpx.TransportError as e:
+                LLM_RESPONSES.inc(model=model, status="transport_error")
+                error = LLMError(f"API call failed: {str(e) or type(e).__name__}")
+            else:
+                LLM_RESPONSES.inc(model=model, status=response.status_code)
+                if response.status_code == 200:
+                    data = response.json()
+                    record_usage(model, data)
+                    return extract_content(data)
+                error = LLMError(f"API call failed: Error: {response.status_code}, {response.text}", response.status_code)
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    raise error
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+
+            if attempt == LLM_MAX_RETRIES:
+                raise error
+            delay = backoff_delay(attempt, retry_after)
+            log_retry(model, error, delay, attempt)
+            await asyncio.sleep(delay)
+
+
+class CallProgress:
+    """
+    Where an AI call stands: waiting for its turn, or sent to the AI service
+
+    Only the time spent at the AI service tells that a call is slow; time in
+    the scheduler queue, or backing off between attempts, does not.
+    """
+
+    def __init__(self):
+        self.sent_at = None    # When the attempt in progress was sent, None while none is
+        self.latency = None    # Time the last answered attempt spent at the AI service
+        self.in_flight = asyncio.Event()
+
+    def sent(self):
+        self.sent_at = time.monotonic()
+        self.in_flight.set()
+
+    def answered(self):
+        self.latency = time.monotonic() - self.sent_at
+        self.sent_at = None
+        self.in_flight.clear()
+
+    def elapsed(self):
+        """Seconds the attempt in progress has spent at the AI service, None while none is sent"""
+        return None if self.sent_at is None else time.monotonic() - self.sent_at
+
+    async def wait_sent(self, task, delay):
+        """
+        Wait until `task` has spent `delay` seconds at the AI service in one attempt
+
+        Returns:
+            bool: True once it did, False if the task finished first
+        """
+        while not task.done():
+            if self.sent_at is None:
+                sent = asyncio.ensure_future(self.in_flight.wait())
+                try:
+                    await asyncio.wait([task, sent], return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    sent.cancel()
+                continue
+            remaining = self.sent_at + delay - time.monotonic()
+            if remaining <= 0:
+                return True
+            await asyncio.wait([task], timeout=remaining)
+        return False
+
+
+class Hedger:
+    """
+    When to send a backup call, and how many of them may be sent
+
+    Keeps the latest latencies of each model to find the hedging delay, and a
+    budget growing by `max_ratio` with each call and spent one unit per backup,
+    so that backups stay below that share of the calls whatever the latency.
+    """
+
+    WINDOW = 200        # Latencies kept per model
+    BUDGET_MAX = 10.0   # Backups that may be sent in a row after a quiet period
+
+    def __init__(self, delay, quantile, min_samples, max_ratio):
+        self.delay = delay
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.max_ratio = max_ratio
+        self.latencies = {}
+        self.budget = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, model, latency):
+        with self.lock:
+            self.latencies.setdefault(model, deque(maxlen=self.WINDOW)).append(latency)
+
+    def hedge_delay(self, model):
+        """
+        Seconds after which a call to `model` gets a backup
+
+        Returns:
+            float: The delay, or None until enough calls were observed
+        """
+        if self.delay > 0:
+            return self.delay
+        with self.lock:
+            samples = sorted(self.latencies.get(model, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[int(self.quantile * (len(samples) - 1))]
+
+    def start_call(self):
+        with self.lock:
+            self.budget = min(self.budget + self.max_ratio, self.BUDGET_MAX)
+
+    def take(self):
+        """Spend one backup from the budget, False when it is used up"""
+        with self.lock:
+            if self.budget < 1:
+                return False
+            self.budget -= 1
+            return True
+
+
+hedger = Hedger(LLM_HEDGE_DELAY, LLM_HEDGE_QUANTILE, LLM_HEDGE_MIN_SAMPLES, LLM_HEDGE_MAX_RATIO)
+
+async def hedged_completion_async(prompt, model=DEFAULT_MODEL, api_key=None, **options):
+    """
+    Send a prompt to the AI service, and again if the answer is slow to come
+
+    Once an attempt has been at the AI service longer than the hedging delay, a
+    backup call is sent to LLM_HEDGE_MODEL (the same model by default), budget
+    permitting. The delay starts when the scheduler lets the call through: a call
+    still waiting for its turn is never hedged, nor is one while the scheduler is
+    at its limit, as the backup would only add to the queue. The first successful answer
+    is kept and the other call cancelled. Calls that fail are retried by
+    chat_completion_async; the error is raised once both failed.
+
+    Args:
+        prompt (str): The prompt to send
+        model (str, optional): OpenRouter model identifier
+        api_key (str): API key for OpenRouter
+        **options: Extra parameters added to the request payload
+
+    Returns:
+        Completion: The response, with the model that gave it
+    """
+    hedger.start_call()
+    progress = CallProgress()
+    primary = asyncio.ensure_future(chat_completion_async(prompt, model=model, api_key=api_key, progress=progress, **options))
+    tasks = {primary: (model, progress)}
+    try:
+        delay = hedger.hedge_delay(model)
+        if delay is not None and await progress.wait_sent(primary, delay):
+            if scheduler.congested():
+                LLM_HEDGES_SKIPPED.inc(model=model, reason="congested")
+            elif not hedger.take():
+                LLM_HEDGES_SKIPPED.inc(model=model, reason="budget")
+            else:
+                backup_model = LLM_HEDGE_MODEL or model
+                LLM_HEDGES.inc(model=model)
+                logger.info("No answer from %s after %.1fs, sending a backup call to %s", model, delay, backup_model)
+                backup_progress = CallProgress()
+                backup = asyncio.ensure_future(chat_completion_async(prompt, model=backup_model, api_key=api_key, progress=backup_progress, **options))
+                tasks[backup] = (backup_model, backup_progress)
+
+        pending, error = set(tasks), None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    if task is primary or error is None:
+                        error = task.exception()  # The primary's error is the one reported
+                    continue
+                winner_model, winner_progress = tasks[task]
+                hedger.record(winner_model, winner_progress.latency)
+                if task is not primary and progress.sent_at is not None:
+                    # The primary beaten by its backup was at the service at least this long; keeping it lets slow calls count
+                    hedger.record(model, progress.elapsed())
+                if len(tasks) > 1:
+                    LLM_HEDGE_WINS.inc(model=model, winner="primary" if task is primary else "backup")
+                return Completion(task.result(), winner_model)
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()  # The slower call gives its scheduler slot and connection back
+
+_background_loop = None
+_background_loop_lock = threading.Lock()
+
+def get_background_loop():
+    """
+    Get the event loop running the AI calls of the synchronous callers that need cancelling
+
+    The analyses call the AI service from worker threads; their hedged and
+    fanned-out calls run on this loop, in a thread of its own, where a call
+    no longer needed is cancelled rather than left running.
+    """
+    global _background_loop
+    if _background_loop is None:
+        with _background_loop_lock:
+            if _background_loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="llm-calls", daemon=True).start()
+                _background_loop = loop
+    return _background_loop
+
+def run_in_background(coroutine):
+    """
+    Run a coroutine on the background loop and wait for its result from the calling thread
+
+    The coroutine runs in a copy of the caller's context: priority, request id
+    and timing breakdown.
+    """
+    loop = get_background_loop()
+    context = contextvars.copy_context()
+    result = concurrent.futures.Future()
+
+    def copy_outcome(task):
+        if task.cancelled():
+            result.cancel()
+        elif task.exception() is not None:
+            result.set_exception(task.exception())
+        else:
+            result.set_result(task.result())
+
+    def start():
+        task = context.run(loop.create_task, coroutine)
+        task.add_done_callback(copy_outcome)
+
+    loop.call_soon_threadsafe(start)
+    return result.result()
+
+async def request_completion_async(prompt, model=DEFAULT_MODEL, api_key=None, **options):
+    """One call to the AI service, hedged when LLM_HEDGE is on"""
+    if LLM_HEDGE:
+        return await hedged_completion_async(prompt, model=model, api_key=api_key, **options)
+    return Completion(await chat_completion_async(prompt, model=model, api_key=api_key, **options), model)
+
+def request_completion(prompt, model=DEFAULT_MODEL, api_key=None, **options):
+    """Blocking version of request_completion_async"""
+    if LLM_HEDGE:
+        return run_in_background(hedged_completion_async(prompt, model=model, api_key=api_key, **options))
+    return Completion(chat_completion(prompt, model=model, api_key=api_key, **options), model)
+
+def complete(prompt, model=DEFAULT_MODEL, api_key=None, use_cache=True, **options):
+    """
+    Send a prompt to the AI service, answering from the response cache when possible
+
+    Args:
+        prompt (str): The prompt to send
+        model (str, optional): OpenRouter model identifier
+        api_key (str): API key for OpenRouter
+        use_cache (bool, optional): Set to False to bypass the response cache for this call
+        **options: Extra parameters added to the request payload
+
+    Returns:
+        Completion: The response and whether it was cached
+    """
+    if llm_cache is None or not use_cache:
+        return request_completion(prompt, model=model, api_key=api_key, **options)
+
+    key = prompt_fingerprint(model, prompt, options)
+    content = llm_cache.get(key)
+    if content is not None:
+        return Completion(content, model, cached=True)
+
+    completion = request_completion(prompt, model=model, api_key=api_key, **options)
+    # Cached under the model that answered, a fallback's answer does not stand for the model asked
+    llm_cache.put(prompt_fingerprint(completion.model, prompt, options), completion.model, completion.content)
+    return completion
+
+async def complete_async(prompt, model=DEFAULT_MODEL, api_key=None, use_cache=True, **options):
+    """Send a prompt to the AI service without blocking the event loop, see complete()"""
+    if llm_cache is None or not use_cache:
+        return await request_completion_async(prompt, model=model, api_key=api_key, **options)
+
+    key = prompt_fingerprint(model, prompt, options)
+    content = llm_cache.get(key)
+    if content is not None:
+        return Completion(content, model, cached=True)
+
+    completion = await request_completion_async(prompt, model=model, api_key=api_key, **options)
+    llm_cache.put(prompt_fingerprint(completion.model, prompt, options), completion.model, completion.content)
+    return completion
+
+async def stream_chat_completion_async(prompt, model=DEFAULT_MODEL, api_key=None, **options):
+    """
+    Send a prompt to the AI service and receive its answer as it is generated
+
+    Failures are retried like in chat_completion as long as nothing was received yet.
+
+    Args:
+        prompt (str): The prompt to send
+        model (str, optional): OpenRouter model identifier
+        api_key (str): API key for OpenRouter
+        **options: Extra parameters added to the request payload
+
+    Yields:
+        str: Successive pieces of the AI's response
+    """
+    headers = build_headers(api_key)
+    body = json.dumps(build_payload(prompt, model, stream=True, **options))
+    url = f"{OPENROUTER_BASE_URL}/chat/completions"
+    client = get_async_client()
+
+    with observe_call(model, "stream"):
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            retry_after = None
+            received = False
+            try:
+                async with scheduler.slot_async(model, api_key, len(body)) as slot, client.stream("POST", url, headers=headers, content=body) as response:
+                    slot.observe(response.status_code, timed=False)  # The slot is held until the end of the stream
+                    LLM_RESPONSES.inc(model=model, status=response.status_code)
+                    if response.status_code == 200:
+                        async for line in response.aiter_lines():
+                            if not line.startswith("data:"):
+                                continue  # Blank separators and ": OPENROUTER PROCESSING" comments
+                            data = line[5:].strip()
+                            if data == "[DONE]":
+                                return
+                            chunk = json.loads(data)
+                            if "error" in chunk:
+                                raise LLMError(f"API call failed: {json.dumps(chunk['error'])}")
+                            record_usage(model, chunk)
+                            delta = (chunk.get("choices") or [{}])[0].get("delta", {}).get("content")
+                            if delta:
+                                received = True
+                                yield delta
+                        return
+                    await response.aread()
+                    error = LLMError(f"API call failed: Error: {response.status_code}, {response.text}", response.status_code)
+                    if response.status_code not in RETRYABLE_STATUS_CODES:
+                        raise error
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            except httpx.TransportError as e:
+                LLM_RESPONSES.inc(model=model, status="transport_error")
+                error = LLMError(f"API call failed: {str(e) or type(e).__name__}")
+                if received:
+                    raise error  # Part of the answer was already handed out, it cannot be replayed
+
+            if attempt == LLM_MAX_RETRIES:
+                raise error
+            delay = backoff_delay(attempt, retry_after)
+            log_retry(model, error, delay, attempt)
+            await asyncio.sleep(delay)
+
+
+class CompletionStream:
+    """
+    Streamed answer of the AI service, answered from the response cache when possible
+
+    Iterate over it to receive the pieces of the answer; once done, `content`
+    holds the whole answer and `cached` tells whether it came from the cache.
+    """
+
+    def __init__(self, prompt, model=DEFAULT_MODEL, api_key=None, use_cache=True, **options):
+        self.prompt = prompt
+        self.model = model
+        self.api_key = api_key
+        self.use_cache = use_cache and llm_cache is not None
+        self.options = options
+        self.content = ""
+        self.cached = False
+
+    async def __aiter__(self):
+        key = prompt_fingerprint(self.model, self.prompt, self.options) if self.use_cache else None
+        if key is not None:
+            content = llm_cache.get(key)
+            if content is not None:
+                self.content, self.cached = content, True
+                yield content
+                return
+
+        parts = []
+        async for delta in stream_chat_completion_async(self.prompt, model=self.model, api_key=self.api_key, **self.options):
+            parts.append(delta)
+            yield delta
+        self.content = "".join(parts)
+
+        if key is not None:
+            llm_cache.put(key, self.model, self.content)
+
+# Function to call the AI agent with a prompt
+def call_agent(prompt, model=DEFAULT_MODEL, api_key=None):
+    return chat_completion(prompt, model=model, api_key=api_key)
+
+# Async version of call_agent, for callers running on the event loop
+async def call_agent_async(prompt, model=DEFAULT_MODEL, api_key=None):
+    return await chat_completion_async(prompt, model=model, api_key=api_key)
@@ -0,0 +1,362 @@
+import os
+import math
+import time
+import asyncio
+import bisect
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager, asynccontextmanager
+from observability import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Queue AI calls in front of the AI service; 0 sends them all at once as before
+LLM_SCHEDULER = os.getenv("LLM_SCHEDULER", "1") == "1"
+LLM_KEY_RATE = float(os.getenv("LLM_KEY_RATE", "5"))         # Calls started per second and API key, 0 for no limit
+LLM_KEY_BURST = float(os.getenv("LLM_KEY_BURST", "20"))       # Calls an API key may start at once after a quiet period
+LLM_MODEL_RATE = float(os.getenv("LLM_MODEL_RATE", "20"))     # Calls started per second and model, 0 for no limit
+LLM_MODEL_BURST = float(os.getenv("LLM_MODEL_BURST", "50"))
+LLM_CONCURRENCY_INITIAL = float(os.getenv("LLM_CONCURRENCY_INITIAL", "16"))  # Calls running at once, adapted from there
+LLM_CONCURRENCY_MIN = float(os.getenv("LLM_CONCURRENCY_MIN", "2"))
+LLM_CONCURRENCY_MAX = float(os.getenv("LLM_CONCURRENCY_MAX", "64"))
+LLM_CONCURRENCY_BACKOFF = float(os.getenv("LLM_CONCURRENCY_BACKOFF", "0.7"))  # Factor applied to the limit on congestion
+# A call slower than this many times the usual latency is a sign of congestion
+LLM_LATENCY_TOLERANCE = float(os.getenv("LLM_LATENCY_TOLERANCE", "2.5"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "120"))  # Seconds a call may wait for its turn
+
+# Priorities, lowest first served: /analyze and its stream, then batches and jobs
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+# Priority of the AI calls made in this context
+llm_priority = contextvars.ContextVar("llm_priority", default=INTERACTIVE)
+
+LATENCY_SMOOTHING = 0.05  # Weight of a new call in the usual latency
+LATENCY_CLASS_CHARS = 8192  # Requests up to this size share a latency class, then one class per doubling
+LATENCY_MIN_EXCESS = 1.0  # Seconds over the usual latency below which a slow call is just noise
+
+QUEUE_SECONDS = REGISTRY.histogram("llm_queue_seconds", "Time AI calls waited for their turn", ["priority"])
+LIMIT_DECREASES = REGISTRY.counter("llm_concurrency_decreases_total", "Cuts of the AI call concurrency limit", ["reason"])
+
+
+class SchedulerTimeout(Exception):
+    """Raised when an AI call waited longer than LLM_QUEUE_TIMEOUT for its turn"""
+
+
+class TokenBucket:
+    """Calls allowed at `rate` per second, up to `burst` at once"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def wait_time(self, now):
+        """Seconds until a call may start, 0 if one may start now"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+def latency_class(model, size):
+    """
+    Calls expected to take about as long: same model, request size within a factor of two
+
+    Args:
+        model (str): OpenRouter model identifier
+        size (int): Size of the request body, in characters
+
+    Returns:
+        tuple: (model, size class)
+    """
+    return model, max(0, math.ceil(math.log2(max(1, size) / LATENCY_CLASS_CHARS)))
+
+def is_overloaded(status):
+    """Whether a response tells that the AI service is overloaded: a 429 or a 5xx"""
+    return isinstance(status, int) and (status == 429 or status >= 500)
+
+
+class AdaptiveLimit:
+    """
+    Concurrency limit adapted to the AI service, AIMD style.
+
+    Every call answered in time while the limit is reached raises it by 1/limit,
+    about one more call per round trip; a 429, a 5xx or a call much slower than
+    the usual latency of its class cuts it by LLM_CONCURRENCY_BACKOFF, at most
+    once per usual latency so that the calls already running when congestion
+    began count once. The usual latency is kept per model and request size (see
+    latency_class), so that a few long prompts or a slower model do not pass for
+    congestion of the others.
+    """
+
+    def __init__(self, initial, minimum, maximum, backoff, tolerance):
+        self.value = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.latencies = {}  # Latency class -> usual latency, moving average in seconds
+        self.last_decrease = 0.0
+
+    def on_success(self, latency, saturated, key=None):
+        """
+        Args:
+            latency (float): Seconds the call took
+            saturated (bool): Whether the limit was reached, the only case where raising it matters
+            key (tuple, optional): Latency class of the call, see latency_class()
+        """
+        usual = self.latencies.setdefault(key, latency)
+        congested = latency > self.tolerance * usual and latency - usual > LATENCY_MIN_EXCESS
+        self.latencies[key] = usual + LATENCY_SMOOTHING * (latency - usual)
+        if congested:
+            self.decrease("latency", key)
+        elif saturated:
+            self.value = min(self.maximum, self.value + 1 / self.value)
+
+    def decrease(self, reason, key=None):
+        now = time.monotonic()
+        if now - self.last_decrease < self.latencies.get(key, 1.0):
+            return
+        self.last_decrease = now
+        self.value = max(self.minimum, self.value * self.backoff)
+        LIMIT_DECREASES.inc(reason=reason)
+        logger.info("AI call concurrency limit cut to %.1f (%s)", self.value, reason)
+
+
+class Waiter:
+    __slots__ = ("priority", "seq", "model", "api_key", "size", "enqueued", "granted", "notify")
+
+    def __init__(self, priority, seq, model, api_key, size, notify):
+        self.priority = priority
+        self.seq = seq
+        self.model = model
+        self.api_key = api_key
+        self.size = size
+        self.enqueued = time.monotonic()
+        self.granted = False
+        self.notify = notify
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class Slot:
+    """Permission to run one AI call; tell it the HTTP status with observe()"""
+
+    def __init__(self, key=None):
+        self.key = key  # Latency class, see latency_class()
+        self.start = time.monotonic()
+        self.status = None
+        self.timed = True
+
+    def observe(self, status, timed=True):
+        """
+        Args:
+            status (int): HTTP status of the response
+            timed (bool, optional): False when the slot does not end with the response, e.g. a stream
+        """
+        self.status = status
+        self.timed = timed
+
+
+class LLMScheduler:
+    """
+    Queue of the AI calls of the process, served by priority.
+
+    A call starts once the calls running are fewer than the adaptive limit and
+    both the token bucket of its API key and that of its model allow it. Calls
+    start by priority then arrival, skipping those held back by a rate limit.
+    Works for threads and for coroutines alike.
+    """
+
+    def __init__(self, key_rate, key_burst, model_rate, model_burst, limit):
+        self.key_rate, self.key_burst = key_rate, key_burst
+        self.model_rate, self.model_burst = model_rate, model_burst
+        self.limit = limit
+        self.waiters = []  # Sorted by priority, then arrival
+        self.in_flight = 0
+        self.key_buckets = {}
+        self.model_buckets = {}
+        self.seq = 0
+        self.timer = None
+        self.timer_at = None
+        self.lock = threading.Lock()
+
+    def queued(self):
+        return len(self.waiters)
+
+    def congested(self):
+        """Whether a call made now would have to wait for its turn"""
+        if not LLM_SCHEDULER:
+            return False
+        with self.lock:
+            return bool(self.waiters) or self.in_flight >= max(1, int(self.limit.value))
+
+    def _buckets(self, waiter):
+        buckets = []
+        if self.key_rate > 0:
+            if waiter.api_key not in self.key_buckets:
+                if len(self.key_buckets) > 1000:
+                    self._prune(self.key_buckets)
+                self.key_buckets[waiter.api_key] = TokenBucket(self.key_rate, self.key_burst)
+            buckets.append(self.key_buckets[waiter.api_key])
+        if self.model_rate > 0:
+            if waiter.model not in self.model_buckets:
+                self.model_buckets[waiter.model] = TokenBucket(self.model_rate, self.model_burst)
+            buckets.append(self.model_buckets[waiter.model])
+        return buckets
+
+    @staticmethod
+    def _prune(buckets):
+        """Forget the buckets refilled to their burst: a new one is the same"""
+        now = time.monotonic()
+        for name, bucket in list(buckets.items()):
+            if bucket.wait_time(now) == 0 and bucket.tokens >= bucket.burst:
+                del buckets[name]
+
+    def _dispatch(self):
+        """Start the waiting calls that may start; called with the lock held"""
+        now = time.monotonic()
+        retry_in = None
+        for waiter in list(self.waiters):
+            if self.in_flight >= max(1, int(self.limit.value)):
+                break
+            buckets = self._buckets(waiter)
+            wait = max((bucket.wait_time(now) for bucket in buckets), default=0.0)
+            if wait > 0:
+                retry_in = wait if retry_in is None else min(retry_in, wait)
+                continue
+            for bucket in buckets:
+                bucket.take()
+            self.waiters.remove(waiter)
+            self.in_flight += 1
+            waiter.granted = True
+            waiter.notify()
+        if retry_in is not None and self.waiters:
+            self._schedule(now + retry_in)
+
+    def _schedule(self, at):
+        if self.timer_at is not None and self.timer_at <= at:
+            return
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer_at = at
+        self.timer = threading.Timer(max(0.0, at - time.monotonic()), self._on_timer)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def _on_timer(self):
+        with self.lock:
+            self.timer, self.timer_at = None, None
+            self._dispatch()
+
+    def _enqueue(self, model, api_key, size, notify):
+        with self.lock:
+            self.seq += 1
+            waiter = Waiter(llm_priority.get(), self.seq, model, api_key or "", size, notify)
+            bisect.insort(self.waiters, waiter)
+            self._dispatch()
+            return waiter
+
+    def _withdraw(self, waiter):
+        """Take a call out of the queue; False if its turn came meanwhile"""
+        with self.lock:
+            if waiter.granted:
+                return False
+            self.waiters.remove(waiter)
+            return True
+
+    def _granted(self, waiter):
+        QUEUE_SECONDS.observe(time.monotonic() - waiter.enqueued, priority=PRIORITY_NAMES.get(waiter.priority, str(waiter.priority)))
+        return Slot(latency_class(waiter.model, waiter.size))
+
+    def release(self, slot):
+        with self.lock:
+            self.in_flight -= 1
+            if is_overloaded(slot.status):
+                self.limit.decrease("rate_limited" if slot.status == 429 else "overloaded", slot.key)
+            elif slot.status == 200 and slot.timed:
+                saturated = bool(self.waiters) or self.in_flight + 1 >= int(self.limit.value)
+                self.limit.on_success(time.monotonic() - slot.start, saturated, slot.key)
+            self._dispatch()
+
+    def acquire(self, model, api_key, size=0):
+        """
+        Wait in the calling thread for the turn of an AI call
+
+        Args:
+            model (str): OpenRouter model identifier
+            api_key (str): API key of the call
+            size (int, optional): Size of the request body, which the latency expected of the call depends on
+
+        Returns:
+            Slot: To hand back with release() once the response is received
+
+        Raises:
+            SchedulerTimeout: After LLM_QUEUE_TIMEOUT seconds in the queue
+        """
+        event = threading.Event()
+        waiter = self._enqueue(model, api_key, size, event.set)
+        if not event.wait(LLM_QUEUE_TIMEOUT) and self._withdraw(waiter):
+            raise SchedulerTimeout(f"AI call waited more than {LLM_QUEUE_TIMEOUT:g}s for its turn, the service is saturated")
+        return self._granted(waiter)
+
+    async def acquire_async(self, model, api_key, size=0):
+        """Wait in the event loop for the turn of an AI call, see acquire()"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        waiter = self._enqueue(model, api_key, size, notify)
+        try:
+            await asyncio.wait_for(future, LLM_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            if self._withdraw(waiter):
+                raise SchedulerTimeout(f"AI call waited more than {LLM_QUEUE_TIMEOUT:g}s for its turn, the service is saturated")
+        except asyncio.CancelledError:
+            if not self._withdraw(waiter):
+                self.release(Slot())  # Its turn came as it was cancelled: give the slot back
+            raise
+        return self._granted(waiter)
+
+    @contextmanager
+    def slot(self, model, api_key, size=0):
+        """Run one attempt of an AI call from a thread once its turn comes"""
+        if not LLM_SCHEDULER:
+            yield Slot()
+            return
+        slot = self.acquire(model, api_key, size)
+        try:
+            yield slot
+        finally:
+            self.release(slot)
+
+    @asynccontextmanager
+    async def slot_async(self, model, api_key, size=0):
+        """Run one attempt of an AI call from a coroutine once its turn comes"""
+        if not LLM_SCHEDULER:
+            yield Slot()
+            return
+        slot = await self.acquire_async(model, api_key, size)
+        try:
+            yield slot
+        finally:
+            self.release(slot)
+
+
+# Scheduler shared by every AI call of the process
+scheduler = LLMScheduler(
+    LLM_KEY_RATE, LLM_KEY_BURST, LLM_MODEL_RATE, LLM_MODEL_BURST,
+    AdaptiveLimit(LLM_CONCURRENCY_INITIAL, LLM_CONCURRENCY_MIN, LLM_CONCURRENCY_MAX, LLM_CONCURRENCY_BACKOFF, LLM_LATENCY_TOLERANCE),
+)
+REGISTRY.gauge("llm_concurrency_limit", "Current adaptive limit of AI calls running at once", function=lambda: round(scheduler.limit.value, 2))
+REGISTRY.gauge("llm_in_flight", "AI calls running", function=lambda: scheduler.in_flight)
+REGISTRY.gauge("llm_queued", "AI calls waiting for their turn", function=scheduler.queued)
@@ -0,0 +1,95 @@
+import os
+from collections import deque
+
+# Below this many patterns, one C-level substring search per pattern beats reading
+# the text character by character in Python, so the automaton is not used
+MATCHER_AUTOMATON_MIN_PATTERNS = int(os.getenv("MATCHER_AUTOMATON_MIN_PATTERNS", "250"))
+
+
+class PatternMatcher:
+    """
+    Aho-Corasick automaton finding which of many patterns occur in a text.
+
+    The automaton is built once from the patterns; each search then reads the
+    text a single time, whatever the number of patterns, instead of scanning
+    the whole text once per pattern. A pattern is found exactly when
+    `pattern in text` is true.
+
+    Small pattern sets are searched one pattern at a time instead, which is
+    faster in CPython until there are a few hundred patterns.
+    """
+
+    def __init__(self, patterns, min_patterns=MATCHER_AUTOMATON_MIN_PATTERNS):
+        # Deduplicated, non-empty patterns, in their original order
+        self.patterns = tuple(dict.fromkeys(pattern for pattern in patterns if pattern))
+        self.use_automaton = len(self.patterns) >= min_patterns
+        self.transitions = None
+        self.outputs = None
+        if self.use_automaton:
+            self._build()
+
+    def _build(self):
+        goto = [{}]     # Trie transitions of each state
+        outputs = [[]]  # Patterns ending at each state
+        for index, pattern in enumerate(self.patterns):
+            state = 0
+            for char in pattern:
+                next_state = goto[state].get(char)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto.append({})
+                    outputs.append([])
+                    goto[state][char] = next_state
+                state = next_state
+            outputs[state].append(index)
+
+        # Breadth-first pass computing the failure link of each state (its longest proper
+        # suffix that is also a trie state) and folding it into complete transitions, so
+        # that a search follows exactly one transition per character. Characters missing
+        # from a state's transitions go back to the root.
+        fail = [0] * len(goto)
+        transitions = [None] * len(goto)
+        transitions[0] = dict(goto[0])
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            transitions[state] = {**transitions[fail[state]], **goto[state]}
+            for char, next_state in goto[state].items():
+                fail[next_state] = transitions[fail[state]].get(char, 0)
+                outputs[next_state].extend(outputs[fail[next_state]])
+                queue.append(next_state)
+
+        self.transitions = transitions
+        self.outputs = [tuple(found) for found in outputs]
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def find(self, text):
+        """
+        Find the patterns occurring in a text
+
+        Args:
+            text (str): The text to search
+
+        Returns:
+            set: The patterns found in the text
+        """
+        if not self.use_automaton:
+            return {pattern for pattern in self.patterns if pattern in text}
+
+        transitions = self.transitions
+        outputs = self.outputs
+        remaining = len(self.patterns)
+        found = set()
+        state = 0
+        for char in text:
+            state = transitions[state].get(char, 0)
+            if outputs[state]:
+                for index in outputs[state]:
+                    if index not in found:
+                        found.add(index)
+                        remaining -= 1
+                if not remaining:
+                    break  # Every pattern was found, no need to read the rest
+        return {self.patterns[index] for index in found}
@@ -0,0 +1,398 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from bisect import bisect_left
+from contextlib import contextmanager
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()       # DEBUG also logs the reports and a line per timed stage
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()     # "json" for one JSON object per line
+ANALYSIS_TIMINGS = os.getenv("ANALYSIS_TIMINGS", "0") == "1"  # Add the timing breakdown to every /analyze response
+
+# Histogram buckets, in seconds: pipeline stages take milliseconds, AI calls up to minutes
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LLM_BUCKETS = (0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 180, 300)
+
+# Identifier of the request (or job) being served, added to every log line
+request_id_var = contextvars.ContextVar("request_id", default="-")
+# Timing breakdown of the current request, when it was asked for
+_timings_var = contextvars.ContextVar("timings", default=None)
+
+logger = logging.getLogger(__name__)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    Base of the metrics: values kept per combination of label values, thread-safe
+
+    Attributes:
+        name (str): Metric name, as exposed on /metrics
+        help (str): Description of the metric
+        label_names (tuple): Names of its labels
+    """
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} takes the labels {', '.join(self.label_names) or '(none)'}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self.lock:
+            items = sorted(self.values.items())
+        for values, value in items:
+            lines.extend(self.samples(values, value))
+        return lines
+
+    def samples(self, values, value):
+        return [f"{self.name}{_format_labels(self.label_names, values)} {_format_value(value)}"]
+
+
+class Counter(Metric):
+    """Value that only goes up: requests, errors, tokens"""
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self.lock:
+            return self.values.get(self.key(labels), 0)
+
+
+class Gauge(Metric):
+    """
+    Value that goes up and down; with `function`, read when the metrics are rendered
+    """
+    type = "gauge"
+
+    def __init__(self, name, help, labels=(), function=None):
+        super().__init__(name, help, labels)
+        self.function = function
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def render(self):
+        if self.function is not None:
+            try:
+                self.set(self.function())
+            except Exception as e:
+                logger.warning("Error reading gauge %s: %s", self.name, e)
+        return super().render()
+
+
+class Histogram(Metric):
+    """Distribution of observed values (durations in seconds) in cumulative buckets"""
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=STAGE_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self, values, state):
+        counts, total, count = state
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, values, [('le', _format_value(float(bound)))])} {cumulative}")
+        lines.append(f"{self.name}_bucket{_format_labels(self.label_names, values, [('le', '+Inf')])} {count}")
+        lines.append(f"{self.name}_sum{_format_labels(self.label_names, values)} {_format_value(total)}")
+        lines.append(f"{self.name}_count{_format_labels(self.label_names, values)} {count}")
+        return lines
+
+
+class Registry:
+    """
+    Metrics exposed on /metrics, in the Prometheus text format
+
+    Besides metrics, collectors can be registered: functions called at render
+    time that return the metrics of a component keeping its own counters.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=(), function=None):
+        return self.register(Gauge(name, help, labels, function))
+
+    def histogram(self, name, help, labels=(), buckets=STAGE_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def add_collector(self, collector):
+        """
+        Register a function returning metrics, e.g. built from the stats() of a cache
+
+        Args:
+            collector (callable): Returns a list of Metric
+        """
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        metrics = list(self.metrics)
+        for collector in self.collectors:
+            try:
+                metrics.extend(collector())
+            except Exception as e:
+                logger.warning("Error collecting metrics: %s", e)
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4"  # The response adds the charset
+
+STAGE_SECONDS = REGISTRY.histogram("analysis_stage_seconds", "Time spent in each pipeline stage", ["stage"])
+STAGE_ERRORS = REGISTRY.counter("analysis_stage_errors_total", "Pipeline stages that raised an error", ["stage"])
+TRIAGE_REJECTIONS = REGISTRY.counter("triage_rejections_total", "PDFs rejected by triage", ["reason"])
+LLM_REQUEST_SECONDS = REGISTRY.histogram("llm_request_seconds", "AI service calls, retries included", ["model", "mode", "outcome"], LLM_BUCKETS)
+LLM_RESPONSES = REGISTRY.counter("llm_responses_total", "AI service attempts, by HTTP status", ["model", "status"])
+LLM_RETRIES = REGISTRY.counter("llm_retries_total", "AI service attempts retried after a failure", ["model"])
+LLM_TOKENS = REGISTRY.counter("llm_tokens_total", "Tokens reported by the AI service", ["model", "kind"])
+LLM_HEDGES = REGISTRY.counter("llm_hedges_total", "Backup AI calls sent because the first one was slow", ["model"])
+LLM_HEDGE_WINS = REGISTRY.counter("llm_hedge_wins_total", "Hedged AI calls, by which of the two answered first", ["model", "winner"])
+LLM_HEDGES_SKIPPED = REGISTRY.counter("llm_hedges_skipped_total", "Slow AI calls not hedged, the extra spend used up or the scheduler at its limit", ["model", "reason"])
+REPORT_PARSE_FAILURES = REGISTRY.counter("report_parse_failures_total", "Specialized reports that could not be read as asked", ["format", "reason"])
+HTTP_REQUESTS = REGISTRY.counter("http_requests_total", "API requests", ["method", "handler", "status"])
+HTTP_REQUEST_SECONDS = REGISTRY.histogram("http_request_seconds", "API requests, until the whole response is sent", ["method", "handler"], LLM_BUCKETS)
+
+
+_caches = {}  # Caches exposed on /metrics, by name
+
+def cache_metrics():
+    """
+    Metrics of the registered caches, from their stats() counters
+
+    Returns:
+        list: Counters of hits (memory and disk tiers together) and misses, and a gauge of the entries
+    """
+    hits = Counter("cache_hits_total", "Cache lookups answered from the cache", ["cache"])
+    misses = Counter("cache_misses_total", "Cache lookups that missed", ["cache"])
+    entries = Gauge("cache_entries", "Entries held by the cache", ["cache"])
+    for name, cache in list(_caches.items()):
+        stats = cache.stats()
+        hits.inc(stats["hits"] + stats.get("disk_hits", 0), cache=name)
+        misses.inc(stats["misses"], cache=name)
+        entries.set(stats["entries"], cache=name)
+    return [hits, misses, entries]
+
+def register_cache(name, cache):
+    """
+    Expose the stats() of a cache on /metrics
+
+    Args:
+        name (str): Value of the `cache` label
+        cache: Object whose stats() returns hits, misses, entries and optionally disk_hits
+    """
+    if not _caches:
+        REGISTRY.add_collector(cache_metrics)
+    _caches[name] = cache
+
+
+class Timings:
+    """
+    Timing breakdown of one request: every stage timed by span() while it was served
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans = []
+
+    def add(self, stage, start, elapsed, error=False):
+        entry = {"stage": stage, "start_ms": round((start - self.start) * 1000, 1), "ms": round(elapsed * 1000, 1)}
+        if error:
+            entry["error"] = True
+        self.spans.append(entry)  # Stages run in threads too, list.append is atomic
+
+    def to_dict(self):
+        return {
+            "total_ms": round((time.perf_counter() - self.start) * 1000, 1),
+            "spans": sorted(self.spans, key=lambda entry: entry["start_ms"]),
+        }
+
+def start_timings():
+    """
+    Collect the timing breakdown of the current request
+
+    Stages timed afterwards in this context, and in the tasks and threads
+    started from it, are added to the returned Timings.
+
+    Returns:
+        Timings: The breakdown, read with to_dict() once the request is served
+    """
+    timings = Timings()
+    _timings_var.set(timings)
+    return timings
+
+def _record(stage, start, error):
+    elapsed = time.perf_counter() - start
+    STAGE_SECONDS.observe(elapsed, stage=stage)
+    if error:
+        STAGE_ERRORS.inc(stage=stage)
+    timings = _timings_var.get()
+    if timings is not None:
+        timings.add(stage, start, elapsed, error)
+    logger.debug("Stage %s took %.1f ms", stage, elapsed * 1000, extra={"stage": stage, "elapsed_ms": round(elapsed * 1000, 1), "error": error})
+
+@contextmanager
+def span(stage):
+    """
+    Time a pipeline stage into analysis_stage_seconds and the request's breakdown
+
+    Exceptions are counted in analysis_stage_errors_total, then raised again.
+    Also usable as a decorator of synchronous functions.
+
+    Args:
+        stage (str): Name of the stage
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        _record(stage, start, error=True)
+        raise
+    _record(stage, start, error=False)
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+# Attributes every LogRecord has; the others were passed with `extra`
+_RECORD_ATTRIBUTES = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime", "request_id"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the fields passed through `extra`"""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+_configured = False
+
+def configure_logging(level=LOG_LEVEL, log_format=LOG_FORMAT):
+    """
+    Send the application logs to stderr, leveled and tagged with the request id
+
+    Args:
+        level (str, optional): Lowest level logged
+        log_format (str, optional): "text" or "json"
+    """
+    global _configured
+    if _configured:
+        return
+    handler = logging.StreamHandler()
+    handler.addFilter(RequestIdFilter())
+    if log_format == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level)
+    _configured = True
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI middleware giving each request an id (X-Request-ID) and counting it in the HTTP metrics
+
+    The duration covers the whole response, streamed bodies included.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")[:64] or uuid.uuid4().hex[:12]
+        token = request_id_var.set(request_id)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers") or []) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            endpoint = scope.get("endpoint")
+            handler = getattr(endpoint, "__name__", "unmatched")  # Function names, not raw paths, keep the labels few
+            HTTP_REQUESTS.inc(method=scope["method"], handler=handler, status=status)
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, method=scope["method"], handler=handler)
+            request_id_var.reset(token)
@@ -0,0 +1,126 @@
+import os
+import re
+import atexit
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import fitz  # PyMuPDF for PDF handling
+
+# Version of the normalized text format, part of the text cache key
+TEXT_FORMAT_VERSION = 2
+
+# Documents with at least this many pages are split across worker processes, 0 disables it
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "150"))
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+_process_pool = None
+
+
+def normalize_text(text):
+    """
+    Normalize the text of a page: lower case, every run of whitespace turned into one space
+
+    Args:
+        text (str): Raw text of the page
+
+    Returns:
+        str: The normalized text
+    """
+    return _WHITESPACE_RE.sub(" ", text.lower()).strip()
+
+def open_pdf(file_content):
+    """
+    Open a PDF given its content or the path of a file holding it
+
+    Args:
+        file_content (bytes or str): PDF content, or path to a PDF file
+
+    Returns:
+        fitz.Document: The open document, to be used as a context manager
+    """
+    if isinstance(file_content, str):
+        return fitz.open(file_content)
+    return fitz.open(stream=file_content, filetype="pdf")
+
+def iter_document_pages(doc, start=0, stop=None):
+    """Normalized text of the pages of an open document, one page at a time"""
+    stop = doc.page_count if stop is None else min(stop, doc.page_count)
+    for number in range(start, stop):
+        yield normalize_text(doc.load_page(number).get_text())
+
+def iter_pdf_pages(file_content, start=0, stop=None):
+    """
+    Extract the normalized text of the pages of a PDF, one page at a time
+
+    The document is closed as soon as the last page was read, or when the
+    generator is closed.
+
+    Args:
+        file_content (bytes or str): PDF content, or path to a PDF file
+        start (int, optional): First page to read
+        stop (int, optional): Page to stop before, defaults to the end of the document
+
+    Yields:
+        str: Normalized text of each page
+    """
+    with open_pdf(file_content) as doc:
+        yield from iter_document_pages(doc, start, stop)
+
+def extract_page_range(file_content, start, stop):
+    """Text of a range of pages, joined; runs in the worker processes"""
+    return " ".join(text for text in iter_pdf_pages(file_content, start, stop) if text)
+
+def get_process_pool():
+    global _process_pool
+    if _process_pool is None:
+        # Workers are started from a clean server process rather than forked from the API and its threads
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        _process_pool = ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS, mp_context=multiprocessing.get_context(method))
+        atexit.register(_process_pool.shutdown, wait=False, cancel_futures=True)
+    return _process_pool
+
+def extract_pages_in_parallel(file_content, page_count, workers):
+    """
+    Extract the text of a PDF by splitting its pages across worker processes
+
+    Args:
+        file_content (bytes): PDF content
+        page_count (int): Number of pages of the PDF
+        workers (int): Number of page ranges to extract concurrently
+
+    Returns:
+        str: Normalized text of the whole document
+    """
+    # Workers read the PDF from a temporary file rather than receiving a copy of its bytes each
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as pdf_file:
+        pdf_file.write(file_content)
+        pdf_file.flush()
+        chunk = -(-page_count // workers)  # Ceiling division
+        ranges = [(start, min(start + chunk, page_count)) for start in range(0, page_count, chunk)]
+        pool = get_process_pool()
+        futures = [pool.submit(extract_page_range, pdf_file.name, start, stop) for start, stop in ranges]
+        return " ".join(text for text in (future.result() for future in futures) if text)
+
+def extract_text(file_content, parallel_min_pages=PDF_PARALLEL_MIN_PAGES, workers=PDF_EXTRACT_WORKERS):
+    """
+    Extract the normalized text of a PDF
+
+    Pages are read and normalized one at a time; large documents are split
+    across worker processes.
+
+    Args:
+        file_content (bytes): PDF content
+        parallel_min_pages (int, optional): Page count from which worker processes are used, 0 never uses them
+        workers (int, optional): Number of worker processes
+
+    Returns:
+        str: Normalized text of the whole document
+    """
+    with open_pdf(file_content) as doc:
+        page_count = doc.page_count
+        if not (parallel_min_pages and workers > 1 and page_count >= parallel_min_pages):
+            return " ".join(text for text in iter_document_pages(doc) if text)
+
+    return extract_pages_in_parallel(file_content, page_count, workers)
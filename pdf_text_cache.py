@@ -0,0 +1,148 @@
+import os
+import sys
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Memory allowed for cached texts, 0 disables the in-memory tier
+PDF_TEXT_CACHE_MAX_MB = float(os.getenv("PDF_TEXT_CACHE_MAX_MB", "64"))
+# Directory of the on-disk tier, which survives restarts; unset disables it
+PDF_TEXT_CACHE_DIR = os.getenv("PDF_TEXT_CACHE_DIR", "")
+
+
+def content_hash(content):
+    """
+    Compute the key of a file in the cache
+
+    Args:
+        content (bytes or str): Content of the file
+
+    Returns:
+        str: Hex SHA-256 of the content
+    """
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
+
+
+class PdfTextCache:
+    """
+    Cache of the text extracted from PDF files, keyed by the SHA-256 of the PDF bytes.
+
+    Texts are kept in an in-memory LRU bounded by size and, optionally, in a directory
+    so that they survive restarts. Entries never go stale since the key is the content.
+    """
+
+    def __init__(self, max_bytes, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory or None
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.txt")
+
+    def _remember(self, key, text):
+        size = sys.getsizeof(text)
+        if size > self.max_bytes:
+            return  # Would evict everything else, not worth it
+        if key in self.entries:
+            self.current_bytes -= sys.getsizeof(self.entries.pop(key))
+        self.entries[key] = text
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:  # Evict the least recently used texts
+            _, evicted = self.entries.popitem(last=False)
+            self.current_bytes -= sys.getsizeof(evicted)
+
+    def get(self, key):
+        """
+        Look up the text of a PDF
+
+        Args:
+            key (str): SHA-256 of the PDF bytes
+
+        Returns:
+            str: The cached text, or None on a miss
+        """
+        with self.lock:
+            text = self.entries.get(key)
+            if text is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return text
+
+        if self.directory:
+            try:
+                with open(self._path(key), encoding="utf-8") as f:
+                    text = f.read()
+            except FileNotFoundError:
+                text = None
+            except OSError as e:
+                logger.warning("Error reading cached PDF text %s: %s", key, e)
+                text = None
+            if text is not None:
+                with self.lock:
+                    self._remember(key, text)
+                    self.disk_hits += 1
+                return text
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, text):
+        """
+        Store the text of a PDF
+
+        Args:
+            key (str): SHA-256 of the PDF bytes
+            text (str): Text extracted from the PDF
+        """
+        with self.lock:
+            self._remember(key, text)
+
+        if self.directory:
+            tmp_path = None
+            try:
+                # Write to a temporary file first so that readers never see a partial text
+                fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    f.write(text)
+                os.replace(tmp_path, self._path(key))
+            except OSError as e:
+                logger.warning("Error writing cached PDF text %s: %s", key, e)
+                if tmp_path is not None:
+                    try:
+                        os.remove(tmp_path)  # A full disk must not fill up with partial files
+                    except OSError:
+                        pass
+
+    def stats(self):
+        """
+        Get the cache counters
+
+        Returns:
+            dict: Hits (memory and disk), misses, number of entries and memory used
+        """
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "entries": len(self.entries),
+                "bytes": self.current_bytes,
+            }
+
+
+# Cache shared by both analyzers
+pdf_text_cache = PdfTextCache(int(PDF_TEXT_CACHE_MAX_MB * 1024 * 1024), PDF_TEXT_CACHE_DIR)
@@ -0,0 +1,296 @@
+import asyncio
+import functools
+import contextvars
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from ingestion import PreparedDocument, prepare_document, prepare_pdf, load_content, extract_pdf_text, load_checklist, is_url
+from storage import is_storage_ref
+from pdf_text_cache import content_hash
+from triage import TriageError, inspect_pdf, check_text
+from llm_client import CompletionStream
+import specialized_only
+import standard_only
+from specialized_only import analyze_prepared_document_json, build_specialized_prompt, build_specialized_result, build_specialized_error
+from standard_only import analyze_prepared_document, build_standard_prompt, build_standard_result, build_standard_error
+from fanout import ANALYSIS_FANOUT, analyze_specialized_sections, analyze_standard_sections
+from observability import span
+from singleflight import SingleFlight
+from llm_scheduler import llm_priority, BATCH
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of blocking pipeline steps (downloads, PDF parsing, AI calls) running at once
+ANALYSIS_MAX_WORKERS = int(os.getenv("ANALYSIS_MAX_WORKERS", "16"))
+
+# Documents of a batch analyzed at the same time, by default and at most; each one keeps two pool threads busy
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", str(max(1, ANALYSIS_MAX_WORKERS // 2))))
+BATCH_MAX_DOCUMENTS = int(os.getenv("BATCH_MAX_DOCUMENTS", "500"))
+
+# Identical analyses requested while one is running wait for its result instead of running again
+ANALYSIS_COALESCE = os.getenv("ANALYSIS_COALESCE", "1") == "1"
+
+# Bounded pool the blocking steps are offloaded to so that the event loop stays free
+executor = ThreadPoolExecutor(max_workers=ANALYSIS_MAX_WORKERS, thread_name_prefix="analysis")
+
+# Downloads and parsing of the same URLs, and analyses of the same PDF and checklist, in progress
+preparations = SingleFlight("prepare")
+analyses = SingleFlight("analysis")
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Run a blocking function in the analysis thread pool without blocking the event loop
+
+    Args:
+        func (callable): The blocking function to run
+        *args: Positional arguments for the function
+        **kwargs: Keyword arguments for the function
+
+    Returns:
+        Any: The value returned by the function
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()  # The request id and timing breakdown follow the step into its thread
+    return await loop.run_in_executor(executor, functools.partial(context.run, func, *args, **kwargs))
+
+async def analyze(pdf_content, checklist_content, api_key=None, use_cache=True, fanout=ANALYSIS_FANOUT, on_stage=None):
+    """
+    Run the specialized and the standard analyses of a document concurrently
+
+    Args:
+        pdf_content (bytes or str): Content of the PDF file to analyze or URL to the PDF
+        checklist_content (bytes or str): Content of the Excel checklist file or URL to the Excel file
+        api_key (str, optional): API key for OpenRouter
+        use_cache (bool, optional): Set to False to bypass the AI response cache
+        fanout (bool, optional): Split each analysis into one AI call per group of DV sections, see fanout.py
+        on_stage (callable, optional): Called on the event loop with the name of each stage
+            reached: "preparing" (downloads, triage, text and checklist), then "analyzing"
+
+    Returns:
+        tuple: The specialized result and the standard result, as returned by
+            analyze_prepared_document_json and analyze_prepared_document, and the
+            triage report of the PDF
+
+    Raises:
+        TriageError: If the PDF was rejected before any AI call
+    """
+    if on_stage is not None:
+        on_stage("preparing")
+    # Download the inputs, extract the PDF text and read the checklist once for both analyses
+    if ANALYSIS_COALESCE and all(is_url(content) or is_storage_ref(content) for content in (pdf_content, checklist_content)):
+        # Inline content is identified once hashed, by analyze_prepared
+        prepared = await preparations.do((pdf_content, checklist_content), run_blocking, prepare_document, pdf_content, checklist_content)
+    else:
+        prepared = await run_blocking(prepare_document, pdf_content, checklist_content)
+    if on_stage is not None:
+        on_stage("analyzing")
+    result, result_summary = await analyze_prepared(prepared, api_key, use_cache, fanout)
+    return result, result_summary, prepared.triage
+
+async def analyze_prepared(prepared, api_key=None, use_cache=True, fanout=ANALYSIS_FANOUT):
+    """
+    Run both analyses of a prepared document concurrently, see analyze()
+
+    Requests for the same PDF, checklist, models and API key made while an analysis
+    of them is running share its result rather than calling the AI service again.
+    """
+    if not ANALYSIS_COALESCE:
+        return await run_analyses(prepared, api_key, use_cache, fanout)
+    key = (
+        prepared.pdf_hash or content_hash(prepared.pdf_bytes),
+        prepared.checklist.source_hash,
+        specialized_only.MODEL,
+        standard_only.MODEL,
+        specialized_only.SPECIALIZED_OUTPUT_FORMAT,
+        fanout,
+        use_cache,
+        content_hash(api_key or ""),  # A request never gets an answer paid with another API key
+    )
+    return await analyses.do(key, run_analyses, prepared, api_key, use_cache, fanout)
+
+async def run_analyses(prepared, api_key=None, use_cache=True, fanout=ANALYSIS_FANOUT):
+    specialized = analyze_specialized_sections if fanout else analyze_prepared_document_json
+    standard = analyze_standard_sections if fanout else analyze_prepared_document
+    # Both analyses wait on the AI service most of the time, so run them side by side
+    result, result_summary = await asyncio.gather(
+        run_blocking(specialized, prepared, api_key, use_cache),
+        run_blocking(standard, prepared, api_key, use_cache),
+    )
+    return result, result_summary
+
+def analysis_response(result, result_summary, triage=None):
+    """
+    Combine the results of both analyses into the /analyze response
+
+    Args:
+        result (dict): Successful specialized result
+        result_summary (dict): Standard result, left out of the response if it failed
+        triage (TriageReport, optional): Triage report of the PDF
+
+    Returns:
+        dict: json_output, standard_report, cached and triage
+    """
+    return {
+        "json_output": result.get("json_output", {}),
+        "standard_report": result_summary.get("standard_report", "") if result_summary.get("success", False) else "",
+        "cached": {
+            "specialized": result.get("cached", False),
+            "standard": result_summary.get("cached", False)
+        },
+        "triage": triage.to_dict() if triage is not None else None
+    }
+
+async def analyze_batch(pdf_contents, checklist, api_key=None, use_cache=True, concurrency=BATCH_CONCURRENCY, fanout=ANALYSIS_FANOUT):
+    """
+    Analyze many documents against one checklist, a bounded number at a time
+
+    Args:
+        pdf_contents (list): Contents of the PDF files or URLs to the PDFs
+        checklist (CompiledChecklist): The checklist, loaded once for the whole batch
+        api_key (str, optional): API key for OpenRouter
+        use_cache (bool, optional): Set to False to bypass the AI response cache
+        concurrency (int, optional): Number of documents analyzed at the same time
+        fanout (bool, optional): Split each analysis into one AI call per group of DV sections
+
+    Yields:
+        dict: One item per document, in the order they finish: its `index` in pdf_contents,
+            `success`, `elapsed_ms`, then the /analyze response fields or `error`
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def analyze_one(index, pdf_content):
+        llm_priority.set(BATCH)  # Interactive analyses get their AI calls first
+        async with semaphore:
+            start = time.perf_counter()
+            item = {"index": index}
+            try:
+                prepared = await run_blocking(prepare_pdf, pdf_content, checklist)
+                result, result_summary = await analyze_prepared(prepared, api_key, use_cache, fanout)
+                if result.get("success", False):
+                    item.update(success=True, **analysis_response(result, result_summary, prepared.triage))
+                else:
+                    item.update(success=False, error=result.get("error", "Unknown error in specialized document analysis"))
+            except TriageError as e:
+                item.update(success=False, error=str(e), reason=e.report.reason, triage=e.report.to_dict())
+            except Exception as e:
+                logger.error("Error in batch item %d: %s", index, e)
+                item.update(success=False, error=str(e))
+            item["elapsed_ms"] = round((time.perf_counter() - start) * 1000)
+            return item
+
+    tasks = [asyncio.ensure_future(analyze_one(index, pdf_content)) for index, pdf_content in enumerate(pdf_contents)]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+    finally:
+        # Stop the remaining documents if the client went away
+        for task in tasks:
+            task.cancel()
+
+async def analyze_stream(pdf_content, checklist_content, api_key=None, use_cache=True):
+    """
+    Run both analyses of a document, reporting progress as it happens
+
+    Args:
+        pdf_content (bytes or str): Content of the PDF file to analyze or URL to the PDF
+        checklist_content (bytes or str): Content of the Excel checklist file or URL to the Excel file
+        api_key (str, optional): API key for OpenRouter
+        use_cache (bool, optional): Set to False to bypass the AI response cache
+
+    Yields:
+        tuple: (event, data) pairs:
+            - ("stage", {"stage": ...}) when the request is accepted, the PDF downloaded,
+              extracted and triaged, and the checklist parsed
+            - ("token", {"report": "specialized" or "standard", "text": ...}) for each piece
+              of the AI reports
+            - ("result", {...}) with the same fields as the /analyze response
+            - ("error", {"stage": ..., "detail": ...}) if the analysis failed, ending the stream;
+              a PDF rejected by triage also gets its `reason` and `triage` report. A failed
+              specialized report is told as soon as it fails, with the fields of build_specialized_error,
+              and the stream ends with the standard report instead of a result
+    """
+    yield "stage", {"stage": "accepted"}
+
+    stage = "download"
+    try:
+        pdf_bytes = await run_blocking(load_content, pdf_content)
+        yield "stage", {"stage": "downloaded", "bytes": len(pdf_bytes)}
+
+        stage = "triage"
+        triage = await run_blocking(inspect_pdf, pdf_bytes)
+
+        stage = "extract"
+        pdf_text = await run_blocking(extract_pdf_text, pdf_bytes)
+        yield "stage", {"stage": "extracted", "characters": len(pdf_text)}
+
+        stage = "triage"
+        await run_blocking(check_text, triage, pdf_text)
+        yield "stage", {"stage": "triaged", "triage": triage.to_dict()}
+
+        stage = "checklist"
+        checklist = await run_blocking(load_checklist, checklist_content)
+        yield "stage", {"stage": "checklist_parsed", "rows": len(checklist.rows)}
+
+        stage = "prompt"
+        prepared = PreparedDocument(pdf_bytes=pdf_bytes, pdf_text=pdf_text, checklist=checklist, triage=triage)
+        specialized_prompt, standard_prompt = await asyncio.gather(
+            run_blocking(build_specialized_prompt, prepared),
+            run_blocking(build_standard_prompt, prepared),
+        )
+    except TriageError as e:
+        yield "error", {"stage": stage, "detail": str(e), "reason": e.report.reason, "triage": e.report.to_dict()}
+        return
+    except Exception as e:
+        logger.error("Error in streamed analysis (%s): %s", stage, e)
+        yield "error", {"stage": stage, "detail": str(e)}
+        return
+
+    # Stream both reports at once, forwarding their pieces as they arrive
+    streams = {
+        "specialized": CompletionStream(specialized_prompt.text, model=specialized_only.MODEL, api_key=api_key, use_cache=use_cache,
+                                        **specialized_only.SPECIALIZED_OPTIONS),
+        "standard": CompletionStream(standard_prompt.text, model=standard_only.MODEL, api_key=api_key, use_cache=use_cache),
+    }
+    queue = asyncio.Queue()
+
+    async def forward(name, stream):
+        try:
+            with span(f"{name}_llm"):
+                async for delta in stream:
+                    queue.put_nowait((name, delta))
+        except Exception as e:
+            queue.put_nowait((name, e))  # This report failed
+        else:
+            queue.put_nowait((name, None))  # This report is over
+
+    tasks = {name: asyncio.create_task(forward(name, stream)) for name, stream in streams.items()}
+    errors = {}
+    try:
+        running = len(tasks)
+        while running:
+            name, delta = await queue.get()
+            if isinstance(delta, str):
+                yield "token", {"report": name, "text": delta}
+                continue
+            running -= 1
+            if delta is not None:
+                errors[name] = delta
+                if name == "specialized":
+                    # Told right away; the standard report goes on streaming
+                    yield "error", {"stage": "specialized", "detail": str(delta), **build_specialized_error(delta)}
+    finally:
+        for task in tasks.values():
+            task.cancel()
+
+    if "specialized" in errors:
+        return
+    result = await run_blocking(build_specialized_result, streams["specialized"].content, specialized_prompt, streams["specialized"].cached)
+
+    if "standard" in errors:
+        result_summary = build_standard_error(errors["standard"])  # We'll continue even if standard analysis fails
+    else:
+        result_summary = build_standard_result(streams["standard"].content, standard_prompt, streams["standard"].cached)
+
+    yield "result", analysis_response(result, result_summary, triage)
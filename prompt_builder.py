@@ -0,0 +1,195 @@
+import os
+import re
+import math
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from checklist import CHECKLIST_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Estimated prompt size above which the document text is deduplicated, then trimmed; 0 disables it
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "120000"))
+# Average characters per token of our French prompts, used to estimate their size
+PROMPT_CHARS_PER_TOKEN = float(os.getenv("PROMPT_CHARS_PER_TOKEN", "3.5"))
+
+# Segments shorter than this are never dropped as duplicates ("oui", "non", dates, ...)
+MIN_DUPLICATE_SEGMENT_CHARS = 24
+TRIM_MARKER = " [...] "
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_SEGMENT_END_RE = re.compile(r"(?<=[.;:!?]) ")
+
+
+@dataclass
+class BuiltPrompt:
+    """
+    Prompt ready to be sent to the AI service
+
+    Attributes:
+        text (str): The prompt
+        estimated_tokens (int): Estimated size of the prompt, in tokens
+        original_tokens (int): Estimated size before deduplication and trimming
+        trimmed (bool): Whether the document text was shortened to fit the budget
+    """
+    text: str
+    estimated_tokens: int
+    original_tokens: int
+    trimmed: bool
+
+
+def estimate_tokens(text):
+    """
+    Estimate the number of tokens of a text without tokenizing it
+
+    Args:
+        text (str): The text
+
+    Returns:
+        int: Estimated number of tokens
+    """
+    return math.ceil(len(text) / PROMPT_CHARS_PER_TOKEN)
+
+def compact_cell(value):
+    return _WHITESPACE_RE.sub(" ", value).strip()
+
+class SerializedChecklists:
+    """
+    Serialized checklists, keyed by the hash of their Excel file then by the rows kept.
+
+    Holds the texts of at most as many checklists as the checklist cache, the
+    least recently used checklist first out, and `max_selections` row selections
+    of each one.
+    """
+
+    def __init__(self, max_checklists, max_selections=64):
+        self.max_checklists = max_checklists
+        self.max_selections = max_selections
+        self.entries = OrderedDict()  # Source hash -> OrderedDict of row indices -> text
+        self.lock = threading.Lock()
+
+    def get(self, source_hash, row_indices):
+        with self.lock:
+            selections = self.entries.get(source_hash)
+            if selections is None or row_indices not in selections:
+                return None
+            self.entries.move_to_end(source_hash)
+            selections.move_to_end(row_indices)
+            return selections[row_indices]
+
+    def put(self, source_hash, row_indices, text):
+        with self.lock:
+            selections = self.entries.setdefault(source_hash, OrderedDict())
+            self.entries.move_to_end(source_hash)
+            selections[row_indices] = text
+            while len(selections) > self.max_selections:
+                selections.popitem(last=False)
+            while len(self.entries) > self.max_checklists:
+                self.entries.popitem(last=False)
+
+
+serialized_checklists = SerializedChecklists(max(1, CHECKLIST_CACHE_SIZE))
+
+def serialize_checklist(checklist, row_indices=None):
+    """
+    Serialize the checklist for the prompt, compactly and without losing any row
+
+    Columns empty in every row are left out, cell whitespace is collapsed and
+    rows repeated verbatim are written once. The text is kept per checklist
+    and row selection, see SerializedChecklists.
+
+    Args:
+        checklist (CompiledChecklist): The compiled checklist
+        row_indices (tuple, optional): Rows to keep, all of them by default
+
+    Returns:
+        str: Header line then one line per row, cells separated by " | "
+    """
+    row_indices = None if row_indices is None else tuple(row_indices)
+    text = serialized_checklists.get(checklist.source_hash, row_indices)
+    if text is not None:
+        return text
+
+    selected = checklist.rows if row_indices is None else [checklist.rows[index] for index in row_indices]
+    rows = [tuple(compact_cell(cell) for cell in row) for row in selected]
+    kept = [index for index in range(len(checklist.columns)) if any(row[index] for row in rows)]
+
+    lines = [" | ".join(compact_cell(checklist.columns[index]) for index in kept)]
+    lines.extend(dict.fromkeys(" | ".join(row[index] for index in kept) for row in rows))
+    text = "\n".join(lines)
+    serialized_checklists.put(checklist.source_hash, row_indices, text)
+    return text
+
+def deduplicate_segments(text):
+    """
+    Drop the sentences of a text that already appeared earlier, like page headers and footers
+
+    Args:
+        text (str): Normalized document text
+
+    Returns:
+        str: The text without repeated segments
+    """
+    seen = set()
+    kept = []
+    for segment in _SEGMENT_END_RE.split(text):
+        if len(segment) >= MIN_DUPLICATE_SEGMENT_CHARS:
+            if segment in seen:
+                continue
+            seen.add(segment)
+        kept.append(segment)
+    return " ".join(kept)
+
+def trim_middle(text, max_chars):
+    """
+    Shorten a text to a number of characters, keeping its beginning and its end
+
+    The end of a DV form holds the signatures, so it is kept as well as the first sections.
+
+    Args:
+        text (str): The text
+        max_chars (int): Maximum length of the result
+
+    Returns:
+        str: The shortened text
+    """
+    if len(text) <= max_chars:
+        return text
+    keep = max(0, max_chars - len(TRIM_MARKER))
+    head = keep * 2 // 3
+    return text[:head] + TRIM_MARKER + text[len(text) - (keep - head):]
+
+def build_prompt(instructions, document, checklist, budget=PROMPT_TOKEN_BUDGET, row_indices=None):
+    """
+    Assemble the prompt of an analysis, keeping it within the token budget
+
+    Args:
+        instructions (str): Instructions given to the AI
+        document (str): Text to analyze
+        checklist (CompiledChecklist): The compiled checklist
+        budget (int, optional): Maximum estimated prompt size in tokens, 0 for no limit
+        row_indices (tuple, optional): Checklist rows to include, all of them by default
+
+    Returns:
+        BuiltPrompt: The prompt and its estimated size
+    """
+    checklist_text = serialize_checklist(checklist, row_indices)
+
+    def assemble(document_text):
+        return instructions + f"\n\n Analyse:{document_text} \n\n Using: {checklist_text}"
+
+    text = assemble(document)
+    original_tokens = estimate_tokens(text)
+    if not budget or original_tokens <= budget:
+        return BuiltPrompt(text, original_tokens, original_tokens, False)
+
+    # Over budget: first drop repeated boilerplate, then cut the middle of the document
+    document = deduplicate_segments(document)
+    text = assemble(document)
+    if estimate_tokens(text) > budget:
+        overflow_chars = math.ceil((estimate_tokens(text) - budget) * PROMPT_CHARS_PER_TOKEN)
+        text = assemble(trim_middle(document, len(document) - overflow_chars))
+
+    logger.info("Prompt over budget (%d > %d tokens), document shortened to %d tokens", original_tokens, budget, estimate_tokens(text))
+    return BuiltPrompt(text, estimate_tokens(text), original_tokens, True)
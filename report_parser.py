@@ -0,0 +1,325 @@
+import re
+import json
+
+# Titles of the "## " sections of the specialized report, French and English
+SECTION_TITLES = {
+    "summary": ("Évaluation Sommaire", "Summary Evaluation", "Résumé de l'Analyse"),
+    "actions": ("RECOMMANDATIONS", "RECOMMENDED ACTIONS", "Actions Recommandées"),
+    "warnings": ("AVERTISSEMENTS", "WARNINGS", "Avertissements"),
+    "overview": ("Aperçu du Document", "Document Overview"),
+}
+
+_WHITESPACE_RE = re.compile(r"\s*")
+
+
+class EntryFormat:
+    """
+    Labelled fields of the entries of a report section, e.g. **Section**: ... **Action Requise**: ...
+
+    Attributes:
+        labels (list): Compiled label of each field, in the order they appear
+        boundary (re.Pattern): What ends the last field of an entry, besides the end of the section
+        optional_bold (bool): Whether the labels may lack their ** markers
+    """
+
+    def __init__(self, labels, boundary, optional_bold=False):
+        self.labels = [re.compile(label) for label in labels]
+        self.boundary = re.compile(boundary)
+        self.optional_bold = optional_bold
+
+    def value_end(self, text, start, label_start):
+        """End of the field value running from `start` to the label at `label_start`, whitespace excluded"""
+        end = label_start
+        if self.optional_bold and end - 2 >= start and text[end - 2:end] == "**":
+            end -= 2
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        return end
+
+    def find_entries(self, text):
+        """
+        Extract the field values of every entry of a section
+
+        Each field runs to the first next label, the last one to the boundary:
+        the text is read once, whatever its formatting. Once a label is
+        missing, no later entry can be complete, so the search stops.
+
+        Args:
+            text (str): The section
+
+        Returns:
+            list: The stripped field values of each complete entry
+        """
+        entries = []
+        position = 0
+        while True:
+            first = self.labels[0].search(text, position)
+            if first is None:
+                return entries
+            start = _WHITESPACE_RE.match(text, first.end()).end()
+            values = []
+            for label in self.labels[1:]:
+                found = label.search(text, start)
+                if found is None:
+                    return entries
+                values.append(text[start:self.value_end(text, start, found.start())].strip())
+                start = _WHITESPACE_RE.match(text, found.end()).end()
+            boundary = self.boundary.search(text, start)
+            position = boundary.start() if boundary is not None else len(text)
+            values.append(text[start:position].strip())
+            entries.append(values)
+
+
+# Entries as the prompt asks for them, then without the ** markers or with English labels
+ACTION_FORMATS = (
+    EntryFormat(
+        [r"\*\*Section\*\*:", r"\*\*Action Requise\*\*:", r"\*\*Priorité\*\*:", r"\*\*(?:Échéancier|Délai)\*\*:"],
+        r"\n\n\*\*Section|\n\n##",
+    ),
+    EntryFormat(
+        [r"Section(?:\*\*)?\s*:", r"Action (?:Requise|Required)(?:\*\*)?\s*:", r"(?:Priorité|Priority)(?:\*\*)?\s*:",
+         r"(?:Échéancier|Délai|Timeline)(?:\*\*)?\s*:"],
+        r"\n\n(?:\*\*)?Section|\n\n##",
+        optional_bold=True,
+    ),
+)
+WARNING_FORMATS = (
+    EntryFormat(
+        [r"\*\*(?:Niveau de Risque|Risque Level)\*\*:", r"\*\*(?:Problème|Issue)\*\*:",
+         r"\*\*(?:Conséquences Potentielles|Potential Consequences)\*\*:", r"\*\*(?:Atténuation|Mitigation)\*\*:"],
+        r"\n\n\*\*(?:Niveau de Risque|Risque Level)|\n\n##",
+    ),
+    EntryFormat(
+        [r"(?:Niveau de Risque|Risque Level)(?:\*\*)?\s*:", r"(?:Problème|Issue)(?:\*\*)?\s*:",
+         r"(?:Conséquences Potentielles|Potential Consequences)(?:\*\*)?\s*:", r"(?:Atténuation|Mitigation)(?:\*\*)?\s*:"],
+        r"\n\n(?:\*\*)?(?:Niveau de Risque|Risque Level)|\n\n##",
+        optional_bold=True,
+    ),
+)
+ACTION_KEYS = ("section", "action_required", "priority", "timeline")
+WARNING_KEYS = ("risk_level", "issue", "potential_consequences", "mitigation")
+
+# Buyers named in the summary, most specific wording first
+BUYERS_PATTERNS = (
+    (re.compile(r"acheteurs? (.*?)(?:est|sont) (.*?)\.?$", re.IGNORECASE | re.MULTILINE), 2),
+    (re.compile(r"celle des acheteurs (.*?)(?:est|sont)? (.*?)\.?$", re.IGNORECASE | re.MULTILINE), 1),
+    (re.compile(r"acheteurs? (.*?)\.?$", re.IGNORECASE | re.MULTILINE), 1),
+)
+
+# Fields of the overview section
+OVERVIEW_PATTERNS = {
+    "vendor": re.compile(r"\*\*(?:Vendeur\(s\)|Vendor\(s\))\*\*:\s*(.*?)(?=\n\-|\Z)", re.DOTALL),
+    "date": re.compile(r"\*\*Date\*\*:\s*(.*?)(?=\n\-|\Z)", re.DOTALL),
+    "property_type": re.compile(r"\*\*(?:Type de Propriété|Property Type)\*\*:\s*(.*?)(?=\n\-|\Z)", re.DOTALL),
+}
+SCORE_PATTERN = re.compile(r"\*\*(?:Score Global|Overall Score)\*\*:\s*(.*?)%")
+
+
+def split_sections(report_text):
+    """
+    Find the body of each known section of the report, in one pass
+
+    A section starts at the first "## <title>" of its titles and its body runs
+    to the next "##", wherever it is, or to the end of the report.
+
+    Args:
+        report_text (str): The specialized report
+
+    Returns:
+        dict: Body of each section found, by name (summary, actions, warnings, overview)
+    """
+    sections = {}
+    mark = report_text.find("## ")
+    while mark != -1 and len(sections) < len(SECTION_TITLES):
+        for name, titles in SECTION_TITLES.items():
+            if name in sections:
+                continue
+            title = next((title for title in titles if report_text.startswith(title, mark + 3)), None)
+            if title is not None:
+                start = mark + 3 + len(title)
+                end = report_text.find("##", start)
+                sections[name] = report_text[start:end if end != -1 else len(report_text)]
+                break
+        mark = report_text.find("## ", mark + 1)
+    return sections
+
+def find_buyers(summary):
+    if "acheteur" not in summary.lower():  # Every pattern needs the word
+        return ""
+    for pattern, group in BUYERS_PATTERNS:
+        match = pattern.search(summary)
+        if match:
+            return match.group(group).strip()
+    return ""
+
+def parse_entries(section, formats, keys):
+    """Entries of a section, in the first format that finds any"""
+    for entry_format in formats:
+        entries = entry_format.find_entries(section)
+        if entries:
+            return [dict(zip(keys, values)) for values in entries]
+    return []
+
+def parse_specialized_report(report_text):
+    """
+    Parse the specialized report into a structured JSON format with summary,
+    recommended_actions, and warnings sections
+
+    Args:
+        report_text (str): The specialized report text from the AI
+
+    Returns:
+        dict: A structured dictionary with the parsed content
+    """
+    result = {
+        "summary": "",
+        "recommended_actions": [],
+        "warnings": [],
+        "vendor": "",
+        "buyers": "",
+        "date": "",
+        "property_type": "",
+        "overall_score": ""
+    }
+    sections = split_sections(report_text)
+
+    if "summary" in sections:
+        result["summary"] = sections["summary"].strip()
+        result["buyers"] = find_buyers(result["summary"])
+
+    if sections.get("actions"):
+        result["recommended_actions"] = parse_entries(sections["actions"], ACTION_FORMATS, ACTION_KEYS)
+
+    if "warnings" in sections:
+        result["warnings"] = parse_entries(sections["warnings"], WARNING_FORMATS, WARNING_KEYS)
+
+    if "overview" in sections:
+        overview_text = sections["overview"]
+        for field, pattern in OVERVIEW_PATTERNS.items():
+            match = pattern.search(overview_text)
+            if match:
+                result[field] = match.group(1).strip()
+        score_match = SCORE_PATTERN.search(overview_text)
+        if score_match:
+            result["overall_score"] = score_match.group(1).strip()
+
+    return result
+
+
+# JSON schema of the specialized report, for AI services supporting structured outputs
+SPECIALIZED_REPORT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "vendor": {"type": "string", "description": "Noms du ou des vendeurs"},
+        "buyers": {"type": "string", "description": "Noms du ou des acheteurs, dans la partie des signatures"},
+        "date": {"type": "string"},
+        "property_type": {"type": "string"},
+        "overall_score": {"type": "number", "description": "Score global de conformité, en pourcentage"},
+        "summary": {"type": "string", "description": "Bref paragraphe d'évaluation générale"},
+        "recommended_actions": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "section": {"type": "string"},
+                    "action_required": {"type": "string"},
+                    "priority": {"type": "string", "enum": ["High", "Medium", "Low"]},
+                    "timeline": {"type": "string"},
+                },
+                "required": list(ACTION_KEYS),
+                "additionalProperties": False,
+            },
+        },
+        "warnings": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "risk_level": {"type": "string", "enum": ["Critical", "High", "Medium"]},
+                    "issue": {"type": "string"},
+                    "potential_consequences": {"type": "string"},
+                    "mitigation": {"type": "string"},
+                },
+                "required": list(WARNING_KEYS),
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["vendor", "buyers", "date", "property_type", "overall_score", "summary", "recommended_actions", "warnings"],
+    "additionalProperties": False,
+}
+
+# response_format parameter asking OpenRouter for a report following the schema
+SPECIALIZED_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "specialized_report", "strict": True, "schema": SPECIALIZED_REPORT_SCHEMA},
+}
+
+STRING_FIELDS = ("vendor", "buyers", "date", "property_type", "summary")
+_CODE_FENCE_RE = re.compile(r"^\s*```(?:json)?\s*(.*?)\s*```\s*$", re.DOTALL)
+
+
+class ReportFormatError(ValueError):
+    """Raised when a structured report does not follow the schema"""
+
+    def __init__(self, message, reason):
+        super().__init__(message)
+        self.reason = reason  # invalid_json or schema
+
+
+def check_entries(value, keys, field):
+    if not isinstance(value, list):
+        raise ReportFormatError(f"{field} is not a list", "schema")
+    entries = []
+    for entry in value:
+        if not isinstance(entry, dict) or not all(isinstance(entry.get(key), str) for key in keys):
+            raise ReportFormatError(f"{field} has an entry without {', '.join(keys)}", "schema")
+        entries.append({key: entry[key].strip() for key in keys})
+    return entries
+
+def parse_structured_report(report_text):
+    """
+    Read a specialized report written as JSON following SPECIALIZED_REPORT_SCHEMA
+
+    Only what the result relies on is checked (fields present, of the right
+    type), by hand: it costs microseconds. Values outside the enums of the
+    schema are kept as they are.
+
+    Args:
+        report_text (str): The JSON answer of the AI, possibly in a ``` block
+
+    Returns:
+        dict: The same fields as parse_specialized_report, overall_score as a string without "%"
+
+    Raises:
+        ReportFormatError: If the text is not JSON, misses a required field or has one of the wrong type
+    """
+    fenced = _CODE_FENCE_RE.match(report_text)
+    try:
+        data = json.loads(fenced.group(1) if fenced else report_text)
+    except ValueError as e:
+        raise ReportFormatError(f"Report is not JSON: {e}", "invalid_json")
+    if not isinstance(data, dict):
+        raise ReportFormatError("Report is not a JSON object", "schema")
+
+    missing = [field for field in SPECIALIZED_REPORT_SCHEMA["required"] if field not in data]
+    if missing:
+        raise ReportFormatError(f"Report misses {', '.join(missing)}", "schema")
+
+    result = {}
+    for field in STRING_FIELDS:
+        value = data[field]
+        if not isinstance(value, str):
+            raise ReportFormatError(f"{field} is not a string", "schema")
+        result[field] = value.strip()
+
+    score = data["overall_score"]
+    if isinstance(score, bool) or not isinstance(score, (int, float)):
+        raise ReportFormatError("overall_score is not a number", "schema")
+    if isinstance(score, float) and score.is_integer():
+        score = int(score)
+    result["overall_score"] = str(score)
+
+    result["recommended_actions"] = check_entries(data["recommended_actions"], ACTION_KEYS, "recommended_actions")
+    result["warnings"] = check_entries(data["warnings"], WARNING_KEYS, "warnings")
+    return {key: result[key] for key in ("summary", "recommended_actions", "warnings", "vendor", "buyers", "date", "property_type", "overall_score")}
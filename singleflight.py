@@ -0,0 +1,71 @@
+import asyncio
+import logging
+from observability import REGISTRY, Gauge
+
+logger = logging.getLogger(__name__)
+
+COALESCED_REQUESTS = REGISTRY.counter("coalesced_requests_total", "Requests that waited on an identical computation already running", ["operation"])
+
+_groups = []  # Every SingleFlight, for the in-flight gauge
+
+
+class SingleFlight:
+    """
+    Identical computations running at the same time, done once.
+
+    The first caller of a key starts the computation in a task; callers of the
+    same key arriving before it ends wait on that task and get its result, or
+    its exception. A caller going away does not stop the computation for the
+    others; it is cancelled only once nobody waits on it any more.
+    """
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.calls = {}  # Key -> [task, number of callers waiting on it]
+        _groups.append(self)
+
+    def in_flight(self):
+        return len(self.calls)
+
+    async def do(self, key, func, *args, **kwargs):
+        """
+        Run `await func(*args, **kwargs)`, or join the identical run in progress
+
+        Args:
+            key (hashable): Identity of the computation, e.g. content hashes and model
+            func (callable): Coroutine function computing the result
+
+        Returns:
+            Any: The result of the computation, shared by every caller of the key
+        """
+        call = self.calls.get(key)
+        if call is None:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            call = self.calls[key] = [task, 0]
+            task.add_done_callback(lambda _: self.calls.pop(key, None) if self.calls.get(key) is call else None)
+        else:
+            COALESCED_REQUESTS.inc(operation=self.operation)
+            logger.info("Identical %s already running, waiting for its result", self.operation)
+
+        task = call[0]
+        call[1] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done() and call[1] == 1:
+                # This was the last caller waiting; later ones start afresh
+                if self.calls.get(key) is call:
+                    del self.calls[key]
+                task.cancel()
+            raise
+        finally:
+            call[1] -= 1
+
+
+def in_flight_metrics():
+    gauge = Gauge("coalescing_in_flight", "Distinct computations running that identical requests may join", ["operation"])
+    for group in _groups:
+        gauge.set(group.in_flight(), operation=group.operation)
+    return [gauge]
+
+REGISTRY.add_collector(in_flight_metrics)
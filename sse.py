@@ -0,0 +1,63 @@
+import os
+import json
+import asyncio
+
+# Seconds without an event after which a comment is sent so that proxies keep the connection open
+SSE_KEEPALIVE_SECONDS = float(os.getenv("SSE_KEEPALIVE_SECONDS", "10"))
+
+# Headers of Server-Sent Events responses; X-Accel-Buffering stops nginx-style proxies from buffering
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+}
+
+KEEPALIVE_COMMENT = ": keep-alive\n\n"
+
+
+def format_event(event, data):
+    """
+    Format a Server-Sent Event
+
+    Args:
+        event (str): Event name
+        data (dict): Event payload, sent as JSON
+
+    Returns:
+        str: The event, ready to be written to the response
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def event_stream(events, keepalive=SSE_KEEPALIVE_SECONDS):
+    """
+    Format (event, data) pairs as Server-Sent Events, adding keep-alive comments while idle
+
+    Args:
+        events (async iterable): The (event name, payload) pairs to send
+        keepalive (float, optional): Seconds of silence before a keep-alive comment
+
+    Yields:
+        str: Formatted events and keep-alive comments
+    """
+    iterator = events.__aiter__()
+    next_event = asyncio.ensure_future(iterator.__anext__())
+    try:
+        while True:
+            done, _ = await asyncio.wait({next_event}, timeout=keepalive)
+            if not done:
+                yield KEEPALIVE_COMMENT
+                continue
+            try:
+                event, data = next_event.result()
+            except StopAsyncIteration:
+                return
+            yield format_event(event, data)
+            next_event = asyncio.ensure_future(iterator.__anext__())
+    finally:
+        # The client went away or the stream ended: stop producing events
+        if not next_event.done():
+            next_event.cancel()
+            try:
+                await next_event
+            except (asyncio.CancelledError, Exception):
+                pass
+        await iterator.aclose()
@@ -1,10 +1,13 @@
 import os
-import fitz  # PyMuPDF for PDF handling
-import pandas as pd
+import logging
 from dotenv import load_dotenv
-import requests
-import json
-from io import BytesIO
+from llm_client import complete, DEFAULT_MODEL
+from prompt_builder import build_prompt
+from ingestion import prepare_document
+from observability import span
+# Re-exported: these were defined in this module before they moved, and scripts still import them from here
+from llm_client import call_agent
+from ingestion import download_from_url, extract_pdf_text
 # from reportlab.lib.pagesizes import A4
 # from reportlab.pdfgen import canvas
 # from reportlab.lib.units import mm
@@ -13,79 +16,9 @@ from datetime import datetime
 
 # Load API key from environment variables
 load_dotenv()
+logger = logging.getLogger(__name__)
 # MODEL = "anthropic/claude-3.7-sonnet"  # Model to be used for API calls
-MODEL = "google/gemini-2.0-flash-001" 
-
-# Function to download content from a URL
-def download_from_url(url):
-    """
-    Download content from a URL
-    
-    Args:
-        url (str): URL to download content from
-        
-    Returns:
-        bytes: Downloaded content
-    """
-    try:
-        response = requests.get(url)
-        response.raise_for_status()  # Raise an exception for HTTP errors
-        return response.content
-    except Exception as e:
-        print(f"Error downloading from {url}: {str(e)}")
-        raise Exception(f"Failed to download content from URL: {str(e)}")
-
-# Function to extract text from a PDF file
-def extract_pdf_text(file_content):
-    """
-    Extract text from PDF content
-    
-    Args:
-        file_content (bytes or str): Either PDF file content as bytes or URL to PDF
-        
-    Returns:
-        str: Extracted text from the PDF
-    """
-    # If file_content is a URL, download the content
-    if isinstance(file_content, str) and (file_content.startswith('http://') or file_content.startswith('https://')):
-        file_content = download_from_url(file_content)
-        
-    doc = fitz.open(stream=file_content, filetype="pdf")  # Open the PDF file
-    text = ""
-    for page in doc:  # Iterate through each page
-        text += page.get_text()  # Extract text from the page
-    return text.lower().replace("\n", " ").replace("  ", " ")  # Clean up the text
-
-# Function to call the Claude AI agent with a prompt
-def call_agent(prompt, model=MODEL, api_key=None):
-    
-    if not api_key:
-        raise Exception("No API key provided for AI service")
-        
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": "https://yourapplication.com/",  # Update with your application's URL
-    }
-
-    payload = {
-        "model": model,
-        "messages": [{"role": "user", "content": prompt}]
-    }
-
-    # Make a POST request to the AI API
-    response = requests.post(
-        "https://openrouter.ai/api/v1/chat/completions",
-        headers=headers,
-        data=json.dumps(payload)  # Convert payload to JSON
-    )
-
-    if response.status_code == 200:
-        return response.json()["choices"][0]["message"]["content"]  # Return the AI's response
-    else:
-        error_message = f"Error: {response.status_code}, {response.text}"
-        print(error_message)  # Log error
-        raise Exception(f"API call failed: {error_message}")
+MODEL = os.getenv("STANDARD_MODEL", DEFAULT_MODEL)
 
 # # Function to convert text to a PDF using ReportLab
 # def text_to_pdf(text, max_width=170*mm):
@@ -127,66 +60,51 @@ def call_agent(prompt, model=MODEL, api_key=None):
 #     buffer.seek(0)  # Move to the beginning of the buffer
 #     return buffer   # Return the buffer containing the PDF
 
-def analyze_real_estate_document(pdf_file_content, checklist_file_content, api_key=None):
+# Function to check the checklist's validation points against the PDF text
+@span("standard_checks")
+def build_standard_blocks(checklist, pdf_text):
     """
-    Analyze a real estate document against a compliance checklist and provide only standard report
-    
+    Give every clause of the checklist a status depending on which of its validation
+    points appear in the PDF text
+
     Args:
-        pdf_file_content (bytes or str): Content of the PDF file to analyze or URL to the PDF
-        checklist_file_content (bytes or str): Content of the Excel checklist file or URL to the Excel file
-        api_key (str, optional): API key for OpenRouter. Defaults to environment variable.
-        
+        checklist (CompiledChecklist): The compiled checklist
+        pdf_text (str): Normalized text extracted from the PDF
+
     Returns:
-        dict: A dictionary containing the standard report as a string and success status
+        list: One "### code - name" block per clause, in checklist order, with its status and missing points
     """
-    try:
-        print(f"Starting standard analysis. PDF type: {type(pdf_file_content)}, Checklist type: {type(checklist_file_content)}")
-        
-        # Extract text from the PDF (URL or content)
-        pdf_text = extract_pdf_text(pdf_file_content)
-        print(f"PDF text extracted, length: {len(pdf_text)} characters")
-        
-        # Process the checklist file (URL or content)
-        if isinstance(checklist_file_content, str) and (checklist_file_content.startswith('http://') or checklist_file_content.startswith('https://')):
-            checklist_content = download_from_url(checklist_file_content)
-            checklist_buffer = BytesIO(checklist_content)
-        else:
-            checklist_buffer = BytesIO(checklist_file_content)
-        
-        # Read the checklist from the Excel file
-        try:
-            checklist = pd.read_excel(checklist_buffer)
-            print(f"Checklist loaded, shape: {checklist.shape}")
-        except Exception as e:
-            print(f"Error reading Excel file: {str(e)}")
-            raise Exception(f"Failed to read Excel checklist: {str(e)}")
-        
-        results = []  # List to hold analysis results
-        for index, row in checklist.iterrows():  # Iterate through each row in the checklist
-            clause_id = row["Code form."]  # Get clause ID
-            clause_name = row["Nom de la clause"]  # Get clause name
-            validations = str(row["Éléments de validation"])  # Get validation elements
+    found = checklist.matcher.find(pdf_text)  # Every validation point present in the text, in one pass
+
+    results = []  # List to hold analysis results
+    for clause in checklist.clauses:  # Iterate through each clause of the checklist
+        status = "✅ Conforme"  # Default status
+        missing = []  # List to hold missing items
 
-            status = "✅ Conforme"  # Default status
-            missing = []  # List to hold missing items
+        for point in clause.validation_points:  # Check each validation point
+            if point not in found:  # Check if the point is missing in the PDF text
+                status = "🟡 Partiellement conforme"  # Update status if partially compliant
+                missing.append(point)  # Add missing point to the list
 
-            for point in validations.split("-"):  # Check each validation point
-                point = point.strip().lower()  # Clean up the point
-                if point and point not in pdf_text:  # Check if the point is missing in the PDF text
-                    status = "🟡 Partiellement conforme"  # Update status if partially compliant
-                    missing.append(point)  # Add missing point to the list
+        if any("rapport" in m for m in missing):  # Check for specific missing items
+            status = "🔴 Non conforme"  # Update status if non-compliant
 
-            if any("rapport" in m for m in missing):  # Check for specific missing items
-                status = "🔴 Non conforme"  # Update status if non-compliant
+        # Append the result for this clause
+        results.append(f"### {clause.code} - {clause.name}\nStatus: {status}\nMissing: {', '.join(missing) if missing else 'None'}\n")
 
-            # Append the result for this clause
-            results.append(f"### {clause_id} - {clause_name}\nStatus: {status}\nMissing: {', '.join(missing) if missing else 'None'}\n")
+    return results
 
-        standard_analysis = "".join(results)  # Combine results into a single string
-        print("Completed standard initial analysis")
+def build_standard_analysis(checklist, pdf_text):
+    """
+    Run the pre-analysis of the whole checklist, see build_standard_blocks
+
+    Returns:
+        str: The blocks of every clause, combined into a single string
+    """
+    return "".join(build_standard_blocks(checklist, pdf_text))
 
-        # Prompts for AI analysis
-        std_prompt = """
+# Standard prompt sent to the AI service, followed by the pre-analysis and the checklist
+STD_PROMPT = """
         <Instruction>
         You are an expert real estate assistant specializing in form validation and compliance analysis. Your task is to analyze a "Déclarations du vendeur" (DV) form based on a detailed validation table that outlines expected responses, required documents, and critical checks for each section (DV1 to DV16).
 
@@ -239,25 +157,97 @@ def analyze_real_estate_document(pdf_file_content, checklist_file_content, api_k
         A missing signature or D15 clarification on a critical item may invalidate the form.        
         """
 
-        # Prepare prompt for the AI
-        standard_prompt = std_prompt + f"""\n\n Analyse:{standard_analysis} \n\n Using:{checklist}"""
-        print("Sending prompt to AI std service...")
+@span("standard_prompt")
+def build_standard_prompt(prepared):
+    """
+    Run the pre-analysis and build the prompt of the standard analysis
+
+    Args:
+        prepared (PreparedDocument): PDF text and checklist produced by prepare_document
+
+    Returns:
+        BuiltPrompt: Prompt for the AI, kept within the token budget
+    """
+    standard_analysis = build_standard_analysis(prepared.checklist, prepared.pdf_text)
+    logger.info("Completed standard initial analysis")
+    return build_prompt(STD_PROMPT, standard_analysis, prepared.checklist)
+
+def build_standard_result(standard_report, prompt, cached=False):
+    """
+    Turn the standard report of the AI into the result returned by the API
+
+    Args:
+        standard_report (str): The standard report text from the AI
+        prompt (BuiltPrompt): The prompt the report answers
+        cached (bool, optional): Whether the report came from the AI response cache
+
+    Returns:
+        dict: The analysis result, see analyze_prepared_document
+    """
+    logger.info("Received AI response, length: %d characters", len(standard_report))
+    logger.debug("Standard report: %s", standard_report)
+    
+    # Return the final result with success status
+    return {
+        "standard_report": standard_report,
+        "cached": cached,
+        "prompt_tokens": prompt.estimated_tokens,
+        "prompt_trimmed": prompt.trimmed,
+        "success": True,
+        "timestamp": datetime.now().strftime("%Y%m%d_%H%M%S")
+    }
 
-        standard_report = call_agent(standard_prompt, api_key=api_key)  # Get standard report
-        print(f"Received AI response, length: {len(standard_report)} characters")
+def build_standard_error(error):
+    logger.error("Error in standard analysis: %s", error)
+    return {
+        "error": str(error),
+        "standard_report": None,
+        "success": False,
+        "timestamp": datetime.now().strftime("%Y%m%d_%H%M%S")
+    }
+
+def analyze_prepared_document(prepared, api_key=None, use_cache=True):
+    """
+    Run the standard analysis on a document that was already downloaded and parsed
+
+    Args:
+        prepared (PreparedDocument): PDF text and checklist produced by prepare_document
+        api_key (str, optional): API key for OpenRouter. Defaults to environment variable.
+        use_cache (bool, optional): Set to False to bypass the AI response cache
+
+    Returns:
+        dict: A dictionary containing the standard report as a string, whether it came from
+            the AI response cache and success status
+    """
+    try:
+        prompt = build_standard_prompt(prepared)
+        logger.info("Sending prompt to AI std service (~%d tokens)...", prompt.estimated_tokens)
+
+        with span("standard_llm"):
+            completion = complete(prompt.text, model=MODEL, api_key=api_key, use_cache=use_cache)  # Get standard report
+        return build_standard_result(completion.content, prompt, completion.cached)
         
-        # Return the final result with success status
-        return {
-            "standard_report": standard_report,
-            "success": True,
-            "timestamp": datetime.now().strftime("%Y%m%d_%H%M%S")
-        }
+    except Exception as e:
+        return build_standard_error(e)
+
+def analyze_real_estate_document(pdf_file_content, checklist_file_content, api_key=None):
+    """
+    Analyze a real estate document against a compliance checklist and provide only standard report
+    
+    Args:
+        pdf_file_content (bytes or str): Content of the PDF file to analyze or URL to the PDF
+        checklist_file_content (bytes or str): Content of the Excel checklist file or URL to the Excel file
+        api_key (str, optional): API key for OpenRouter. Defaults to environment variable.
+        
+    Returns:
+        dict: A dictionary containing the standard report as a string and success status
+    """
+    try:
+        logger.info("Starting standard analysis. PDF type: %s, Checklist type: %s", type(pdf_file_content), type(checklist_file_content))
         
+        # Download the inputs, extract the PDF text and read the checklist
+        prepared = prepare_document(pdf_file_content, checklist_file_content)
     except Exception as e:
-        print(f"Error in standard analysis: {str(e)}")
-        return {
-            "error": str(e),
-            "standard_report": None,
-            "success": False,
-            "timestamp": datetime.now().strftime("%Y%m%d_%H%M%S")
-        } 
\ No newline at end of file
+        return build_standard_error(e)
+
+    return analyze_prepared_document(prepared, api_key)
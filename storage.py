@@ -0,0 +1,411 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from email.utils import formatdate
+from urllib.parse import quote, unquote
+from downloader import fetch, get_session, DownloadError, DOWNLOAD_CONNECT_TIMEOUT, DOWNLOAD_READ_TIMEOUT
+from observability import span, register_cache
+
+logger = logging.getLogger(__name__)
+
+# Supabase project the buckets belong to, and the key for private buckets (public URLs are used without it)
+SUPABASE_URL = os.getenv("SUPABASE_URL", "").rstrip("/")
+SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")
+# Directory standing in for Supabase, holding <bucket>/<object>; set, it replaces the Supabase project
+STORAGE_LOCAL_ROOT = os.getenv("STORAGE_LOCAL_ROOT", "")
+# Directory of the read-through mirror of the buckets; unset disables it
+STORAGE_MIRROR_DIR = os.getenv("STORAGE_MIRROR_DIR", "")
+STORAGE_MIRROR_MAX_MB = float(os.getenv("STORAGE_MIRROR_MAX_MB", "1024"))  # Disk used by the mirror, least recently read first out
+STORAGE_MIRROR_TTL = float(os.getenv("STORAGE_MIRROR_TTL", "300"))         # Seconds a mirrored object is served without revalidation
+STORAGE_PREWARM_BUCKETS = [bucket for bucket in os.getenv("STORAGE_PREWARM_BUCKETS", "compliance-files").split(",") if bucket]
+
+DOCUMENTS_BUCKET = "documents"            # DV forms uploaded by the brokers
+CHECKLISTS_BUCKET = "compliance-files"    # Compliance checklists
+# Buckets the API inputs may reference; the service role key could read every other one of the project
+STORAGE_BUCKETS = [bucket for bucket in os.getenv("STORAGE_BUCKETS", f"{DOCUMENTS_BUCKET},{CHECKLISTS_BUCKET}").split(",") if bucket]
+
+REF_SCHEME = "supabase://"
+PUBLIC_PATH = "/storage/v1/object/public/"
+
+
+def parse_ref(content):
+    """
+    Read a bucket/object reference
+
+    Accepts "supabase://<bucket>/<object>" and the public URLs of the configured
+    Supabase project, ".../storage/v1/object/public/<bucket>/<object>".
+
+    Args:
+        content: An input of the API
+
+    Returns:
+        tuple: (bucket, object path), or None if the input is not a storage reference
+    """
+    if not isinstance(content, str):
+        return None
+    if content.startswith(REF_SCHEME):
+        rest = content[len(REF_SCHEME):]
+    elif SUPABASE_URL and content.startswith(SUPABASE_URL + PUBLIC_PATH):
+        rest = unquote(content[len(SUPABASE_URL + PUBLIC_PATH):].split("?", 1)[0])
+    else:
+        return None
+    bucket, _, path = rest.partition("/")
+    if not bucket or not path:
+        return None
+    return bucket, path
+
+def is_storage_ref(content):
+    return parse_ref(content) is not None
+
+
+class StorageRefError(DownloadError):
+    """Raised when an input references an object the API may not read"""
+
+    def __init__(self, message):
+        super().__init__(message, 400)
+
+def check_ref(content):
+    """
+    Reject a storage reference outside the STORAGE_BUCKETS allowlist
+
+    Args:
+        content: An input of the API; inputs other than storage references pass
+
+    Raises:
+        StorageRefError: If the input references another bucket, or climbs out of its bucket
+    """
+    ref = parse_ref(content)
+    if ref is None:
+        return
+    bucket, path = ref
+    if bucket not in STORAGE_BUCKETS:
+        raise StorageRefError(f"Bucket not allowed: {bucket}")
+    if ".." in path.replace("\\", "/").split("/"):
+        raise StorageRefError(f"Invalid object path: {bucket}/{path}")
+
+
+class LocalBackend:
+    """Buckets as subdirectories of a local directory, standing in for Supabase in tests"""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def _path(self, bucket, path):
+        directory = os.path.abspath(os.path.join(self.root, bucket))
+        full = os.path.abspath(os.path.join(directory, path))
+        if not directory.startswith(self.root + os.sep) or not (full + os.sep).startswith(directory + os.sep):
+            raise DownloadError(f"Invalid object path: {bucket}/{path}", 400)
+        return full
+
+    def fetch(self, bucket, path, validators=None):
+        """
+        Read an object, or tell that it did not change since its validators
+
+        Returns:
+            tuple: The status (200 or 304), the content (None on a 304) and the object's validators
+        """
+        full = self._path(bucket, path)
+        try:
+            stat = os.stat(full)
+        except FileNotFoundError:
+            raise DownloadError(f"Object not found: {bucket}/{path}", 404)
+        current = {"last_modified": formatdate(stat.st_mtime, usegmt=True), "etag": f'"{stat.st_mtime_ns}-{stat.st_size}"'}
+        if validators and validators.get("etag") == current["etag"]:
+            return 304, None, current
+        with open(full, "rb") as f:
+            return 200, f.read(), current
+
+    def list(self, bucket):
+        directory = self._path(bucket, ".")
+        for parent, _, files in os.walk(directory):
+            for name in files:
+                yield os.path.relpath(os.path.join(parent, name), directory).replace(os.sep, "/")
+
+
+class SupabaseBackend:
+    """Objects of a Supabase project, through its Storage REST API"""
+
+    def __init__(self, base_url, key=""):
+        self.base_url = base_url
+        self.key = key
+
+    def _headers(self):
+        return {"Authorization": f"Bearer {self.key}", "apikey": self.key} if self.key else {}
+
+    def fetch(self, bucket, path, validators=None):
+        """See LocalBackend.fetch"""
+        visibility = "" if self.key else "public/"  # With a key, private buckets can be read too
+        url = f"{self.base_url}/storage/v1/object/{visibility}{quote(bucket)}/{quote(path)}"
+        headers = self._headers()
+        if validators and validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators and validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+        status, body, response_headers = fetch(url, headers)
+        current = {"etag": response_headers.get("ETag"), "last_modified": response_headers.get("Last-Modified")}
+        if status == 304:
+            current = {key: current[key] or (validators or {}).get(key) for key in current}
+        return status, body, current
+
+    def list(self, bucket, prefix=""):
+        """Paths of the objects of a bucket, folders walked recursively"""
+        offset = 0
+        while True:
+            response = get_session().post(
+                f"{self.base_url}/storage/v1/object/list/{quote(bucket)}",
+                headers=self._headers(),
+                json={"prefix": prefix, "limit": 1000, "offset": offset, "sortBy": {"column": "name", "order": "asc"}},
+                timeout=(DOWNLOAD_CONNECT_TIMEOUT, DOWNLOAD_READ_TIMEOUT),
+            )
+            if response.status_code >= 400:
+                raise DownloadError(f"Cannot list bucket {bucket}: {response.status_code} {response.text[:200]}", response.status_code)
+            entries = response.json()
+            for entry in entries:
+                name = f"{prefix}{entry['name']}"
+                if entry.get("id") is None:  # Folders have no id
+                    yield from self.list(bucket, f"{name}/")
+                else:
+                    yield name
+            if len(entries) < 1000:
+                return
+            offset += len(entries)
+
+
+class StorageMirror:
+    """
+    Read-through mirror of storage objects on local disk.
+
+    An object is read from the backend the first time, then served from disk.
+    After `ttl` seconds it is revalidated: an unchanged object costs a 304 (or a
+    stat for a local backend). The mirror is bounded by size, the least recently
+    read objects are evicted first. Without a directory, every read goes to the backend.
+    """
+
+    def __init__(self, backend, directory=None, max_bytes=0, ttl=STORAGE_MIRROR_TTL):
+        self.backend = backend
+        self.directory = directory or None
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # Key -> size on disk, least recently read first
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.lock = threading.Lock()
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self._load_index()
+
+    @staticmethod
+    def _key(bucket, path):
+        return hashlib.sha256(f"{bucket}/{path}".encode("utf-8")).hexdigest()
+
+    def _data_path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _meta_path(self, key):
+        return self._data_path(key) + ".json"
+
+    def _load_index(self):
+        """Rebuild the LRU order from the files left by a previous run, oldest read first"""
+        found = []
+        for parent, _, files in os.walk(self.directory):
+            for name in files:
+                if len(name) == 64:  # Data files are named by their key, metadata files end with .json
+                    stat = os.stat(os.path.join(parent, name))
+                    found.append((stat.st_mtime, name, stat.st_size))
+        for _, key, size in sorted(found):
+            self.entries[key] = size
+            self.current_bytes += size
+        self._evict()
+
+    def _evict(self):
+        while self.current_bytes > self.max_bytes and self.entries:
+            key, size = self.entries.popitem(last=False)
+            self.current_bytes -= size
+            for path in (self._data_path(key), self._meta_path(key)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def _read_mirrored(self, key):
+        try:
+            with open(self._meta_path(key), encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(self._data_path(key), "rb") as f:
+                return f.read(), meta
+        except (OSError, ValueError):
+            return None, None
+
+    def _store(self, key, content, validators):
+        if len(content) > self.max_bytes:
+            return
+        path = self._data_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to temporary files first so that readers never see a partial object
+        for target, data in ((path, content), (self._meta_path(key), json.dumps({**validators, "checked_at": time.time()}).encode("utf-8"))):
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, target)
+            except OSError:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                raise
+        with self.lock:
+            self.current_bytes += len(content) - self.entries.pop(key, 0)
+            self.entries[key] = len(content)
+            self._evict()
+
+    def _touch(self, key, meta=None):
+        """Mark an object as just read, and as just revalidated when given its metadata"""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+        try:
+            os.utime(self._data_path(key))
+            if meta is not None:
+                with open(self._meta_path(key), "w", encoding="utf-8") as f:
+                    json.dump({**meta, "checked_at": time.time()}, f)
+        except OSError:
+            pass
+
+    def read(self, bucket, path):
+        """
+        Get the content of an object, from the mirror when possible
+
+        Args:
+            bucket (str): Bucket name
+            path (str): Object path in the bucket
+
+        Returns:
+            bytes: Content of the object
+
+        Raises:
+            DownloadError: If the object cannot be read from the backend
+        """
+        if not self.directory:
+            return self.backend.fetch(bucket, path)[1]
+
+        key = self._key(bucket, path)
+        content, meta = self._read_mirrored(key) if key in self.entries else (None, None)
+        if content is not None:
+            if time.time() - meta.get("checked_at", 0) <= self.ttl:
+                self._touch(key)
+                with self.lock:
+                    self.hits += 1
+                return content
+            status, fresh, validators = self.backend.fetch(bucket, path, meta)
+            if status == 304:
+                self._touch(key, validators)
+                with self.lock:
+                    self.hits += 1
+                    self.revalidated += 1
+                return content
+        else:
+            status, fresh, validators = self.backend.fetch(bucket, path)
+
+        with self.lock:
+            self.misses += 1
+        try:
+            self._store(key, fresh, validators)
+        except OSError as e:
+            logger.warning("Error mirroring %s/%s: %s", bucket, path, e)
+        return fresh
+
+    def prewarm(self, bucket):
+        """
+        Mirror every object of a bucket
+
+        Args:
+            bucket (str): Bucket name
+
+        Returns:
+            int: Number of objects mirrored
+        """
+        count = 0
+        for path in self.backend.list(bucket):
+            try:
+                self.read(bucket, path)
+                count += 1
+            except DownloadError as e:
+                logger.warning("Error prewarming %s/%s: %s", bucket, path, e)
+        return count
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidated": self.revalidated,
+                "entries": len(self.entries),
+                "bytes": self.current_bytes,
+            }
+
+
+def make_backend():
+    if STORAGE_LOCAL_ROOT:
+        return LocalBackend(STORAGE_LOCAL_ROOT)
+    if SUPABASE_URL:
+        return SupabaseBackend(SUPABASE_URL, SUPABASE_KEY)
+    return None
+
+
+# Mirror shared by the analyses; None when no storage is configured
+storage_mirror = None
+_backend = make_backend()
+if _backend is not None:
+    storage_mirror = StorageMirror(_backend, STORAGE_MIRROR_DIR, int(STORAGE_MIRROR_MAX_MB * 1024 * 1024))
+    if STORAGE_MIRROR_DIR:
+        register_cache("storage_mirror", storage_mirror)
+
+
+@span("storage")
+def read_object(ref):
+    """
+    Get the content of a storage reference
+
+    Args:
+        ref (str): "supabase://<bucket>/<object>" or a public URL of the Supabase project
+
+    Returns:
+        bytes: Content of the object
+    """
+    check_ref(ref)
+    bucket, path = parse_ref(ref)
+    if storage_mirror is None:
+        raise DownloadError(f"No storage configured to read {ref}: set SUPABASE_URL or STORAGE_LOCAL_ROOT")
+    return storage_mirror.read(bucket, path)
+
+def start_prewarm(buckets=None):
+    """
+    Mirror the given buckets (STORAGE_PREWARM_BUCKETS by default) in a background thread
+
+    Returns:
+        threading.Thread: The thread, or None when there is no mirror to warm
+    """
+    if storage_mirror is None or not storage_mirror.directory:
+        return None
+    buckets = STORAGE_PREWARM_BUCKETS if buckets is None else buckets
+
+    def prewarm():
+        for bucket in buckets:
+            start = time.perf_counter()
+            try:
+                count = storage_mirror.prewarm(bucket)
+                logger.info("Mirrored %d objects of bucket %s in %.1fs", count, bucket, time.perf_counter() - start)
+            except Exception as e:
+                logger.warning("Error prewarming bucket %s: %s", bucket, e)
+
+    thread = threading.Thread(target=prewarm, name="storage-prewarm", daemon=True)
+    thread.start()
+    return thread
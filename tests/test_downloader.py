@@ -0,0 +1,77 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import downloader
+from downloader import DownloadError, ValidatorCache
+
+
+@pytest.fixture
+def server():
+    """A file server that answers 304 to conditional GETs, or to every GET once `always_304` is set"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.server.requests.append(dict(self.headers))
+            if self.server.always_304 or self.headers.get("If-None-Match") == '"v1"':
+                self.send_response(304)
+                self.end_headers()
+                return
+            body = b"checklist"
+            self.send_response(200)
+            self.send_header("ETag", '"v1"')
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.daemon_threads = True
+    httpd.requests, httpd.always_304 = [], False
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield httpd, f"http://127.0.0.1:{httpd.server_address[1]}/list.xlsx"
+    httpd.shutdown()
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = ValidatorCache(1024)
+    monkeypatch.setattr(downloader, "validator_cache", cache)
+    return cache
+
+
+def evict(cache, url):
+    """Drop the body of `url` but keep answering its validators, as after an eviction between the two lookups"""
+    validators = cache.validators(url)
+    cache.entries.pop(url)
+    cache.validators = lambda _: validators
+
+
+def test_304_reuses_the_cached_copy(server, cache):
+    httpd, url = server
+    assert downloader.download(url, conditional=True) == b"checklist"
+    assert downloader.download(url, conditional=True) == b"checklist"
+    assert httpd.requests[1]["If-None-Match"] == '"v1"'
+    assert cache.stats()["hits"] == 1
+
+
+def test_304_after_eviction_downloads_again_unconditionally(server, cache):
+    httpd, url = server
+    downloader.download(url, conditional=True)
+    evict(cache, url)
+
+    assert downloader.download(url, conditional=True) == b"checklist"
+    assert len(httpd.requests) == 3
+    assert "If-None-Match" in httpd.requests[1]
+    assert "If-None-Match" not in httpd.requests[2] and "If-Modified-Since" not in httpd.requests[2]
+
+
+def test_304_without_cached_copy_raises_download_error(server, cache):
+    httpd, url = server
+    downloader.download(url, conditional=True)
+    evict(cache, url)
+    httpd.always_304 = True
+
+    with pytest.raises(DownloadError) as error:
+        downloader.download(url, conditional=True)
+    assert error.value.status_code == 304
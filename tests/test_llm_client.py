@@ -0,0 +1,88 @@
+import asyncio
+import itertools
+import pytest
+import llm_client
+from llm_client import LLMError, chat_completion, chat_completion_async
+from benchmarks.stub_openrouter import start_stub_server, DEFAULT_CONTENT
+
+models = (f"stub/retry-{number}" for number in itertools.count())  # Fresh scheduler limits for every test
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    """Stub OpenRouter server, with short backoffs and every retry delay recorded"""
+    server, url = start_stub_server()
+    monkeypatch.setattr(llm_client, "OPENROUTER_BASE_URL", url)
+    monkeypatch.setattr(llm_client, "LLM_BACKOFF_BASE", 0.01)
+    server.delays = []
+    log_retry = llm_client.log_retry
+
+    def record_retry(model, error, delay, attempt):
+        server.delays.append(delay)
+        log_retry(model, error, delay, attempt)
+
+    monkeypatch.setattr(llm_client, "log_retry", record_retry)
+    yield server
+    server.shutdown()
+
+
+def call(mode, model):
+    if mode == "sync":
+        return chat_completion("prompt", model=model, api_key="key")
+    return asyncio.run(chat_completion_async("prompt", model=model, api_key="key"))
+
+
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_retries_retryable_statuses(stub, mode):
+    stub.state.failures = [503, 502]
+    model = next(models)
+
+    assert call(mode, model) == DEFAULT_CONTENT
+    assert len(stub.state.requests) == 3
+    assert len(stub.delays) == 2
+    assert llm_client.LLM_RETRIES.get(model=model) == 2
+
+
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_waits_for_retry_after(stub, mode):
+    stub.state.failures = [429]
+    stub.state.retry_after = 0.2
+
+    assert call(mode, next(models)) == DEFAULT_CONTENT
+    assert len(stub.state.requests) == 2
+    # The requested delay, plus a jitter of at most LLM_BACKOFF_BASE
+    assert 0.2 <= stub.delays[0] <= 0.21
+
+
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_caps_retry_after(stub, mode, monkeypatch):
+    monkeypatch.setattr(llm_client, "LLM_RETRY_AFTER_MAX", 0.05)
+    stub.state.failures = [429]
+    stub.state.retry_after = 3600
+
+    assert call(mode, next(models)) == DEFAULT_CONTENT
+    assert stub.delays[0] <= 0.06
+
+
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_gives_up_after_max_retries(stub, mode):
+    stub.state.failures = [503] * (llm_client.LLM_MAX_RETRIES + 1)
+
+    with pytest.raises(LLMError) as error:
+        call(mode, next(models))
+    assert error.value.status_code == 503
+    assert len(stub.state.requests) == llm_client.LLM_MAX_RETRIES + 1
+
+
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_does_not_retry_client_errors(stub, mode):
+    stub.state.failures = [400]
+    stub.state.retry_after = 0.2
+    model = next(models)
+
+    with pytest.raises(LLMError) as error:
+        call(mode, model)
+    assert error.value.status_code == 400
+    assert len(stub.state.requests) == 1
+    assert stub.delays == []
+    assert llm_client.LLM_RETRIES.get(model=model) == 0
@@ -0,0 +1,64 @@
+import asyncio
+import random
+import pytest
+import llm_client
+import pipeline
+import specialized_only
+from llm_client import CompletionStream, LLMError
+from pdf_text import extract_text
+from benchmarks.stub_openrouter import start_stub_server
+from benchmarks.bench_pipeline import synthetic_pdf, synthetic_checklist
+
+
+@pytest.fixture
+def document():
+    rng = random.Random(2)
+    pdf = synthetic_pdf(4, rng)
+    return pdf, synthetic_checklist(10, rng, extract_text(pdf))
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    # Small chunks, slowly, so that the standard report is still streaming when the specialized one fails
+    server, url = start_stub_server(chunk_size=20, chunk_delay=0.01)
+    monkeypatch.setattr(llm_client, "OPENROUTER_BASE_URL", url)
+    yield server
+    server.shutdown()
+
+
+class FailingStream(CompletionStream):
+    """Stream of the specialized model that fails before its first piece"""
+
+    async def __aiter__(self):
+        raise LLMError("API call failed: Error: 400, bad request", 400)
+        yield
+
+
+def collect(document):
+    async def run():
+        return [event async for event in pipeline.analyze_stream(*document, api_key="key", use_cache=False)]
+    return asyncio.run(run())
+
+
+def test_stream_ends_with_result(stub, document):
+    events = collect(document)
+
+    assert events[-1][0] == "result"
+    assert {data["report"] for event, data in events if event == "token"} == {"specialized", "standard"}
+
+
+def test_specialized_failure_is_sent_at_once_and_standard_keeps_streaming(stub, document, monkeypatch):
+    monkeypatch.setattr(specialized_only, "MODEL", "stub/failing")
+    monkeypatch.setattr(pipeline, "CompletionStream",
+                        lambda prompt, model, **kwargs: (FailingStream if model == "stub/failing" else CompletionStream)(prompt, model, **kwargs))
+
+    events = collect(document)
+    names = [event for event, _ in events]
+
+    error = next(data for event, data in events if event == "error")
+    assert error["stage"] == "specialized"
+    assert error["success"] is False and "400" in error["error"] and "timestamp" in error
+    # Sent as soon as the specialized report failed, with standard tokens still to come
+    assert "token" in names[names.index("error"):]
+    assert all(data["report"] == "standard" for event, data in events if event == "token")
+    assert "result" not in names
@@ -0,0 +1,51 @@
+import json
+import pytest
+from report_parser import parse_structured_report, ReportFormatError
+
+REPORT = {
+    "vendor": "Jean Tremblay",
+    "buyers": "Marie Roy",
+    "date": "2025-04-09",
+    "property_type": "Maison unifamiliale",
+    "overall_score": 85.0,
+    "summary": "Le formulaire est globalement conforme.",
+    "recommended_actions": [
+        {"section": "DV5", "action_required": "Joindre le rapport d'inspection", "priority": "High", "timeline": "Immediate"},
+    ],
+    "warnings": [
+        {"risk_level": "High", "issue": "Rapport manquant", "potential_consequences": "Recours", "mitigation": "L'obtenir"},
+    ],
+}
+
+
+def test_reads_a_complete_report_in_a_code_block():
+    parsed = parse_structured_report(f"```json\n{json.dumps(REPORT)}\n```")
+    assert parsed["overall_score"] == "85"
+    assert parsed["buyers"] == "Marie Roy"
+    assert parsed["recommended_actions"][0]["section"] == "DV5"
+
+
+def test_rejects_an_empty_object():
+    with pytest.raises(ReportFormatError) as error:
+        parse_structured_report("{}")
+    assert error.value.reason == "schema"
+
+
+def test_rejects_a_partial_object():
+    partial = {key: REPORT[key] for key in ("vendor", "buyers", "summary")}
+    with pytest.raises(ReportFormatError) as error:
+        parse_structured_report(json.dumps(partial))
+    assert error.value.reason == "schema"
+    assert "overall_score" in str(error.value)
+
+
+def test_rejects_wrong_typed_actions():
+    with pytest.raises(ReportFormatError) as error:
+        parse_structured_report(json.dumps({**REPORT, "recommended_actions": "Joindre le rapport"}))
+    assert error.value.reason == "schema"
+
+
+def test_rejects_text_that_is_not_json():
+    with pytest.raises(ReportFormatError) as error:
+        parse_structured_report("# RAPPORT D'ANALYSE")
+    assert error.value.reason == "invalid_json"
@@ -0,0 +1,82 @@
+import os
+import pytest
+import storage
+from storage import LocalBackend, StorageMirror, StorageRefError, check_ref
+
+
+@pytest.fixture
+def buckets(tmp_path):
+    """A local root holding the allowed buckets and a private one"""
+    root = tmp_path / "root"
+    for bucket in ("documents", "compliance-files", "private"):
+        (root / bucket).mkdir(parents=True)
+    return root
+
+
+def write(root, bucket, name, size):
+    path = root / bucket / name
+    path.write_bytes(b"x" * size)
+    return path
+
+
+def test_check_ref_rejects_buckets_outside_the_allowlist():
+    check_ref("supabase://documents/a.pdf")
+    check_ref("supabase://compliance-files/list.xlsx")
+    check_ref("https://example.com/a.pdf")  # Not a storage reference
+    with pytest.raises(StorageRefError) as error:
+        check_ref("supabase://private/secret.pdf")
+    assert error.value.status_code == 400
+
+
+def test_read_object_rejects_before_reading(buckets, monkeypatch):
+    write(buckets, "private", "secret.pdf", 10)
+    monkeypatch.setattr(storage, "storage_mirror", StorageMirror(LocalBackend(str(buckets))))
+    with pytest.raises(StorageRefError):
+        storage.read_object("supabase://private/secret.pdf")
+    with pytest.raises(StorageRefError):
+        storage.read_object("supabase://documents/../private/secret.pdf")
+
+
+def test_analyze_answers_400_to_a_private_bucket():
+    from fastapi.testclient import TestClient
+    from api import app
+
+    response = TestClient(app).post("/analyze", json={
+        "pdf_content": "supabase://private/secret.pdf",
+        "checklist_content": "supabase://compliance-files/list.xlsx",
+    })
+    assert response.status_code == 400
+    assert "private" in response.json()["detail"]
+
+
+def test_mirror_evicts_least_recently_read(buckets, tmp_path):
+    for name in ("a", "b", "c"):
+        write(buckets, "documents", name, 100)
+    mirror = StorageMirror(LocalBackend(str(buckets)), str(tmp_path / "mirror"), max_bytes=250)
+
+    mirror.read("documents", "a")
+    mirror.read("documents", "b")
+    mirror.read("documents", "a")  # b is now the least recently read
+    mirror.read("documents", "c")
+
+    assert list(mirror.entries) == [mirror._key("documents", "a"), mirror._key("documents", "c")]
+    assert mirror.stats()["bytes"] == 200
+    assert not os.path.exists(mirror._data_path(mirror._key("documents", "b")))
+
+    mirror.read("documents", "a")
+    mirror.read("documents", "b")
+    assert mirror.stats()["hits"] == 2
+    assert mirror.stats()["misses"] == 4
+
+
+def test_mirror_keeps_its_order_across_restarts(buckets, tmp_path):
+    for name in ("a", "b"):
+        write(buckets, "documents", name, 100)
+    directory = str(tmp_path / "mirror")
+    mirror = StorageMirror(LocalBackend(str(buckets)), directory, max_bytes=250)
+    mirror.read("documents", "a")
+    mirror.read("documents", "b")
+    os.utime(mirror._data_path(mirror._key("documents", "a")), (1, 1))
+
+    reopened = StorageMirror(LocalBackend(str(buckets)), directory, max_bytes=150)
+    assert list(reopened.entries) == [mirror._key("documents", "b")]
@@ -0,0 +1,30 @@
+import pytest
+from triage import TriageReport, TriageError, check_text
+from fanout import segment_text
+
+FILLER = "le vendeur déclare que l'immeuble est conforme et que les renseignements sont exacts. " * 3
+
+
+def form_text(heading):
+    return " ".join(f"{heading.format(number)} {FILLER}" for number in range(1, 16))
+
+
+def check(text):
+    return check_text(TriageReport(pdf_bytes=len(text), pages=1), text)
+
+
+@pytest.mark.parametrize("heading", ["dv{}", "dv {}", "d{}", "d.{}"])
+def test_accepts_every_heading_style(heading):
+    report = check(form_text(heading))
+    assert report.accepted
+    assert report.dv_sections == list(range(1, 16))
+
+
+def test_fanout_splits_at_the_same_headings():
+    assert sorted(segment_text(form_text("d{}"))) == list(range(1, 16))
+
+
+def test_rejects_text_without_sections():
+    with pytest.raises(TriageError) as error:
+        check(FILLER * 5)
+    assert error.value.report.reason == "not_dv_form"
@@ -0,0 +1,122 @@
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+# Sums of cached widths this close to the line width are checked by measuring the whole line,
+# since adding widths can round differently than measuring the joined text
+BOUNDARY_EPSILON = 1e-6
+
+
+class TextLayout:
+    """
+    Word-wrapping of text in one font and size, measuring each distinct word once.
+
+    A line is filled with words while the sum of their widths and of the spaces
+    between them fits `max_width`, so wrapping takes time linear in the text.
+    Words wider than a line are broken across lines.
+    """
+
+    def __init__(self, max_width, font_name="Helvetica", font_size=11):
+        self.max_width = max_width
+        self.font_name = font_name
+        self.font_size = font_size
+        self.space_width = stringWidth(" ", font_name, font_size)
+        self.widths = {}
+
+    def measure(self, text):
+        """Width of a word or character, from the cache"""
+        width = self.widths.get(text)
+        if width is None:
+            width = self.widths[text] = stringWidth(text, self.font_name, self.font_size)
+        return width
+
+    def fits(self, words, word, width):
+        """
+        Whether the words of a line and one more word, of summed width `width`, fit the line width
+
+        The line is only joined and measured at the boundary, so a word costs the
+        same whatever the length of the line.
+        """
+        if abs(width - self.max_width) > BOUNDARY_EPSILON:
+            return width <= self.max_width
+        return stringWidth(" ".join(words + [word]), self.font_name, self.font_size) <= self.max_width
+
+    def break_word(self, word):
+        """Split a word wider than a line into pieces that fit, the last one possibly shorter"""
+        pieces = []
+        start = 0
+        width = 0.0
+        for index, char in enumerate(word):
+            char_width = self.measure(char)
+            if index > start and width + char_width > self.max_width:
+                pieces.append(word[start:index])
+                start = index
+                width = 0.0
+            width += char_width
+        pieces.append(word[start:])
+        return pieces
+
+    def wrap_line(self, line):
+        """
+        Wrap one line of text
+
+        Args:
+            line (str): Text without line breaks; runs of whitespace separate words
+
+        Returns:
+            list: The wrapped lines, words separated by one space
+        """
+        lines = []
+        current = []
+        current_width = 0.0
+        for word in line.split():
+            word_width = self.measure(word)
+            if current and self.fits(current, word, current_width + self.space_width + word_width):
+                current.append(word)
+                current_width += self.space_width + word_width
+                continue
+
+            if current:
+                lines.append(" ".join(current))
+            if word_width > self.max_width:
+                *full, word = self.break_word(word)
+                lines.extend(full)
+                word_width = self.measure(word)
+            current = [word]
+            current_width = word_width
+
+        if current:
+            lines.append(" ".join(current))
+        return lines
+
+    def wrap(self, text):
+        """Wrap a text, yielding its lines one at a time"""
+        for raw_line in text.split("\n"):
+            yield from self.wrap_line(raw_line)
+
+
+def lines_per_page(height, y_margin, leading):
+    """Number of lines drawn on a page, from the top margin down to the bottom one"""
+    count = 0
+    y = height - y_margin
+    while not y < y_margin:
+        count += 1
+        y -= leading
+    return max(count, 1)
+
+def iter_pages(lines, per_page):
+    """
+    Group lines into pages as they are produced
+
+    Args:
+        lines (iterable): The wrapped lines
+        per_page (int): Lines on each page
+
+    Yields:
+        list: The lines of each page; one empty page for a text without lines
+    """
+    page = []
+    for line in lines:
+        if len(page) == per_page:
+            yield page
+            page = []
+        page.append(line)
+    yield page
@@ -0,0 +1,146 @@
+import os
+import re
+import time
+import logging
+from dataclasses import dataclass, field, asdict
+from typing import Optional
+from pdf_text import open_pdf
+from observability import span, TRIAGE_REJECTIONS
+
+logger = logging.getLogger(__name__)
+
+# Limits checked before any AI call; 0 disables a check
+TRIAGE_MAX_PDF_MB = float(os.getenv("TRIAGE_MAX_PDF_MB", "50"))                  # Largest PDF accepted
+TRIAGE_MAX_PAGES = int(os.getenv("TRIAGE_MAX_PAGES", "500"))                      # Most pages accepted
+TRIAGE_MIN_CHARS_PER_PAGE = float(os.getenv("TRIAGE_MIN_CHARS_PER_PAGE", "100"))  # Below this, the PDF is a scan without text layer
+TRIAGE_MIN_LETTER_RATIO = float(os.getenv("TRIAGE_MIN_LETTER_RATIO", "0.5"))      # Below this, the text layer is garbage
+TRIAGE_MIN_DV_SECTIONS = int(os.getenv("TRIAGE_MIN_DV_SECTIONS", "3"))            # Distinct DV1-DV16 markers a DV form has
+
+DV_SECTION_COUNT = 16
+# Headings of the DV sections in the normalized (lower-cased) text: "dv1", "dv 12", "dv5.3",
+# and "d15" or "d.5" as many forms write them; fanout.py splits the text at the same markers
+DV_SECTION_MARKER_RE = re.compile(r"\bd\.? ?v? ?(\d{1,2})\b")
+
+
+@dataclass
+class TriageReport:
+    """
+    What triage found out about a PDF, cheaply and before any AI call
+
+    Attributes:
+        pdf_bytes (int): Size of the file
+        pages (int): Number of pages, None if the file could not be opened
+        text_chars (int): Length of the extracted text
+        chars_per_page (float): Text layer density
+        letter_ratio (float): Share of letters among the non-space characters of the text
+        dv_sections (list): DV section numbers found in the text
+        accepted (bool): Whether the PDF goes on to the analyzers
+        reason (str): Why it was rejected: too_large, corrupt, encrypted, empty, too_many_pages,
+            no_text_layer, unreadable_text or not_dv_form
+        elapsed_ms (float): Time spent on triage, text extraction excluded
+    """
+    pdf_bytes: int
+    pages: Optional[int] = None
+    text_chars: Optional[int] = None
+    chars_per_page: Optional[float] = None
+    letter_ratio: Optional[float] = None
+    dv_sections: list = field(default_factory=list)
+    accepted: bool = True
+    reason: Optional[str] = None
+    elapsed_ms: float = 0.0
+
+    def to_dict(self):
+        return asdict(self)
+
+
+class TriageError(Exception):
+    """Raised when a PDF is rejected by triage, carrying the triage report"""
+
+    def __init__(self, message, report):
+        super().__init__(message)
+        self.report = report
+
+    def to_detail(self):
+        """Error detail returned by the API"""
+        return {"reason": self.report.reason, "message": str(self), "triage": self.report.to_dict()}
+
+
+def reject(report, reason, message, start):
+    report.accepted = False
+    report.reason = reason
+    report.elapsed_ms = round((time.perf_counter() - start) * 1000, 2)
+    TRIAGE_REJECTIONS.inc(reason=reason)
+    logger.info("PDF rejected by triage (%s): %s", reason, message, extra={"reason": reason})
+    raise TriageError(message, report)
+
+@span("triage")
+def inspect_pdf(pdf_bytes):
+    """
+    Check the size and structure of a PDF, before its text is extracted
+
+    Args:
+        pdf_bytes (bytes): PDF content
+
+    Returns:
+        TriageReport: The report, to be completed by check_text
+
+    Raises:
+        TriageError: If the PDF is too large, corrupt, encrypted, empty or has too many pages
+    """
+    start = time.perf_counter()
+    report = TriageReport(pdf_bytes=len(pdf_bytes))
+
+    if TRIAGE_MAX_PDF_MB and len(pdf_bytes) > TRIAGE_MAX_PDF_MB * 1024 * 1024:
+        reject(report, "too_large", f"PDF of {len(pdf_bytes) / 1024 / 1024:.1f} MB, the limit is {TRIAGE_MAX_PDF_MB:g} MB", start)
+
+    try:
+        with open_pdf(pdf_bytes) as doc:
+            encrypted = doc.needs_pass
+            report.pages = doc.page_count
+    except Exception as e:
+        reject(report, "corrupt", f"The file is not a readable PDF: {str(e)}", start)
+
+    if encrypted:
+        reject(report, "encrypted", "The PDF is password protected", start)
+    if report.pages == 0:
+        reject(report, "empty", "The PDF has no pages", start)
+    if TRIAGE_MAX_PAGES and report.pages > TRIAGE_MAX_PAGES:
+        reject(report, "too_many_pages", f"PDF of {report.pages} pages, the limit is {TRIAGE_MAX_PAGES}", start)
+
+    report.elapsed_ms = round((time.perf_counter() - start) * 1000, 2)
+    return report
+
+@span("triage")
+def check_text(report, pdf_text):
+    """
+    Check that the extracted text is worth analyzing: dense enough, readable, from a DV form
+
+    Args:
+        report (TriageReport): Report from inspect_pdf, completed in place
+        pdf_text (str): Normalized text of the PDF
+
+    Returns:
+        TriageReport: The completed report of an accepted PDF
+
+    Raises:
+        TriageError: If the PDF has no text layer, an unreadable one, or is not a DV form
+    """
+    start = time.perf_counter() - report.elapsed_ms / 1000
+    report.text_chars = len(pdf_text)
+    report.chars_per_page = round(len(pdf_text) / report.pages, 1)
+
+    if TRIAGE_MIN_CHARS_PER_PAGE and report.chars_per_page < TRIAGE_MIN_CHARS_PER_PAGE:
+        reject(report, "no_text_layer", "The PDF has little or no text layer, it is probably a scan: run OCR on it first", start)
+
+    characters = pdf_text.replace(" ", "")
+    report.letter_ratio = round(sum(1 for char in characters if char.isalpha()) / (len(characters) or 1), 3)
+    if TRIAGE_MIN_LETTER_RATIO and report.letter_ratio < TRIAGE_MIN_LETTER_RATIO:
+        reject(report, "unreadable_text", "The text layer of the PDF is not readable text", start)
+
+    sections = {int(number) for number in DV_SECTION_MARKER_RE.findall(pdf_text)}
+    report.dv_sections = sorted(number for number in sections if 1 <= number <= DV_SECTION_COUNT)
+    if TRIAGE_MIN_DV_SECTIONS and len(report.dv_sections) < TRIAGE_MIN_DV_SECTIONS:
+        reject(report, "not_dv_form", f"The PDF does not look like a DV form: {len(report.dv_sections)} of the DV1-DV{DV_SECTION_COUNT} sections found", start)
+
+    report.elapsed_ms = round((time.perf_counter() - start) * 1000, 2)
+    return report
@@ -1,6 +1,9 @@
-from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-import requests
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+import asyncio
+import httpx
 import os
 from dotenv import load_dotenv
 
@@ -19,69 +22,118 @@ app.add_middleware(
 )
 
 # URL of your full API hosted elsewhere (could be a cloud VM, Heroku, etc.)
-PROCESSING_API_URL = os.getenv("PROCESSING_API_URL", "https://oaciq-python-api-production.up.railway.app")
+PROCESSING_API_URL = os.getenv("PROCESSING_API_URL", "https://oaciq-python-api-production.up.railway.app").rstrip("/")
 
-@app.post("/analyze")
-async def analyze_document(request: Request):
+PROXY_CONNECT_TIMEOUT = float(os.getenv("PROXY_CONNECT_TIMEOUT", "5"))  # Seconds to open a connection to the full API
+PROXY_READ_TIMEOUT = float(os.getenv("PROXY_READ_TIMEOUT", "300"))      # Seconds without receiving data from the full API
+PROXY_WRITE_TIMEOUT = float(os.getenv("PROXY_WRITE_TIMEOUT", "60"))     # Seconds without being able to send it data
+PROXY_POOL_SIZE = int(os.getenv("PROXY_POOL_SIZE", "20"))               # Keep-alive connections kept open to it
+
+# Headers that describe one connection rather than the message, never forwarded (RFC 9110 section 7.6.1)
+HOP_BY_HOP_HEADERS = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "proxy-connection",
+    "te",
+    "trailer",
+    "transfer-encoding",
+    "upgrade",
+    "host",  # Set by the client for the full API
+}
+
+# Endpoints of the full API reachable through the proxy, with their methods
+PROXIED_ROUTES = [
+    ("/analyze", ["POST"]),
+    ("/analyze/stream", ["POST"]),
+    ("/analyze/batch", ["POST"]),
+    ("/convert", ["POST"]),
+    ("/jobs", ["POST"]),
+    ("/jobs/{job_id}", ["GET"]),
+    ("/jobs/{job_id}/events", ["GET"]),
+]
+
+_clients = {}
+
+
+def get_client():
     """
-    Proxy endpoint that forwards requests to the full API implementation
+    Get the pooled client to the full API of the running event loop
+
+    Returns:
+        httpx.AsyncClient: The pooled keep-alive client
     """
-    try:
-        # Get the raw request body
-        body = await request.json()
-        
-        # Forward the request to the full API
-        response = requests.post(f"{PROCESSING_API_URL}/analyze", json=body)
-        
-        # Check if the request was successful
-        if response.status_code != 200:
-            raise HTTPException(status_code=response.status_code, detail=response.text)
-        
-        # Return the response from the full API
-        return response.json()
-        
-    except Exception as e:
-        # Handle errors
-        raise HTTPException(status_code=500, detail=str(e))
-
-@app.post("/convert")
-async def convert_text_to_pdf(request: Request):
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            base_url=PROCESSING_API_URL,
+            timeout=httpx.Timeout(PROXY_READ_TIMEOUT, connect=PROXY_CONNECT_TIMEOUT, write=PROXY_WRITE_TIMEOUT),
+            limits=httpx.Limits(max_connections=PROXY_POOL_SIZE, max_keepalive_connections=PROXY_POOL_SIZE),
+        )
+        _clients[loop] = client
+    return client
+
+def filter_headers(headers):
+    """
+    Drop the hop-by-hop headers of a message, including those named by its Connection header
+
+    Args:
+        headers (list): (name, value) pairs of the incoming request or of the upstream response,
+            repeated headers listed once per value
+
+    Returns:
+        list: The (name, value) pairs to forward
     """
-    Proxy endpoint that forwards requests to the full API implementation
+    excluded = set(HOP_BY_HOP_HEADERS)
+    for name, value in headers:
+        if name.lower() == "connection":
+            excluded.update(option.strip().lower() for option in value.split(","))
+    return [(name, value) for name, value in headers if name.lower() not in excluded]
+
+async def proxy(request: Request):
+    """
+    Forward a request to the full API, streaming the bodies both ways
+
+    The request body is sent upstream as it is received and the response is
+    relayed as it arrives (Server-Sent Events and NDJSON included), so the
+    proxy holds only one chunk of each in memory.
     """
+    client = get_client()
+    upstream_request = client.build_request(
+        request.method,
+        request.url.path,
+        params=request.query_params,
+        headers=filter_headers(request.headers.items()),
+        content=request.stream() if request.method in ("POST", "PUT", "PATCH") else None,
+    )
     try:
-        # Get the raw request body
-        body = await request.body()
-        
-        # Get the content type
-        content_type = request.headers.get("content-type", "")
-        
-        # Forward the request to the full API
-        response = requests.post(
-            f"{PROCESSING_API_URL}/convert", 
-            data=body,
-            headers={"Content-Type": content_type}
-        )
-        
-        # Check if the request was successful
-        if response.status_code != 200:
-            raise HTTPException(status_code=response.status_code, detail=response.text)
-        
-        # Return the response from the full API
-        return Response(
-            content=response.content,
-            media_type=response.headers.get("Content-Type", "application/pdf"),
-            headers=dict(response.headers)
-        )
-        
-    except Exception as e:
-        # Handle errors
-        raise HTTPException(status_code=500, detail=str(e))
+        upstream = await client.send(upstream_request, stream=True)
+    except httpx.TimeoutException as e:
+        raise HTTPException(status_code=504, detail=f"Processing API timed out: {type(e).__name__}")
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Processing API unreachable: {str(e)}")
+
+    response = StreamingResponse(upstream.aiter_raw(), status_code=upstream.status_code, background=BackgroundTask(upstream.aclose))
+    # The body is relayed as received, so Content-Length and Content-Encoding still apply to it;
+    # set as raw headers to keep repeated ones like Set-Cookie
+    response.raw_headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in filter_headers(upstream.headers.multi_items())]
+    return response
+
+for path, methods in PROXIED_ROUTES:
+    app.add_api_route(path, proxy, methods=methods, include_in_schema=False)
 
 @app.get("/health")
 async def health_check():
     """Simple health check endpoint"""
     return {"status": "ok", "vercel": True, "api_url": PROCESSING_API_URL}
 
+@app.on_event("shutdown")
+async def close_client():
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
 # This is required for Vercel deployment
-# The app object needs to be directly accessible at the module level 
\ No newline at end of file
+# The app object needs to be directly accessible at the module level
\ No newline at end of file